@@ -1,31 +1,179 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import (Flask, Response, abort, flash, g, jsonify, redirect, render_template, request,
+                   stream_template, stream_with_context, url_for)
 import sqlite3
 from pathlib import Path
 
+import ar_aging
+import clinic_time
+import db
+import http_cache
+import pagination
+import patient_chart
+import patient_search
+import query_cache
+import query_metrics
+import queries
+import reports
+import scheduling
+import schema_version
+import snapshot
+
 APP_DIR = Path(__file__).parent
 DB_PATH = APP_DIR / 'hospital.db'
 
 app = Flask(__name__)
 app.secret_key = 'dev-secret'
 
+# compile the catalog's reads once per pooled connection
+db.on_connect(queries.prepare)
+
+_schema_checked = set()
+
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA foreign_keys = ON;')
-    return conn
+    """Return the pooled connection bound to the current app context."""
+    if 'db' not in g:
+        if DB_PATH not in _schema_checked:
+            schema_version.ensure(DB_PATH, background_backfills=True)
+            _schema_checked.add(DB_PATH)
+        g.db = db.get_pool(DB_PATH).acquire()
+    return g.db
+
+
+def get_report_connection():
+    """Connection for report queries: the report snapshot if enabled, else the live pool."""
+    snap = snapshot.get_snapshot(DB_PATH)
+    if not snap.enabled:
+        return get_db_connection()
+    if 'report_db' not in g:
+        g.report_db = snap.connect()
+    return g.report_db
+
+
+def execute_write(name, **params):
+    """Run catalog statement ``name`` on the single writer thread; returns rowcount."""
+    return db.get_writer(DB_PATH).run(lambda conn: queries.execute(conn, name, **params).rowcount)
+
+
+def tables_validator(query):
+    """Conditional-GET validator: the versions of the tables catalog entry ``query`` reads."""
+    tables = queries.get(query).tables
+    return lambda **view_args: query_cache.QueryCache.table_versions(get_db_connection(), tables)
+
+
+def chart_validator(patient_id):
+    try:
+        return tuple(get_db_connection().execute(patient_chart.SQL_VERSIONS, (patient_id,)).fetchone())
+    except sqlite3.OperationalError:
+        return None  # not migrated yet
+
+
+def report_validator(name=None, tables=None):
+    """Conditional-GET validator of a report: its tables' versions, or the snapshot it reads."""
+    def validator(**view_args):
+        snap = snapshot.get_snapshot(DB_PATH)
+        if snap.enabled:
+            age = snap.age()
+            # a snapshot due for a refresh is read (and the refresh started) by the view
+            return None if age is None or age > snap.refresh else ('snapshot', snap.info().taken_at)
+        report = name or view_args['name']
+        if tables is not None:
+            return query_cache.QueryCache.table_versions(get_db_connection(), tables)
+        if report not in reports.REPORTS:
+            return None
+        try:
+            query, _ = reports.resolve(report, request.args)
+        except ValueError:
+            return None
+        return query_cache.QueryCache.table_versions(get_db_connection(), queries.get(query).tables)
+    return validator
+
+
+@app.before_request
+def tag_sql_caller():
+    query_metrics.set_caller('web:' + (request.endpoint or 'unknown'))
+
+
+@app.after_request
+def compress_response(response):
+    return http_cache.compress(response)
+
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    for name in ('db', 'report_db'):
+        conn = g.pop(name, None)
+        if conn is not None:
+            conn.close()
+
+
+@app.route('/health/db')
+def db_health():
+    """Connection pool statistics (checkouts, hits, waits, ...)"""
+    return jsonify(db.get_pool(DB_PATH).stats())
+
+
+@app.route('/health/cache')
+def cache_health():
+    """Query cache statistics (hits, misses, evictions, invalidations, ...)"""
+    return jsonify(query_cache.get_cache().stats())
+
+
+@app.route('/health/snapshot')
+def snapshot_health():
+    """Report snapshot mode, age and refresh counters"""
+    return jsonify(snapshot.get_snapshot(DB_PATH).stats())
+
+
+@app.route('/health/http-cache')
+def http_cache_health():
+    """304s served, pages validated and compression savings"""
+    return jsonify(http_cache.stats())
+
+
+@app.route('/health/slow-queries')
+def slow_queries():
+    """Most recent slow statements with their query plans"""
+    return jsonify(query_metrics.get_stats().slow_queries())
+
+
+@app.route('/metrics')
+def metrics():
+    """Per-statement SQL metrics plus pool and cache stats in Prometheus text format"""
+    body = (query_metrics.render_prometheus()
+            + query_metrics.render_gauges('hospital_db_pool', db.get_pool(DB_PATH).stats(), 'Connection pool')
+            + query_metrics.render_gauges('hospital_query_cache', query_cache.get_cache().stats(), 'Query cache')
+            + query_metrics.render_gauges('hospital_chart_cache', patient_chart.get_cache(DB_PATH).stats(), 'Patient chart cache'))
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/patients')
+@http_cache.conditional(tables_validator('patients.list'))
 def patients():
+    """Patients, keyset-paginated on (last_name, first_name, patient_id); ?q= searches instead"""
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM patients ORDER BY last_name, first_name')
-    rows = cur.fetchall()
-    conn.close()
-    return render_template('patients.html', patients=rows)
+    q = request.args.get('q', '').strip()
+    if q:
+        found = patient_search.search(conn, q, patient_search.MAX_LIMIT)
+        return render_template('patients.html', patients=found, page=None, q=q)
+    try:
+        page = queries.page(conn, 'patients.list', after=request.args.get('after'), before=request.args.get('before'),
+                            limit=pagination.clamp_limit(request.args.get('limit')))
+    except ValueError:
+        flash('Invalid page cursor, showing the first page', 'warning')
+        return redirect(url_for('patients'))
+    return render_template('patients.html', patients=page.rows, page=page, page_sizes=pagination.PAGE_SIZES, q='')
+
+
+@app.route('/api/patients/search')
+def api_patient_search():
+    """Typeahead: patients whose name, phone, email or insurance words start with ?q= words"""
+    limit = request.args.get('limit', patient_search.DEFAULT_LIMIT, type=int)
+    rows = patient_search.search(get_db_connection(), request.args.get('q', ''), limit)
+    return jsonify(q=request.args.get('q', ''), patients=[dict(r) for r in rows])
 
 @app.route('/patients/add', methods=('GET', 'POST'))
 def add_patient():
@@ -38,177 +186,266 @@ def add_patient():
         address = request.form['address']
         insurance = request.form['insurance']
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('INSERT INTO patients (first_name, last_name, dob, phone, email, address, insurance) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                    (first, last, dob, phone, email, address, insurance))
-        conn.commit()
-        conn.close()
+        execute_write('patients.insert', first_name=first, last_name=last, dob=dob, phone=phone, email=email,
+                      address=address, insurance=insurance)
         flash('Patient added successfully', 'success')
         return redirect(url_for('patients'))
 
     return render_template('add_patient.html')
 
 @app.route('/appointments')
+@http_cache.conditional(tables_validator('appointments.list'))
 def appointments():
+    """Appointments, keyset-paginated on (appointment_datetime, appointment_id)"""
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT a.appointment_id, a.appointment_datetime, a.status, a.reason,
-               p.patient_id, p.first_name AS patient_first, p.last_name AS patient_last,
-               d.doctor_id, d.first_name AS doctor_first, d.last_name AS doctor_last
-        FROM appointments a
-        JOIN patients p ON a.patient_id = p.patient_id
-        JOIN doctors d ON a.doctor_id = d.doctor_id
-        ORDER BY a.appointment_datetime
-    ''')
-    rows = cur.fetchall()
-    conn.close()
-    return render_template('appointments.html', appointments=rows)
+    try:
+        page = queries.page(conn, 'appointments.list', after=request.args.get('after'),
+                            before=request.args.get('before'), limit=pagination.clamp_limit(request.args.get('limit')))
+    except ValueError:
+        flash('Invalid page cursor, showing the first page', 'warning')
+        return redirect(url_for('appointments'))
+    return render_template('appointments.html', appointments=page.rows, page=page, page_sizes=pagination.PAGE_SIZES)
 
 @app.route('/appointments/schedule', methods=('GET', 'POST'))
 def schedule_appointment():
+    """Book an appointment; the slot engine rejects double bookings"""
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT doctor_id, first_name, last_name FROM doctors')
-    doctors = cur.fetchall()
-    cur.execute('SELECT patient_id, first_name, last_name FROM patients')
-    patients = cur.fetchall()
+    doctors = query_cache.get_cache().fetch(conn, 'doctors.choices')
+    form = request.form if request.method == 'POST' else request.args
+    doctor_id = form.get('doctor_id', type=int) or (doctors[0].doctor_id if doctors else None)
+    slots = scheduling.get_index(DB_PATH)
 
     if request.method == 'POST':
-        patient_id = request.form['patient_id']
-        doctor_id = request.form['doctor_id']
-        appointment_datetime = request.form['appointment_datetime']
-        reason = request.form['reason']
-
-        cur.execute('INSERT INTO appointments (patient_id, doctor_id, appointment_datetime, reason) VALUES (?, ?, ?, ?)',
-                    (patient_id, doctor_id, appointment_datetime, reason))
-        conn.commit()
-        conn.close()
-        flash('Appointment scheduled', 'success')
-        return redirect(url_for('appointments'))
+        try:
+            appointment_datetime = clinic_time.normalize_datetime(form['appointment_datetime'])
+        except ValueError:
+            flash('Invalid date/time, expected YYYY-MM-DD HH:MM', 'danger')
+        else:
+            try:
+                book_appointment(form.get('patient_id', type=int), doctor_id, appointment_datetime, form.get('reason', ''))
+            except scheduling.SlotTaken as e:
+                flash(f'The doctor is already booked at {e.conflict}. Next free: {", ".join(e.next_free) or "none"}', 'danger')
+            except scheduling.SlotUnavailable as e:
+                flash(f'{e}. Next free: {", ".join(e.next_free) or "none"}', 'danger')
+            except (LookupError, sqlite3.IntegrityError):
+                flash('Unknown patient or doctor', 'danger')
+            else:
+                flash('Appointment scheduled', 'success')
+                return redirect(url_for('appointments'))
 
-    conn.close()
-    return render_template('schedule.html', doctors=doctors, patients=patients)
+    free_slots = slots.next_free(conn, doctor_id) if doctor_id else []
+    return render_template('schedule.html', doctors=doctors, doctor_id=doctor_id, free_slots=free_slots, form=form)
+
+
+def book_appointment(patient_id, doctor_id, appointment_datetime, reason=''):
+    """Check the slot and insert on the writer thread, in one transaction; returns the new id."""
+    return db.get_writer(DB_PATH).run(scheduling.get_index(DB_PATH).book, patient_id, doctor_id,
+                                      appointment_datetime, reason)
+
+
+def _slot_query_args():
+    """(count, after) from the query string of the slot API; ValueError if malformed."""
+    count = max(1, min(request.args.get('count', scheduling.DEFAULT_COUNT, type=int), scheduling.MAX_COUNT))
+    after = request.args.get('after')
+    return count, clinic_time.normalize_datetime(after) if after else None
+
+
+def _doctor_exists(conn, doctor_id):
+    return queries.fetch_one(conn, 'doctors.exists', doctor_id=doctor_id) is not None
+
+
+@app.route('/api/doctors/<int:doctor_id>/slots')
+def api_doctor_slots(doctor_id):
+    """Next free slots of one doctor (?count=10&after=YYYY-MM-DD HH:MM)"""
+    conn = get_db_connection()
+    if not _doctor_exists(conn, doctor_id):
+        return jsonify(error='doctor not found'), 404
+    try:
+        count, after = _slot_query_args()
+    except ValueError:
+        return jsonify(error='after: expected YYYY-MM-DD HH:MM'), 400
+    return jsonify(doctor_id=doctor_id, slot_minutes=scheduling.SLOT_MINUTES,
+                   slots=scheduling.get_index(DB_PATH).next_free(conn, doctor_id, count, after))
+
+
+@app.route('/api/doctors/<int:doctor_id>/slots/check')
+def api_check_slot(doctor_id):
+    """Whether ?datetime= is free for the doctor, and what it overlaps if not"""
+    conn = get_db_connection()
+    if not _doctor_exists(conn, doctor_id):
+        return jsonify(error='doctor not found'), 404
+    try:
+        when = clinic_time.normalize_datetime(request.args.get('datetime'))
+    except ValueError:
+        return jsonify(error='datetime: expected YYYY-MM-DD HH:MM'), 400
+    conflict = scheduling.get_index(DB_PATH).conflict(conn, doctor_id, when)
+    return jsonify(doctor_id=doctor_id, datetime=when, free=conflict is None, conflict=conflict)
+
+
+@app.route('/api/departments/<int:department_id>/slots')
+def api_department_slots(department_id):
+    """Next free slots across all doctors of a department"""
+    conn = get_db_connection()
+    try:
+        count, after = _slot_query_args()
+    except ValueError:
+        return jsonify(error='after: expected YYYY-MM-DD HH:MM'), 400
+    slots = scheduling.get_index(DB_PATH).next_free_in_department(conn, department_id, count, after)
+    return jsonify(department_id=department_id, slot_minutes=scheduling.SLOT_MINUTES,
+                   slots=[{'datetime': when, 'doctor_id': doctor_id} for when, doctor_id in slots])
+
+
+@app.route('/api/appointments', methods=('POST',))
+def api_schedule_appointment():
+    """Book an appointment from JSON {patient_id, doctor_id, appointment_datetime, reason}; 409 if not bookable"""
+    data = request.get_json(silent=True) or request.form
+    try:
+        patient_id, doctor_id = int(data['patient_id']), int(data['doctor_id'])
+        appointment_datetime = clinic_time.normalize_datetime(data['appointment_datetime'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error='patient_id, doctor_id and appointment_datetime (YYYY-MM-DD HH:MM) are required'), 400
+    try:
+        appointment_id = book_appointment(patient_id, doctor_id, appointment_datetime, data.get('reason') or '')
+    except scheduling.SlotTaken as e:
+        return jsonify(error='slot taken', conflict=e.conflict, next_free=e.next_free), 409
+    except scheduling.SlotUnavailable as e:
+        return jsonify(error='slot unavailable', reason=e.reason, next_free=e.next_free), 409
+    except LookupError:
+        return jsonify(error='doctor not found'), 404
+    except sqlite3.IntegrityError:
+        return jsonify(error='patient not found'), 400
+    return jsonify(appointment_id=appointment_id, patient_id=patient_id, doctor_id=doctor_id,
+                   appointment_datetime=appointment_datetime), 201
 
 @app.route('/patient/<int:patient_id>')
+@http_cache.conditional(chart_validator)
 def patient_history(patient_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM patients WHERE patient_id = ?', (patient_id,))
-    patient = cur.fetchone()
-
-    cur.execute('''
-        SELECT v.visit_id, v.visit_date, v.diagnosis, v.notes, d.first_name AS doctor_first, d.last_name AS doctor_last
-        FROM visits v JOIN doctors d ON v.doctor_id = d.doctor_id
-        WHERE v.patient_id = ?
-        ORDER BY v.visit_date DESC
-    ''', (patient_id,))
-    visits = cur.fetchall()
-
-    cur.execute('''
-        SELECT p.prescription_id, p.medication, p.dosage, p.frequency, p.duration, p.prescribed_at
-        FROM prescriptions p JOIN visits v ON p.visit_id = v.visit_id
-        WHERE v.patient_id = ?
-        ORDER BY p.prescribed_at DESC
-    ''', (patient_id,))
-    prescriptions = cur.fetchall()
-
-    conn.close()
-    return render_template('patient_history.html', patient=patient, visits=visits, prescriptions=prescriptions)
+    """Patient chart: visits with their prescriptions and bills"""
+    chart = patient_chart.get_cache(DB_PATH).get(get_db_connection(), patient_id)
+    if chart is None:
+        abort(404)
+    return render_template('patient_history.html', chart=chart, patient=chart.patient)
+
+
+@app.route('/api/patients/<int:patient_id>/chart')
+def api_patient_chart(patient_id):
+    """The patient chart as nested JSON"""
+    chart = patient_chart.get_cache(DB_PATH).get(get_db_connection(), patient_id)
+    if chart is None:
+        return jsonify(error='patient not found'), 404
+    return jsonify(patient_chart.to_dict(chart))
 
 
 @app.route('/patients/delete/<int:patient_id>', methods=('POST',))
 def delete_patient(patient_id):
     """Delete a patient and rely on FK cascade to remove related records."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM patients WHERE patient_id = ?', (patient_id,))
-    p = cur.fetchone()
-    if not p:
-        conn.close()
+    # the DELETE's row count is the existence check; the cascade uses the child-FK indexes (migration 0008)
+    if not execute_write('patients.delete', patient_id=patient_id):
         flash('Patient not found', 'danger')
         return redirect(url_for('patients'))
-
-    cur.execute('DELETE FROM patients WHERE patient_id = ?', (patient_id,))
-    conn.commit()
-    conn.close()
     flash('Patient and related records deleted', 'success')
     return redirect(url_for('patients'))
 
 
+@app.route('/import', methods=('GET', 'POST'))
+def bulk_import_upload():
+    """Upload a CSV/NDJSON file of patients, appointments, visits or bills"""
+    import bulk_import
+    result = None
+    if request.method == 'POST':
+        table = request.form['table']
+        upload = request.files.get('file')
+        if table not in bulk_import.TABLES or not upload or not upload.filename:
+            flash('Choose a table and a file to import', 'danger')
+            return redirect(url_for('bulk_import_upload'))
+        fmt = request.form.get('format') or bulk_import.detect_format(upload.filename)
+        # through the writer queue, chunk by chunk; --defer (dropping indexes and triggers) is CLI-only
+        result = bulk_import.import_queued(db.get_writer(DB_PATH), table, bulk_import.text_stream(upload.stream), fmt)
+        flash(f'Imported {result.inserted} of {result.read} {table} rows, {result.rejected} rejected',
+              'success' if not result.rejected else 'warning')
+    return render_template('import.html', tables=list(bulk_import.TABLES), result=result)
+
+
+def stream_report(name, template):
+    """Render a report page from the query cache, or while rows are still being fetched."""
+    query, params = reports.resolve(name, request.args)
+    rows = query_cache.get_cache().fetch(get_report_connection(), query, **params)
+    snap = snapshot.get_snapshot(DB_PATH)
+    return Response(stream_template(template, rows=rows, params=params,
+                                    snapshot=snap.info() if snap.enabled else None))
+
+
 @app.route('/reports/billing')
+@http_cache.conditional(report_validator('billing'))
 def report_billing():
     """Billing summary: total billed and unpaid amounts per patient"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT p.patient_id, p.first_name || ' ' || p.last_name AS patient_name,
-               SUM(b.amount) AS total_billed,
-               SUM(CASE WHEN b.status = 'unpaid' THEN b.amount ELSE 0 END) AS total_unpaid
-        FROM bills b
-        JOIN patients p ON b.patient_id = p.patient_id
-        GROUP BY p.patient_id, patient_name
-        ORDER BY total_unpaid DESC
-    ''')
-    rows = cur.fetchall()
-    conn.close()
-    return render_template('reports/billing.html', rows=rows)
+    return stream_report('billing', 'reports/billing.html')
 
 
 @app.route('/reports/doctor-workload')
+@http_cache.conditional(report_validator('doctor-workload'))
 def report_doctor_workload():
     """Doctor workload: number of appointments per doctor in the next 7 days"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT d.doctor_id, d.first_name || ' ' || d.last_name AS doctor_name,
-               COUNT(a.appointment_id) AS upcoming_appointments
-        FROM doctors d
-        LEFT JOIN appointments a ON a.doctor_id = d.doctor_id
-            AND date(a.appointment_datetime) BETWEEN date('now') AND date('now', '+7 days')
-        GROUP BY d.doctor_id, doctor_name
-        ORDER BY upcoming_appointments DESC
-    ''')
-    rows = cur.fetchall()
-    conn.close()
-    return render_template('reports/doctor_workload.html', rows=rows)
+    return stream_report('doctor-workload', 'reports/doctor_workload.html')
 
 
 @app.route('/reports/daily-appointments')
+@http_cache.conditional(report_validator('daily-appointments'))
 def report_daily_appointments():
     """List appointments for today"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT a.appointment_id, a.appointment_datetime, a.status, p.first_name || ' ' || p.last_name AS patient_name,
-               d.first_name || ' ' || d.last_name AS doctor_name
-        FROM appointments a
-        JOIN patients p ON a.patient_id = p.patient_id
-        JOIN doctors d ON a.doctor_id = d.doctor_id
-        WHERE date(a.appointment_datetime) = date('now')
-        ORDER BY a.appointment_datetime
-    ''')
-    rows = cur.fetchall()
-    conn.close()
-    return render_template('reports/daily_appointments.html', rows=rows)
+    return stream_report('daily-appointments', 'reports/daily_appointments.html')
 
 
 @app.route('/reports/overdue-bills')
+@http_cache.conditional(report_validator('overdue-bills'))
 def report_overdue_bills():
     """Show unpaid bills older than 30 days"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT b.bill_id, b.issued_at, b.amount, b.status, p.first_name || ' ' || p.last_name AS patient_name
-        FROM bills b
-        JOIN patients p ON b.patient_id = p.patient_id
-        WHERE b.status = 'unpaid' AND date(b.issued_at) <= date('now', '-30 days')
-        ORDER BY b.issued_at
-    ''')
-    rows = cur.fetchall()
-    conn.close()
-    return render_template('reports/overdue_bills.html', rows=rows)
+    return stream_report('overdue-bills', 'reports/overdue_bills.html')
+
+
+@app.route('/reports/workload')
+@http_cache.conditional(report_validator('workload'))
+def report_workload():
+    """Appointments and visits per day/week/month/year and department or doctor, from the rollups"""
+    try:
+        return stream_report('workload', 'reports/workload.html')
+    except ValueError:
+        flash('Invalid date range, grain or grouping, showing the default report', 'warning')
+        return redirect(url_for('report_workload'))
+
+
+@app.route('/reports/ar-aging')
+@http_cache.conditional(report_validator('ar-aging', tables=queries.get('bills.aging-chunk').tables))
+def report_ar_aging():
+    """Accounts-receivable aging buckets, DSO and monthly collection trends"""
+    try:
+        as_of = ar_aging.parse_as_of(request.args.get('as_of'))
+        months = int(request.args.get('months') or ar_aging.DEFAULT_MONTHS)
+    except ValueError:
+        flash('Invalid as-of date or months, showing the default report', 'warning')
+        as_of, months = None, ar_aging.DEFAULT_MONTHS
+    snap = snapshot.get_snapshot(DB_PATH)
+    try:
+        aging = ar_aging.report(get_report_connection(), as_of, months)
+    except ar_aging.MissingNumPy as e:
+        return render_template('reports/ar_aging.html', aging=None, error=str(e), snapshot=None), 503
+    return render_template('reports/ar_aging.html', aging=aging, error=None,
+                           snapshot=snap.info() if snap.enabled else None)
+
+
+@app.route('/reports/<name>.<any(csv, ndjson):fmt>')
+@http_cache.conditional(report_validator())
+def report_export(name, fmt):
+    """Download a report as CSV or NDJSON, streamed in batches"""
+    if name not in reports.REPORTS:
+        abort(404)
+    try:
+        columns, rows = reports.run_report(get_report_connection(), name, args=request.args)
+    except ValueError:
+        abort(400)
+    return Response(stream_with_context(reports.export(fmt, columns, rows)),
+                    mimetype=reports.EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={name}.{fmt}'})
 
 if __name__ == '__main__':
     # auto-init DB if missing
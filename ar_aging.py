@@ -0,0 +1,178 @@
+"""Accounts-receivable aging, DSO and collection trends over the whole bills table.
+
+``bills`` is read in ``CHUNK_SIZE`` keyset chunks of plain numbers (dates as
+day ordinals, computed by SQLite) straight into NumPy arrays; every figure
+is then computed from those arrays with vectorized operations instead of
+one SQL aggregate per bucket and month:
+
+- aging: unpaid bills by days since issue (0-30, 31-60, 61-90, 90+), with
+  amounts, bill counts and distinct patients per bucket;
+- days sales outstanding: receivables as of the day divided by the average
+  daily billing of the last ``DSO_DAYS`` days;
+- per month of issue: billed, the share of it collected so far, average days
+  to payment, receivables at month end and that month's DSO.
+
+A bill counts as paid when its status is 'paid'; a paid bill without
+paid_at is taken as paid on the day it was issued. Results are cached per
+bills version and as-of date.
+
+NumPy is optional (``pip install numpy``); without it ``report()`` raises
+``MissingNumPy`` and the page and command say so.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import date
+
+import clinic_time
+import queries
+import query_cache
+
+CHUNK_SIZE = 20000  # each chunk stays well under the slow-query threshold
+BUCKETS = ((0, 30), (31, 60), (61, 90), (91, None))
+DSO_DAYS = 90
+DEFAULT_MONTHS = 12
+MAX_MONTHS = 120
+MAX_CACHED = 16
+
+# toordinal() of 1970-01-01, NumPy's datetime64 epoch
+_EPOCH = date(1970, 1, 1).toordinal()
+
+Bucket = namedtuple('Bucket', 'label bills amount patients')
+Month = namedtuple('Month', 'month billed collected collection_rate avg_days_to_pay receivables dso')
+Aging = namedtuple('Aging', 'as_of bills receivables dso buckets months seconds')
+
+
+class MissingNumPy(RuntimeError):
+    """The AR aging report needs NumPy, which is not installed."""
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise MissingNumPy('The AR aging report needs NumPy: pip install numpy') from None
+    return numpy
+
+
+def bucket_label(low, high):
+    return f'{low}-{high}' if high is not None else f'{low - 1}+'
+
+
+def load(conn, chunk_size=CHUNK_SIZE):
+    """All bills as a float64 array of rows (bill_id, patient_id, amount, paid, issued day, paid day)."""
+    np = _numpy()
+    chunks, after = [], 0
+    while True:
+        rows = queries.execute(conn, 'bills.aging-chunk', after=after, limit=chunk_size).fetchall()
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.float64)
+        chunks.append(chunk)
+        after = int(chunk[-1, 0])
+    return np.concatenate(chunks) if chunks else np.empty((0, 6))
+
+
+def _cumulative_at(np, days, weights, points):
+    """Sum of ``weights`` whose day is on or before each of ``points``."""
+    order = np.argsort(days, kind='stable')
+    totals = np.concatenate(([0.0], np.cumsum(weights[order])))
+    return totals[np.searchsorted(days[order], points, side='right')]
+
+
+def compute(data, as_of, months=DEFAULT_MONTHS):
+    """Aging, DSO and monthly trends of ``load()``'s array as of the date ``as_of``."""
+    np = _numpy()
+    today = as_of.toordinal()
+    issued = data[:, 4]
+    data = data[(issued > 0) & (issued <= today)]  # undated and future bills do not count
+    patient, amount, paid, issued, paid_day = data[:, 1], data[:, 2], data[:, 3] > 0, data[:, 4], data[:, 5]
+    paid_day = np.where(paid & (paid_day <= 0), issued, paid_day)
+    # paid after as_of means still open on as_of
+    open_ = ~paid | (paid_day > today)
+
+    # aging buckets of what is open today
+    age = today - issued[open_]
+    bucket = np.searchsorted([high for _, high in BUCKETS[:-1]], age, side='left')
+    amounts = np.bincount(bucket, weights=amount[open_], minlength=len(BUCKETS))
+    counts = np.bincount(bucket, minlength=len(BUCKETS))
+    # distinct patients per bucket: unique (bucket, patient) pairs packed into one integer
+    base = int(patient.max(initial=0)) + 1
+    pairs = np.unique(bucket * base + patient[open_].astype(np.int64))
+    patients = np.bincount(pairs // base, minlength=len(BUCKETS))
+    buckets = [Bucket(bucket_label(low, high), int(counts[i]), round(float(amounts[i]), 2), int(patients[i]))
+               for i, (low, high) in enumerate(BUCKETS)]
+    receivables = float(amounts.sum())
+    recent = amount[issued > today - DSO_DAYS].sum()
+    dso = round(receivables / (recent / DSO_DAYS), 1) if recent else None
+
+    # monthly trends by month of issue, oldest first
+    month_of = (issued - _EPOCH).astype('datetime64[D]').astype('datetime64[M]')
+    last = np.datetime64(as_of, 'M')
+    first = last - (months - 1)
+    index = (month_of - first).astype(np.int64)
+    in_range = (index >= 0) & (index < months)
+    index, m_amount, m_paid = index[in_range], amount[in_range], paid[in_range] & (paid_day[in_range] <= today)
+    billed = np.bincount(index, weights=m_amount, minlength=months)
+    collected = np.bincount(index[m_paid], weights=m_amount[m_paid], minlength=months)
+    paid_counts = np.bincount(index[m_paid], minlength=months)
+    pay_days = np.bincount(index[m_paid], weights=(paid_day[in_range] - issued[in_range])[m_paid], minlength=months)
+    starts = np.arange(first, last + 1).astype('datetime64[D]').astype(np.int64) + _EPOCH
+    ends = np.minimum(np.append(starts[1:] - 1, today), today)
+    # receivables at each month end: billed by then minus paid by then
+    open_at_end = (_cumulative_at(np, issued, amount, ends)
+                   - _cumulative_at(np, paid_day[paid], amount[paid], ends))
+    trend = []
+    for i in range(months):
+        days_in = int(ends[i] - starts[i] + 1)
+        trend.append(Month(
+            date.fromordinal(int(starts[i])).strftime('%Y-%m'), round(float(billed[i]), 2),
+            round(float(collected[i]), 2),
+            round(float(collected[i] / billed[i]), 4) if billed[i] else None,
+            round(float(pay_days[i] / paid_counts[i]), 1) if paid_counts[i] else None,
+            round(float(open_at_end[i]), 2),
+            round(float(open_at_end[i] / (billed[i] / days_in)), 1) if billed[i] else None))
+    return Aging(as_of.isoformat(), int(len(data)), round(receivables, 2), dso, buckets, trend, None)
+
+
+class AgingCache:
+    """Reports keyed by (bills version, as-of date, months); recomputed when bills change."""
+
+    def __init__(self, max_entries=MAX_CACHED):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def report(self, conn, as_of=None, months=DEFAULT_MONTHS):
+        as_of = as_of or clinic_time.clinic_today()
+        months = max(1, min(months, MAX_MONTHS))
+        version = query_cache.QueryCache.table_versions(conn, ('bills',))
+        key = (version, as_of, months)
+        if version is not None:
+            with self._lock:
+                result = self._entries.get(key)
+                if result is not None:
+                    self._entries.move_to_end(key)
+                    return result
+        started = time.perf_counter()
+        result = compute(load(conn), as_of, months)
+        result = result._replace(seconds=round(time.perf_counter() - started, 3))
+        if version is not None:
+            with self._lock:
+                self._entries[key] = result
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return result
+
+
+_cache = AgingCache()
+
+
+def report(conn, as_of=None, months=DEFAULT_MONTHS):
+    """The AR aging report as of ``as_of`` (default: clinic today), cached per bills version."""
+    return _cache.report(conn, as_of, months)
+
+
+def parse_as_of(value):
+    """'YYYY-MM-DD' -> date; ValueError if malformed. None/'' -> None (today)."""
+    return date.fromisoformat(value) if value else None
@@ -0,0 +1,264 @@
+"""Move inactive patients and all their rows into an attached archive database.
+
+A patient is inactive when none of their appointments, visits or bills is
+newer than the cutoff and no bill is left unpaid. Patients without any
+appointment or visit are left alone: the schema does not record when they
+were added.
+
+The run walks patient_id in ranges of ``BATCH_SIZE``. Each batch has two
+short transactions, because SQLite does not commit WAL databases attached
+to one connection atomically together:
+
+1. copy the batch's inactive patients, appointments, visits, prescriptions
+   and bills into the archive (replacing any earlier partial copy) and note
+   each patient's patient_versions counter there;
+2. under the main database's write lock, drop patients that changed or
+   became active since (their counter moved), delete the rest children
+   first (keeping their counts in the workload rollups, see rollups.py),
+   and advance the checkpoint in ``archive_runs``.
+
+A crash between the two leaves an extra copy in the archive, never a
+missing one. Copies of patients that are still in the main database are
+removed when the next run starts. An interrupted run resumes at its
+checkpoint with its original cutoff.
+"""
+import sqlite3
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import clinic_time
+import rollups
+
+INACTIVE_DAYS = 3 * 365
+BATCH_SIZE = 500     # patient ids per batch
+PAUSE = 0.05         # seconds between batches, for the app's writer
+
+# (table, primary key, rows belonging to the batch's patients in schema {db});
+# children first, which is the order rows are deleted in
+TABLES = (
+    ('prescriptions', 'prescription_id',
+     'visit_id IN (SELECT visit_id FROM {db}.visits WHERE patient_id IN temp.archive_batch)'),
+    ('bills', 'bill_id', 'patient_id IN temp.archive_batch'),
+    ('visits', 'visit_id', 'patient_id IN temp.archive_batch'),
+    ('appointments', 'appointment_id', 'patient_id IN temp.archive_batch'),
+    ('patients', 'patient_id', 'patient_id IN temp.archive_batch'),
+)
+
+SQL_INACTIVE = '''
+SELECT p.patient_id FROM main.patients p
+WHERE p.patient_id >= :lo AND p.patient_id < :hi
+  AND (EXISTS (SELECT 1 FROM main.appointments a WHERE a.patient_id = p.patient_id)
+       OR EXISTS (SELECT 1 FROM main.visits v WHERE v.patient_id = p.patient_id))
+  AND NOT EXISTS (SELECT 1 FROM main.appointments a
+                  WHERE a.patient_id = p.patient_id AND a.appointment_datetime >= :cutoff)
+  AND NOT EXISTS (SELECT 1 FROM main.visits v WHERE v.patient_id = p.patient_id AND v.visit_date >= :cutoff)
+  AND NOT EXISTS (SELECT 1 FROM main.bills b
+                  WHERE b.patient_id = p.patient_id
+                    AND (b.status IS NOT 'paid' OR b.issued_at >= :cutoff OR b.paid_at >= :cutoff))
+'''
+
+SQL_ARCHIVE_LOG = '''
+CREATE TABLE IF NOT EXISTS archive.archived_patients (
+    patient_id INTEGER PRIMARY KEY,
+    version INTEGER,
+    run_id INTEGER NOT NULL,
+    cutoff TEXT NOT NULL,
+    archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+
+def default_archive_path(db_path):
+    db_path = Path(db_path)
+    return db_path.with_name(db_path.stem + '_archive' + db_path.suffix)
+
+
+def cutoff_for(inactive_days, today=None):
+    """'YYYY-MM-DD': activity on or after this day keeps a patient in the main database."""
+    return ((today or clinic_time.clinic_today()) - timedelta(days=inactive_days)).isoformat()
+
+
+def _connect(db_path, archive_path):
+    from db import apply_pragmas
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    apply_pragmas(conn)
+    conn.execute('ATTACH DATABASE ? AS archive', (str(archive_path),))
+    conn.execute('PRAGMA archive.auto_vacuum = INCREMENTAL')  # only takes effect on a new file
+    conn.execute('PRAGMA archive.journal_mode = WAL')
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (patient_id INTEGER PRIMARY KEY)')
+    _ensure_archive_schema(conn)
+    return conn
+
+
+def _ensure_archive_schema(conn):
+    """Archive tables mirror the main columns with the primary key but no other constraints."""
+    conn.execute('BEGIN IMMEDIATE')
+    for table, key, _ in TABLES:
+        columns = [(r[1], r[2]) for r in conn.execute(f'PRAGMA main.table_info({table})')]
+        existing = {r[1] for r in conn.execute(f'PRAGMA archive.table_info({table})')}
+        if not existing:
+            defs = ', '.join(f'{name} {type_} PRIMARY KEY' if name == key else f'{name} {type_}'
+                             for name, type_ in columns)
+            conn.execute(f'CREATE TABLE archive.{table} ({defs})')
+        else:
+            for name, type_ in columns:
+                if name not in existing:  # the main schema gained a column since
+                    conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {name} {type_}')
+    for table, column in (('appointments', 'patient_id'), ('visits', 'patient_id'),
+                          ('bills', 'patient_id'), ('prescriptions', 'visit_id')):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS archive.idx_{table}_{column} ON {table}({column})')
+    conn.execute(SQL_ARCHIVE_LOG)
+    conn.execute('COMMIT')
+
+
+def _columns(conn, table):
+    return ', '.join(r[1] for r in conn.execute(f'PRAGMA main.table_info({table})'))
+
+
+def _purge_archive_copies(conn):
+    """Remove archive rows of the patients in temp.archive_batch (children first)."""
+    for table, _, where in TABLES:
+        conn.execute(f'DELETE FROM archive.{table} WHERE {where.format(db="archive")}')
+    conn.execute('DELETE FROM archive.archived_patients WHERE patient_id IN temp.archive_batch')
+
+
+def _fill_batch(conn, sql, params=()):
+    conn.execute('DELETE FROM temp.archive_batch')
+    conn.execute(f'INSERT INTO temp.archive_batch (patient_id) {sql}', params)
+
+
+def cleanup_partial_copies(conn):
+    """Drop archive copies of patients still in the main database (interrupted batches)."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _fill_batch(conn, 'SELECT patient_id FROM archive.archived_patients '
+                          'WHERE patient_id IN (SELECT patient_id FROM main.patients)')
+        stale = conn.execute('SELECT COUNT(*) FROM temp.archive_batch').fetchone()[0]
+        if stale:
+            _purge_archive_copies(conn)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return stale
+
+
+def archive_batch(conn, run_id, cutoff, lo, hi):
+    """Archive the inactive patients with ids in [lo, hi); returns how many moved."""
+    params = {'lo': lo, 'hi': hi, 'cutoff': cutoff}
+    # 1. copy (writes the archive only)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _fill_batch(conn, SQL_INACTIVE, params)
+        candidates = conn.execute('SELECT COUNT(*) FROM temp.archive_batch').fetchone()[0]
+        if candidates:
+            _purge_archive_copies(conn)
+            for table, _, where in reversed(TABLES):
+                columns = _columns(conn, table)
+                conn.execute(f'INSERT INTO archive.{table} ({columns}) '
+                             f'SELECT {columns} FROM main.{table} WHERE {where.format(db="main")}')
+            conn.execute('''INSERT INTO archive.archived_patients (patient_id, version, run_id, cutoff)
+                            SELECT b.patient_id, pv.version, ?, ? FROM temp.archive_batch b
+                            LEFT JOIN main.patient_versions pv ON pv.patient_id = b.patient_id''', (run_id, cutoff))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    # 2. delete what is still exactly what was copied (writes main only)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        moved = 0
+        if candidates:
+            _fill_batch(conn, f'''SELECT i.patient_id FROM ({SQL_INACTIVE}) i
+                                  JOIN archive.archived_patients ap ON ap.patient_id = i.patient_id
+                                  LEFT JOIN main.patient_versions pv ON pv.patient_id = i.patient_id
+                                  WHERE ap.version IS pv.version''', params)
+            moved = conn.execute('SELECT COUNT(*) FROM temp.archive_batch').fetchone()[0]
+            # the delete triggers take the rows out of the workload rollups; count them back in first
+            for statement in rollups.SQL_KEEP_ARCHIVED:
+                conn.execute(statement)
+            for table, _, where in TABLES:
+                conn.execute(f'DELETE FROM main.{table} WHERE {where.format(db="main")}')
+            conn.execute('DELETE FROM main.patient_versions WHERE patient_id IN temp.archive_batch')
+        conn.execute('UPDATE archive_runs SET next_key = ?, patients = patients + ?, updated_at = CURRENT_TIMESTAMP '
+                     'WHERE run_id = ?', (hi, moved, run_id))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    if moved < candidates:
+        cleanup_partial_copies(conn)  # those patients changed in between and stay
+    return moved
+
+
+def _start_run(conn, cutoff, archive_path, restart):
+    run = conn.execute('SELECT run_id, cutoff, archive_path, next_key, max_key FROM archive_runs '
+                       'WHERE done = 0 ORDER BY run_id DESC LIMIT 1').fetchone()
+    if run is not None and restart:
+        conn.execute('UPDATE archive_runs SET done = 1, updated_at = CURRENT_TIMESTAMP WHERE run_id = ?', (run[0],))
+        run = None
+    if run is None:
+        max_key = conn.execute('SELECT COALESCE(MAX(patient_id), 0) FROM patients').fetchone()[0]
+        cur = conn.execute('INSERT INTO archive_runs (cutoff, archive_path, max_key) VALUES (?, ?, ?)',
+                           (cutoff, str(archive_path), max_key))
+        run = (cur.lastrowid, cutoff, str(archive_path), 0, max_key)
+    return run
+
+
+def run(db_path, archive_path=None, inactive_days=INACTIVE_DAYS, batch_size=BATCH_SIZE, pause=PAUSE,
+        restart=False, progress=None):
+    """Archive inactive patients, resuming an unfinished run; returns a summary dict.
+
+    ``progress(next_key, max_key, moved)`` is called after every batch.
+    """
+    archive_path = Path(archive_path or default_archive_path(db_path))
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        run_id, cutoff, archive_path, next_key, max_key = _start_run(
+            conn, cutoff_for(inactive_days), archive_path, restart)
+    finally:
+        conn.close()
+    conn = _connect(db_path, archive_path)
+    started = time.perf_counter()
+    moved = batches = 0
+    slowest = 0.0
+    try:
+        stale = cleanup_partial_copies(conn)
+        while next_key <= max_key:
+            batch_start = time.perf_counter()
+            moved += archive_batch(conn, run_id, cutoff, next_key, next_key + batch_size)
+            slowest = max(slowest, time.perf_counter() - batch_start)
+            next_key += batch_size
+            batches += 1
+            if progress:
+                progress(min(next_key, max_key), max_key, moved)
+            if pause:
+                time.sleep(pause)
+        conn.execute('UPDATE archive_runs SET done = 1, updated_at = CURRENT_TIMESTAMP WHERE run_id = ?', (run_id,))
+    finally:
+        conn.close()
+    return {'run_id': run_id, 'cutoff': cutoff, 'archive': archive_path, 'patients': moved, 'batches': batches,
+            'stale_copies_removed': stale, 'seconds': round(time.perf_counter() - started, 2),
+            'slowest_batch_ms': round(slowest * 1000, 1)}
+
+
+def count_inactive(db_path, inactive_days=INACTIVE_DAYS):
+    """How many patients a run with this cutoff would archive (read-only)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        max_key = conn.execute('SELECT COALESCE(MAX(patient_id), 0) FROM patients').fetchone()[0]
+        sql = f'SELECT COUNT(*) FROM ({SQL_INACTIVE})'.replace('main.', '')
+        return conn.execute(sql, {'lo': 0, 'hi': max_key + 1, 'cutoff': cutoff_for(inactive_days)}).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def runs(db_path):
+    """All archive runs, newest first, for ``cli.py archive-patients --status``."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT run_id, cutoff, archive_path, next_key, max_key, patients, done, started_at, '
+                            'updated_at FROM archive_runs ORDER BY run_id DESC').fetchall()
+    finally:
+        conn.close()
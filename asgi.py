@@ -0,0 +1,214 @@
+"""ASGI entry point: the Flask app behind an asyncio front end.
+
+    uvicorn asgi:application
+
+Connections are accepted and parked on the event loop, so clients waiting
+for their turn do not each tie up a thread. At most ``CONCURRENCY`` requests
+run the unchanged Flask routes and templates at a time, each on a thread of
+a pool sized to the SQLite connection pool, so the threads never queue on
+the pool themselves. Up to ``MAX_QUEUE`` further requests wait for a slot.
+Beyond that, or after ``QUEUE_TIMEOUT`` seconds, the server answers 503 with
+Retry-After (backpressure) instead of letting tail latency grow without
+bound.
+
+A response is produced by one worker thread from start to finish (Flask's
+request context must not hop threads). The thread stays at most
+``BUFFERED_CHUNKS`` chunks ahead of the client, so streamed reports keep
+memory flat.
+
+Tune with HOSPITAL_ASGI_CONCURRENCY, HOSPITAL_ASGI_QUEUE and
+HOSPITAL_ASGI_QUEUE_TIMEOUT. Live counters are served at ``/health/asgi``.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+from app import app as flask_app
+
+CONCURRENCY = int(os.environ.get('HOSPITAL_ASGI_CONCURRENCY', db.POOL_SIZE))
+MAX_QUEUE = int(os.environ.get('HOSPITAL_ASGI_QUEUE', '64'))
+QUEUE_TIMEOUT = float(os.environ.get('HOSPITAL_ASGI_QUEUE_TIMEOUT', '5'))
+BUFFERED_CHUNKS = 8
+# request bodies (e.g. /import uploads) above this spill to a temp file
+SPOOL_BYTES = 1024 * 1024
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class WsgiAdapter:
+    """Run a WSGI app from ASGI with a concurrency limit and a bounded wait queue."""
+
+    def __init__(self, wsgi_app, concurrency=CONCURRENCY, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        self.wsgi_app = wsgi_app
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix='asgi-worker')
+        self._slots = asyncio.Semaphore(concurrency)
+        self.stats = {'served': 0, 'rejected': 0, 'timed_out': 0, 'errors': 0, 'in_flight': 0, 'waiting': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        if scope['path'] == '/health/asgi':
+            return await self._send_simple(send, 200, json.dumps(dict(self.stats, concurrency=self.concurrency,
+                                                                      max_queue=self.max_queue)),
+                                           'application/json')
+        if self.stats['waiting'] >= self.max_queue and self._slots.locked():
+            self.stats['rejected'] += 1
+            return await self._send_simple(send, 503, 'Server busy, retry shortly', retry_after=1)
+        self.stats['waiting'] += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats['timed_out'] += 1
+            return await self._send_simple(send, 503, 'Server busy, retry shortly', retry_after=1)
+        finally:
+            self.stats['waiting'] -= 1
+        self.stats['in_flight'] += 1
+        try:
+            await self._handle(scope, receive, send)
+            self.stats['served'] += 1
+        finally:
+            self.stats['in_flight'] -= 1
+            self._slots.release()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _send_simple(send, status, text, content_type='text/plain; charset=utf-8', retry_after=None):
+        body = text.encode('utf-8')
+        headers = [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+        if retry_after is not None:
+            headers.append((b'retry-after', str(retry_after).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    async def _read_body(receive):
+        body = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise _Cancelled()
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        size = body.tell()
+        body.seek(0)
+        return body, size
+
+    @staticmethod
+    def _environ(scope, body, size):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = 'HTTP_' + name
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def _produce(self, environ, response, loop, chunks, credit, cancelled):
+        """Worker thread: run the app and hand its chunks to the event loop."""
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: None  # the legacy write() callable is not used by Flask
+
+        item = None
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        credit.acquire()
+                        if cancelled.is_set():
+                            break
+                        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except BaseException as e:
+            item = e
+        loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+    async def _handle(self, scope, receive, send):
+        try:
+            body, size = await self._read_body(receive)
+        except _Cancelled:
+            return
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        credit = threading.Semaphore(BUFFERED_CHUNKS)
+        cancelled = threading.Event()
+        response = {}
+        worker = loop.run_in_executor(self.executor, self._produce, self._environ(scope, body, size),
+                                      response, loop, chunks, credit, cancelled)
+        started = False
+        try:
+            while True:
+                item = await chunks.get()
+                if isinstance(item, BaseException):
+                    raise item
+                if not started:
+                    await send({'type': 'http.response.start', 'status': response['status'],
+                                'headers': response['headers']})
+                    started = True
+                if item is None:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+                await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+                credit.release()
+        except Exception:
+            self.stats['errors'] += 1
+            if not started:
+                await self._send_simple(send, 500, 'Internal Server Error')
+            else:
+                raise
+        finally:
+            cancelled.set()
+            credit.release()  # unblock a producer still waiting for room
+            await worker
+            body.close()
+
+
+application = WsgiAdapter(flask_app)
@@ -0,0 +1,160 @@
+"""Load test: threaded WSGI (app.run) against the ASGI front end (asgi.py).
+
+Both servers run in a subprocess against the same seeded scratch database,
+and get the same appointment-rush mix of list pages, day reports and
+patient histories (the full billing report, a multi-megabyte page at scale,
+is left out so it does not drown everything else) from
+``--clients`` concurrent keep-alive clients for ``--seconds`` each. The
+result is JSON with requests/sec, p50/p95/p99 latency and status counts per
+mode; 503s from the ASGI backpressure are counted, not timed.
+
+    python bench_async.py --patients 20000 --clients 64 --seconds 15
+
+The ASGI mode needs uvicorn (``pip install uvicorn``); it is skipped when
+uvicorn is not installed.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import db
+import schema_version
+import seed_data
+from init_db import init_db
+
+HERE = Path(__file__).parent
+
+PATHS = ['/patients', '/appointments', '/reports/doctor-workload', '/reports/daily-appointments',
+         '/patient/{patient_id}', '/patient/{patient_id}', '/patient/{patient_id}']
+
+SERVERS = {
+    'wsgi': "import sys; from pathlib import Path; import app; app.DB_PATH = Path(sys.argv[1]); "
+            "app.app.run(port=int(sys.argv[2]), threaded=True)",
+    'asgi': "import sys; from pathlib import Path; import app; app.DB_PATH = Path(sys.argv[1]); import asgi, uvicorn; "
+            "uvicorn.run(asgi.application, port=int(sys.argv[2]), log_level='warning')",
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def client(port, stop, patients, seed, latencies, statuses):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while not stop.is_set():
+        path = rng.choice(PATHS).format(patient_id=rng.randint(1, patients))
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            statuses['error'] = statuses.get('error', 0) + 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            continue
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if response.status == 200:
+            latencies.append(time.perf_counter() - start)
+        if response.getheader('connection', '').lower() == 'close' or response.version == 10:
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.close()
+
+
+def run_mode(mode, db_path, patients, clients, seconds):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-c', SERVERS[mode], str(db_path), str(port)], cwd=HERE,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port)
+        # warm the pool, caches and templates before measuring
+        warm = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        for path in PATHS:
+            warm.request('GET', path.format(patient_id=1))
+            warm.getresponse().read()
+        warm.close()
+        stop = threading.Event()
+        latencies, per_client = [], [dict() for _ in range(clients)]
+        threads = [threading.Thread(target=client, args=(port, stop, patients, i, latencies, per_client[i]))
+                   for i in range(clients)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+    statuses = {}
+    for counts in per_client:
+        for status, n in counts.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + n
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 2) if latencies else None
+    return {'requests_per_s': round(len(latencies) / elapsed, 1), 'ok': len(latencies), 'statuses': statuses,
+            'p50_ms': pct(50), 'p95_ms': pct(95), 'p99_ms': pct(99),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare WSGI and ASGI serving under concurrent load')
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--modes', default='wsgi,asgi')
+    args = parser.parse_args()
+
+    results = {'clients': args.clients, 'seconds': args.seconds, 'patients': args.patients, 'modes': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'load.db'
+        with contextlib.redirect_stdout(sys.stderr):
+            init_db(path)
+            schema_version.apply(path)
+        conn = db.connect(path)
+        seed_data.generate(conn, args.patients, progress=None)
+        conn.close()
+        db.discard(path)
+        for mode in args.modes.split(','):
+            if mode == 'asgi':
+                try:
+                    import uvicorn  # noqa: F401
+                except ImportError:
+                    print('uvicorn is not installed; skipping the asgi mode', file=sys.stderr)
+                    continue
+            print(f'Load testing {mode} ({args.clients} clients, {args.seconds}s)...', file=sys.stderr)
+            results['modes'][mode] = run_mode(mode, path, args.patients, args.clients, args.seconds)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
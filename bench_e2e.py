@@ -0,0 +1,254 @@
+"""End-to-end benchmark of the Flask routes, CLI commands and reports.
+
+For each scale a scratch database is built with seed_data.generate() in a
+fresh subprocess, so its peak RSS is that scale's alone. The GET routes, the
+booking API and the read-only cli.py commands are then driven through the
+Flask test client and Click's CliRunner. Output is JSON with p50/p95/p99
+latency and throughput per target, and peak RSS per scale.
+
+    python bench_e2e.py --scales 1k,10k --iterations 20 --out bench.json
+    python bench_e2e.py --scales 1k --baseline bench.json      # flag regressions
+
+Not benchmarked: init-db (wipes the database), import (needs input files,
+see bulk_import.py), the maintenance commands (migrate, refresh-snapshot,
+archive-patients, vacuum) and the HTML form POSTs. The AR aging page and
+command are skipped when NumPy is not installed.
+"""
+import argparse
+import contextlib
+import importlib.util
+import itertools
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import app as webapp
+import cli
+import scheduling
+import schema_version
+import seed_data
+from init_db import init_db
+
+ROUTES = [
+    '/', '/patients', '/patients?limit=250', '/appointments', '/appointments/schedule', '/patient/{patient_id}',
+    '/reports/billing', '/reports/doctor-workload', '/reports/daily-appointments', '/reports/overdue-bills',
+    '/reports/billing.csv', '/reports/overdue-bills.ndjson',
+    '/reports/workload', '/reports/workload?grain=week&by=doctor',
+    '/api/patients/search?q=Patel', '/api/patients/{patient_id}/chart',
+    '/api/doctors/1/slots', '/api/doctors/1/slots/check?datetime=2030-01-07 09:00', '/api/departments/1/slots',
+]
+
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+if HAS_NUMPY:
+    ROUTES.append('/reports/ar-aging')
+
+# timed again with If-None-Match: the 304 path of http_cache.conditional()
+REVALIDATED = ['/patients', '/appointments', '/reports/billing', '/reports/workload', '/reports/billing.csv']
+
+COMMANDS = [
+    ['list-patients', '--limit', '50'],
+    ['list-patients'],
+    ['patient-history', '{patient_id}'],
+    ['report-billing'],
+    ['report-doctor-workload'],
+    ['report-daily-appointments'],
+    ['report-overdue-bills'],
+    ['report-overdue-bills', '--format', 'csv'],
+    ['report-workload', '--grain', 'year', '--by', 'doctor'],
+    ['search-patients', 'Patel'],
+    ['free-slots', '--doctor-id', '1'],
+    ['free-slots', '--department-id', '1'],
+    ['index-advisor'],
+    ['rebuild-summaries', '--check'],
+    ['rebuild-rollups', '--check'],
+    ['add-patient', '--first', 'Bench', '--last', 'Mark'],
+    ['schedule-appointment', '--patient-id', '{patient_id}', '--doctor-id', '1', '--datetime', '{slot}'],
+]
+if HAS_NUMPY:
+    COMMANDS.append(['report-ar-aging'])
+
+
+def peak_rss_kb():
+    """Peak RSS of this process so far (the high-water mark, never lowered)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'iterations': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'mean_ms': round(total / len(samples) * 1000, 3),
+        'throughput_per_s': round(len(samples) / total, 1) if total else None,
+    }
+
+
+def build_database(path, patients, seed):
+    # keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db(path)
+        schema_version.apply(path)
+    conn = webapp.db.get_pool(path).acquire()
+    seed_data.generate(conn, patients, seed=seed, progress=None)
+    conn.close()
+
+
+def time_target(fn, iterations, rng, max_id, warmup=1):
+    for _ in range(warmup):
+        fn(rng.randint(1, max_id))
+    samples = []
+    for _ in range(iterations):
+        patient_id = rng.randint(1, max_id)
+        start = time.perf_counter()
+        fn(patient_id)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def run_scale(name, patients, iterations, seed, warmup=1):
+    from click.testing import CliRunner
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / f'bench_{name}.db'
+        started = time.perf_counter()
+        build_database(path, patients, seed)
+        build_seconds = time.perf_counter() - started
+        webapp.DB_PATH = cli.DB_PATH = path
+        client = webapp.app.test_client()
+        runner = CliRunner()
+        rng = random.Random(seed)
+        results = {}
+        # a new weekday slot per booking: the slot engine rejects a second booking of the same one
+        slots = (day for day in (datetime(2030, 1, 1, 9) + timedelta(days=n) for n in itertools.count())
+                 if day.weekday() in scheduling.CLINIC_DAYS)
+
+        for route in ROUTES:
+            def hit(patient_id, route=route):
+                response = client.get(route.format(patient_id=patient_id))
+                response.get_data()  # drain streamed responses
+                if response.status_code != 200:
+                    raise RuntimeError(f'{route} returned {response.status_code}')
+            results['GET ' + route] = time_target(hit, iterations, rng, patients, warmup)
+
+        def book(patient_id):
+            response = client.post('/api/appointments', json={
+                'patient_id': patient_id, 'doctor_id': 2, 'appointment_datetime': next(slots).strftime('%Y-%m-%d %H:%M')})
+            if response.status_code != 201:
+                raise RuntimeError(f'/api/appointments returned {response.status_code}: {response.get_json()}')
+        results['POST /api/appointments'] = time_target(book, iterations, rng, patients, warmup)
+
+        for route in REVALIDATED:
+            response = client.get(route)
+            response.get_data()
+            etag = response.headers['ETag']
+
+            def revalidate(patient_id, route=route, etag=etag):
+                response = client.get(route, headers={'If-None-Match': etag})
+                if response.status_code != 304:
+                    raise RuntimeError(f'{route} returned {response.status_code}, not 304')
+            results['GET ' + route + ' (304)'] = time_target(revalidate, iterations, rng, patients, warmup)
+
+        for command in COMMANDS:
+            def invoke(patient_id, command=command):
+                slot = next(slots).strftime('%Y-%m-%d %H:%M')
+                res = runner.invoke(cli.cli, [arg.format(patient_id=patient_id, slot=slot) for arg in command])
+                if res.exit_code not in (0, None):
+                    raise RuntimeError(f'{command} exited {res.exit_code}: {res.output}')
+            results['cli ' + ' '.join(command)] = time_target(invoke, iterations, rng, patients, warmup)
+
+        webapp.db.discard(path)
+    return {'patients': patients, 'build_seconds': round(build_seconds, 2),
+            'peak_rss_kb': peak_rss_kb(), 'targets': results}
+
+
+def run_scale_subprocess(scale, args):
+    """run_scale() in a fresh interpreter, so peak_rss_kb() covers this scale only."""
+    command = [sys.executable, __file__, '--scales', scale, '--iterations', str(args.iterations),
+               '--warmup', str(args.warmup), '--seed', str(args.seed), '--in-process']
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True, text=True).stdout
+    return json.loads(output)['scales'][scale]
+
+
+def compare(current, baseline, threshold, min_ms):
+    """Return (scale, target, baseline p95, current p95) for every regression."""
+    regressions = []
+    for scale, result in current['scales'].items():
+        base = baseline.get('scales', {}).get(scale)
+        if not base:
+            continue
+        for target, stats in result['targets'].items():
+            old = base['targets'].get(target)
+            if not old:
+                continue
+            if stats['p95_ms'] > old['p95_ms'] * (1 + threshold) and stats['p95_ms'] - old['p95_ms'] > min_ms:
+                regressions.append((scale, target, old['p95_ms'], stats['p95_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark routes, CLI commands and reports')
+    parser.add_argument('--scales', default='1k', help=f'Comma-separated scales from {sorted(seed_data.SCALES)} or patient counts')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed calls per target before measuring')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='Write the JSON results to this file (default: stdout)')
+    parser.add_argument('--baseline', help='Compare against a stored results file and flag regressions')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed p95 slowdown vs baseline (0.25 = 25%%)')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='Ignore p95 differences smaller than this')
+    parser.add_argument('--in-process', action='store_true',
+                        help='Run the scales in this process (peak RSS is then the largest so far)')
+    args = parser.parse_args()
+
+    results = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                 'iterations': args.iterations, 'warmup': args.warmup, 'seed': args.seed, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'scales': {},
+    }
+    for scale in args.scales.split(','):
+        patients = seed_data.SCALES.get(scale) or int(scale)
+        if args.in_process:
+            print(f'Benchmarking scale {scale} ({patients} patients)...', file=sys.stderr)
+            results['scales'][scale] = run_scale(scale, patients, args.iterations, args.seed, args.warmup)
+        else:
+            results['scales'][scale] = run_scale_subprocess(scale, args)
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding='utf-8')
+    else:
+        print(text)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        for scale, target, old, new in regressions:
+            print(f'REGRESSION [{scale}] {target}: p95 {old:.2f}ms -> {new:.2f}ms', file=sys.stderr)
+        print(f'{len(regressions)} regressions against {args.baseline}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
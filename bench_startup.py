@@ -0,0 +1,102 @@
+"""Cold-start benchmark for cli.py, with a budget for scripted/cron use.
+
+Each command runs in a fresh interpreter against a small scratch database
+(already stamped by schema_version, so no migrations run). The median time
+above a bare ``python -c pass`` is compared to the budget. The run fails if
+any command goes over budget, or if ``cli.py --help`` pulls in modules that
+should load only when a command needs them.
+
+    python bench_startup.py --runs 20 --budget-ms 100
+"""
+import argparse
+import contextlib
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import db
+import schema_version
+import seed_data
+from init_db import init_db
+
+HERE = Path(__file__).parent
+
+COMMANDS = [
+    ['--help'],
+    ['list-patients', '--limit', '1'],
+    ['patient-history', '1'],
+    ['report-overdue-bills'],
+    ['report-doctor-workload', '--format', 'csv'],
+]
+
+# must not be imported just to parse the command line
+LAZY_MODULES = ('flask', 'werkzeug', 'jinja2', 'sqlite3', 'db', 'reports', 'query_cache',
+                'bulk_import', 'index_advisor', 'concurrent.futures')
+
+RUN_CLI = "import sys; from pathlib import Path; import cli; cli.DB_PATH = Path(sys.argv[1]); cli.cli(sys.argv[2:], prog_name='cli.py')"
+CHECK_IMPORTS = ("import sys, cli\n"
+                 "try:\n    cli.cli(['--help'], prog_name='cli.py')\nexcept SystemExit:\n    pass\n"
+                 "print(','.join(m for m in sys.argv[1:] if m in sys.modules), file=sys.stderr)")
+
+
+def median_ms(argv, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def build_database(path):
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db(path)
+        schema_version.apply(path)
+    conn = db.connect(path)
+    seed_data.generate(conn, 1000, progress=None)
+    conn.close()
+    db.discard(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cli.py cold-start time against a budget')
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, default=100.0, help='Allowed median time above bare interpreter startup')
+    parser.add_argument('--out', help='Also write the JSON results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'startup.db'
+        build_database(path)
+        bare = median_ms([sys.executable, '-c', 'pass'], args.runs)
+        results = {'python': sys.version.split()[0], 'bare_ms': round(bare, 1), 'budget_ms': args.budget_ms, 'commands': {}}
+        over = []
+        for command in COMMANDS:
+            ms = median_ms([sys.executable, '-c', RUN_CLI, str(path)] + command, args.runs)
+            name = ' '.join(command)
+            results['commands'][name] = {'median_ms': round(ms, 1), 'over_bare_ms': round(ms - bare, 1)}
+            if ms - bare > args.budget_ms:
+                over.append(name)
+
+    loaded = subprocess.run([sys.executable, '-c', CHECK_IMPORTS, *LAZY_MODULES], cwd=HERE,
+                            capture_output=True, text=True, check=True).stderr.strip()
+    results['eager_imports'] = loaded.split(',') if loaded else []
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text, encoding='utf-8')
+    for name in over:
+        print(f'OVER BUDGET: cli.py {name}: {results["commands"][name]["over_bare_ms"]} ms > {args.budget_ms} ms', file=sys.stderr)
+    if results['eager_imports']:
+        print(f'EAGER IMPORTS at startup: {", ".join(results["eager_imports"])}', file=sys.stderr)
+    if over or results['eager_imports']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
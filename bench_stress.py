@@ -0,0 +1,139 @@
+"""Stress benchmark: concurrent report readers against appointment writers.
+
+Builds a seeded scratch database per storage profile and hammers it from
+several threads for a fixed time:
+
+- ``legacy``: rollback journal, one fresh connection per operation and every
+  writer thread racing for the database lock (how app.py used to work).
+- ``tuned``: WAL, pooled reader connections and all writes funneled through
+  the single ``db.WriteQueue`` thread.
+
+Usage: python bench_stress.py --readers 8 --writers 4 --seconds 5
+"""
+import argparse
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import db
+import seed_data
+from init_db import init_db
+from migrate_db import apply_migration
+
+READ_SQL = '''
+    SELECT d.doctor_id, COUNT(a.appointment_id) AS upcoming_appointments
+    FROM doctors d
+    LEFT JOIN appointments a ON a.doctor_id = d.doctor_id
+    GROUP BY d.doctor_id
+'''
+WRITE_SQL = 'INSERT INTO appointments (patient_id, doctor_id, appointment_datetime, reason) VALUES (1, 1, ?, ?)'
+
+
+def build_db(path, profile):
+    init_db(path, profile=profile)
+    apply_migration(path)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    db.apply_pragmas(conn, profile)
+    seed_data.seed_departments(conn)
+    seed_data.seed_medications(conn)
+    seed_data.seed_doctors(conn)
+    seed_data.seed_patients(conn)
+    visit_ids = seed_data.seed_appointments_and_visits(conn)
+    seed_data.seed_prescriptions_and_adjust_bills(conn, visit_ids)
+    conn.close()
+
+
+def legacy_ops(path):
+    def connect():
+        conn = sqlite3.connect(path)
+        db.apply_pragmas(conn, 'legacy')
+        return conn
+
+    def read():
+        conn = connect()
+        conn.execute(READ_SQL).fetchall()
+        conn.close()
+
+    def write(i):
+        conn = connect()
+        conn.execute(WRITE_SQL, ('2030-01-01 10:00', f'stress {i}'))
+        conn.commit()
+        conn.close()
+    return read, write, lambda: None
+
+
+def tuned_ops(path):
+    pool = db.ConnectionPool(path, profile='tuned')
+    writer = db.WriteQueue(path, profile='tuned')
+
+    def read():
+        conn = pool.acquire()
+        conn.execute(READ_SQL).fetchall()
+        conn.close()
+
+    def write(i):
+        writer.run(lambda conn: conn.execute(WRITE_SQL, ('2030-01-01 10:00', f'stress {i}')))
+
+    def shutdown():
+        writer.stop()
+        pool.close_all()
+    return read, write, shutdown
+
+
+def run_profile(profile, readers, writers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'stress.db'
+        build_db(path, profile)
+        read, write, shutdown = (legacy_ops if profile == 'legacy' else tuned_ops)(path)
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def worker(kind):
+            i = 0
+            while time.perf_counter() < deadline:
+                try:
+                    if kind == 'reads':
+                        read()
+                    else:
+                        write(i)
+                    key = kind
+                except sqlite3.OperationalError:
+                    key = 'errors'
+                i += 1
+                with lock:
+                    counts[key] += 1
+
+        threads = [threading.Thread(target=worker, args=('reads',)) for _ in range(readers)]
+        threads += [threading.Thread(target=worker, args=('writes',)) for _ in range(writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        shutdown()
+    counts['reads_per_s'] = counts['reads'] / seconds
+    counts['writes_per_s'] = counts['writes'] / seconds
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = {}
+    for profile in ('legacy', 'tuned'):
+        results[profile] = r = run_profile(profile, args.readers, args.writers, args.seconds)
+        print(f"{profile:7s} reads/s={r['reads_per_s']:9.1f} writes/s={r['writes_per_s']:8.1f} errors={r['errors']}")
+    legacy, tuned = results['legacy'], results['tuned']
+    total = lambda r: r['reads_per_s'] + r['writes_per_s']
+    print(f"throughput gain: {total(tuned) / max(total(legacy), 1e-9):.2f}x")
+
+
+if __name__ == '__main__':
+    main()
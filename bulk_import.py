@@ -0,0 +1,362 @@
+"""Bulk import of patients, appointments, visits and bills from CSV or NDJSON.
+
+Files are read as a stream and processed in chunks: each chunk is validated
+(required columns, date formats, and foreign keys checked with one IN query
+per referenced table), then inserted with ``executemany``. Commits happen
+every ``commit_every`` rows, so a large file runs in a few big transactions
+instead of one per row.
+
+Appointments are checked against the doctor's other appointments like a
+booking (scheduling.py): one that overlaps a stored or earlier imported one
+is rejected. Clinic hours and past dates are not enforced, so history can be
+imported.
+
+With ``defer=True`` the target table's secondary indexes and triggers are
+dropped for the duration of the load and recreated at the end. The work those
+triggers would have done (auto-created bills for visits, the billing
+summary, workload rollups, cache version counters) is then replayed once,
+set-based, for the keys above the table's largest key before the load; rows
+with an explicit key at or below it are rejected in that mode.
+
+The web upload goes through the app's single writer instead
+(``import_queued``): one writer job, and transaction, per chunk, so other
+writes run between chunks, and always with the triggers in place.
+"""
+import csv
+import io
+import json
+import sqlite3
+import time
+from collections import namedtuple
+
+import clinic_time
+import scheduling
+
+CHUNK_SIZE = 5000
+COMMIT_EVERY = 50000
+# stay well below SQLite's host parameter limit in the FK IN (...) probes
+IN_BATCH = 500
+
+# stamped: time columns set to the clinic's current time when missing (their
+# schema DEFAULT, CURRENT_TIMESTAMP, is UTC)
+TableSpec = namedtuple('TableSpec', 'key columns required fks datetimes stamped', defaults=((),))
+
+TABLES = {
+    'patients': TableSpec(
+        'patient_id',
+        ('patient_id', 'first_name', 'last_name', 'dob', 'gender', 'phone', 'email', 'address', 'insurance'),
+        ('first_name', 'last_name'), {}, ()),
+    'appointments': TableSpec(
+        'appointment_id',
+        ('appointment_id', 'patient_id', 'doctor_id', 'department_id', 'appointment_datetime', 'status', 'reason'),
+        ('patient_id', 'doctor_id', 'appointment_datetime'),
+        {'patient_id': ('patients', 'patient_id'), 'doctor_id': ('doctors', 'doctor_id'),
+         'department_id': ('departments', 'department_id')},
+        ('appointment_datetime',)),
+    'visits': TableSpec(
+        'visit_id',
+        ('visit_id', 'appointment_id', 'patient_id', 'doctor_id', 'visit_date', 'diagnosis', 'notes'),
+        ('patient_id', 'doctor_id'),
+        {'appointment_id': ('appointments', 'appointment_id'), 'patient_id': ('patients', 'patient_id'),
+         'doctor_id': ('doctors', 'doctor_id')},
+        ('visit_date',), ('visit_date',)),
+    'bills': TableSpec(
+        'bill_id',
+        ('bill_id', 'visit_id', 'patient_id', 'amount', 'status', 'issued_at', 'paid_at'),
+        ('patient_id', 'amount'),
+        {'visit_id': ('visits', 'visit_id'), 'patient_id': ('patients', 'patient_id')},
+        ('issued_at', 'paid_at'), ('issued_at',)),
+}
+
+ImportResult = namedtuple('ImportResult', 'table read inserted rejected seconds rejects')
+
+
+def detect_format(filename):
+    return 'ndjson' if filename.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+
+def iter_records(stream, fmt):
+    """Yield (line number, record dict) from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for n, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield n, json.loads(line)
+                except ValueError:
+                    yield n, None
+
+
+def _chunks(records, size):
+    chunk = []
+    for item in records:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _existing_ids(conn, table, column, values):
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), IN_BATCH):
+        batch = values[i:i + IN_BATCH]
+        marks = ', '.join('?' * len(batch))
+        found.update(r[0] for r in conn.execute(f'SELECT {column} FROM {table} WHERE {column} IN ({marks})', batch))
+    return found
+
+
+def _clean(spec, record):
+    """Return (column values, None) or (None, rejection reason) for one record."""
+    if not isinstance(record, dict):
+        return None, 'unparseable record'
+    values = {}
+    for col in spec.columns:
+        value = record.get(col)
+        values[col] = None if value in ('', None) else value
+    for col in spec.required:
+        if values[col] is None:
+            return None, f'missing {col}'
+    for col in spec.stamped:
+        if values[col] is None:
+            values[col] = clinic_time.clinic_timestamp()
+    for col in spec.datetimes:
+        if values[col] is not None:
+            try:
+                values[col] = clinic_time.normalize_datetime(str(values[col]))
+            except ValueError:
+                return None, f'bad {col}: {values[col]!r}'
+    return values, None
+
+
+def _key_reason(spec, values, key_floor):
+    """Why an explicit key cannot be replayed by a deferred load (keys above ``key_floor`` are)."""
+    key = values[spec.key]
+    if key_floor is None or key is None:
+        return None
+    try:
+        key = int(key)
+    except (TypeError, ValueError):
+        return f'bad {spec.key}: {key!r}'
+    if key <= key_floor:
+        return f'{spec.key} {key} is not above the existing keys (required with --defer)'
+    return None
+
+
+def _check_slots(conn, good, rejects):
+    """Drop appointments overlapping a stored one or an earlier row of the chunk."""
+    kept, taken = [], {}
+    for line, record, values in good:
+        if values['status'] != 'cancelled':
+            try:
+                doctor_id, minutes = int(values['doctor_id']), scheduling.to_minutes(values['appointment_datetime'])
+            except (TypeError, ValueError):
+                kept.append((line, record, values))  # left to the INSERT's constraints
+                continue
+            conflict = scheduling.stored_conflict(conn, doctor_id, minutes)
+            if conflict is None and any(abs(minutes - m) < scheduling.SLOT_MINUTES for m in taken.get(doctor_id, ())):
+                conflict = 'an earlier row of the file'
+            if conflict is not None:
+                rejects.append((line, f'doctor {doctor_id} already has an appointment at {conflict}', record))
+                continue
+            taken.setdefault(doctor_id, []).append(minutes)
+        kept.append((line, record, values))
+    return kept
+
+
+def _validate_chunk(conn, spec, chunk, key_floor=None):
+    """Split a chunk into insertable value dicts and (line, reason, record) rejects."""
+    good, rejects = [], []
+    for line, record in chunk:
+        values, reason = _clean(spec, record)
+        if values is not None:
+            reason = _key_reason(spec, values, key_floor)
+        if reason:
+            rejects.append((line, reason, record))
+        else:
+            good.append((line, record, values))
+    for col, (table, ref) in spec.fks.items():
+        wanted = {v[col] for _, _, v in good if v[col] is not None}
+        if not wanted:
+            continue
+        present = {str(x) for x in _existing_ids(conn, table, ref, wanted)}
+        kept = []
+        for line, record, values in good:
+            if values[col] is not None and str(values[col]) not in present:
+                rejects.append((line, f'unknown {col} {values[col]}', record))
+            else:
+                kept.append((line, record, values))
+        good = kept
+    return good, rejects
+
+
+def _begin(conn):
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+
+
+def _by_columns(spec, good):
+    """Group rows by the columns they have a value for: the others are left to their schema DEFAULT."""
+    groups = {}
+    for item in good:
+        values = item[2]
+        cols = tuple(c for c in spec.columns if values[c] is not None)
+        groups.setdefault(cols, []).append(item)
+    return groups.items()
+
+
+def _insert_chunk(conn, table, spec, good, rejects):
+    _begin(conn)
+    inserted = 0
+    for cols, items in _by_columns(spec, good):
+        sql = f'INSERT INTO {table} ({", ".join(cols)}) VALUES ({", ".join("?" * len(cols))})'
+        rows = [tuple(v[c] for c in cols) for _, _, v in items]
+        conn.execute('SAVEPOINT chunk')
+        try:
+            conn.executemany(sql, rows)
+            conn.execute('RELEASE chunk')
+            inserted += len(rows)
+            continue
+        except sqlite3.IntegrityError:
+            conn.execute('ROLLBACK TO chunk')
+        # a constraint failed somewhere in the batch: isolate the offending rows
+        for (line, record, _), row in zip(items, rows):
+            try:
+                conn.execute(sql, row)
+                inserted += 1
+            except sqlite3.Error as e:
+                rejects.append((line, str(e), record))
+        conn.execute('RELEASE chunk')
+    return inserted
+
+
+def _load_chunk(conn, table, spec, chunk, key_floor=None):
+    """Validate and insert one chunk; returns (inserted, rejects)."""
+    good, rejects = _validate_chunk(conn, spec, chunk, key_floor)
+    if table == 'appointments':
+        good = _check_slots(conn, good, rejects)
+    inserted = _insert_chunk(conn, table, spec, good, rejects) if good else 0
+    return inserted, rejects
+
+
+def drop_indexes_and_triggers(conn, table, keep=()):
+    """Drop the table's secondary indexes and triggers except ``keep``; return what was dropped."""
+    saved = [r for r in conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)) if r[1] not in keep]
+    _begin(conn)
+    for kind, name, _ in saved:
+        conn.execute(f'DROP {kind.upper()} {name}')
+    conn.commit()
+    return saved
+
+
+def recreate(conn, saved):
+    """Recreate dropped indexes/triggers that do not exist (again) yet."""
+    _begin(conn)
+    existing = {r[0] for r in conn.execute('SELECT name FROM sqlite_master')}
+    for _, name, sql in saved:
+        if name not in existing:
+            conn.execute(sql)
+
+
+def _restore(conn, table, saved, watermark):
+    """Recreate deferred indexes/triggers and replay their effect on the new rows."""
+    recreate(conn, saved)
+    names = {name for _, name, _ in saved}
+    if table == 'visits' and 'trg_create_bill_after_visit' in names:
+        # bills' own triggers are still active, so the summary and versions follow
+        conn.execute('''INSERT INTO bills (visit_id, patient_id, amount, status, issued_at)
+                        SELECT visit_id, patient_id, 50.0, 'unpaid', COALESCE(visit_date, CURRENT_TIMESTAMP)
+                        FROM visits WHERE visit_id > ?''', (watermark,))
+    if table == 'bills' and 'trg_billing_summary_insert' in names:
+        from migrate_billing_summary import rebuild
+        rebuild(conn)
+    if table == 'patients' and 'trg_patients_fts_insert' in names:
+        from patient_search import index_new_patients
+        index_new_patients(conn, watermark)
+    if f'trg_rollup_{table}_insert' in names:
+        from rollups import add_new
+        add_new(conn, table, watermark)
+    if any(name.startswith(f'trg_patient_version_{table}_') for name in names):
+        from patient_chart import invalidate_all
+        invalidate_all(conn)
+    if f'trg_version_{table}_INSERT' in names:
+        conn.execute('UPDATE table_versions SET version = version + 1 WHERE table_name = ?', (table,))
+    conn.commit()
+
+
+def import_stream(conn, table, stream, fmt='csv', chunk_size=CHUNK_SIZE, commit_every=COMMIT_EVERY,
+                  defer=False, progress=None):
+    """Import one table from a text stream; returns an ImportResult.
+
+    ``progress(read, inserted, rejected, seconds)`` is called after each chunk.
+    """
+    spec = TABLES[table]
+    start = time.perf_counter()
+    read = inserted = since_commit = 0
+    rejects = []
+    if conn.in_transaction:
+        conn.commit()
+    # rows above this key are new; deferred trigger work is replayed for them
+    watermark = conn.execute(f'SELECT COALESCE(MAX({spec.key}), 0) FROM {table}').fetchone()[0]
+    # the slot check of each imported appointment needs its index
+    keep = ('idx_appointments_doctor_slot',) if table == 'appointments' else ()
+    saved = drop_indexes_and_triggers(conn, table, keep) if defer else []
+    try:
+        for chunk in _chunks(iter_records(stream, fmt), chunk_size):
+            read += len(chunk)
+            n, chunk_rejects = _load_chunk(conn, table, spec, chunk, watermark if defer else None)
+            inserted += n
+            since_commit += n
+            rejects.extend(chunk_rejects)
+            if since_commit >= commit_every:
+                conn.commit()
+                since_commit = 0
+            if progress:
+                progress(read, inserted, len(rejects), time.perf_counter() - start)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if saved:
+            _restore(conn, table, saved, watermark)
+    return ImportResult(table, read, inserted, len(rejects), time.perf_counter() - start, rejects)
+
+
+def import_queued(writer, table, stream, fmt='csv', chunk_size=CHUNK_SIZE):
+    """Import one table through a db.WriteQueue, one job per chunk; returns an ImportResult."""
+    spec = TABLES[table]
+    start = time.perf_counter()
+    read = inserted = 0
+    rejects = []
+    for chunk in _chunks(iter_records(stream, fmt), chunk_size):
+        read += len(chunk)
+        n, chunk_rejects = writer.run(_load_chunk, table, spec, chunk)
+        inserted += n
+        rejects.extend(chunk_rejects)
+    return ImportResult(table, read, inserted, len(rejects), time.perf_counter() - start, rejects)
+
+
+def import_file(conn, table, path, fmt=None, **kwargs):
+    fmt = fmt or detect_format(str(path))
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return import_stream(conn, table, f, fmt, **kwargs)
+
+
+def write_rejects(rejects, out):
+    """Write (line, reason, record) rejects as CSV to a text stream."""
+    writer = csv.writer(out)
+    writer.writerow(['line', 'reason', 'record'])
+    for line, reason, record in rejects:
+        writer.writerow([line, reason, json.dumps(record)])
+
+
+def text_stream(binary):
+    return io.TextIOWrapper(binary, encoding='utf-8', newline='')
@@ -1,19 +1,43 @@
 import click
-import sqlite3
 from pathlib import Path
 
+import pagination
+
+# Cron jobs run these commands thousands of times a day, so only Click and
+# pagination's constants load up front: db, reports, clinic_time and the
+# maintenance modules are imported by the commands that use them.
+
 DB_PATH = Path(__file__).parent / 'hospital.db'
 
+# commands that must not trigger the startup schema check
+NO_SCHEMA_CHECK = ('init-db', 'migrate')
+
+
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA foreign_keys = ON;')
-    return conn
+    """Check out a pooled connection; ``conn.close()`` returns it to the pool."""
+    import db
+    return db.connect(DB_PATH)
 
 
-@click.group()
-def cli():
-    pass
+class CLI(click.Group):
+    """Keeps the subcommand's arguments in ``ctx.meta`` for the startup check."""
+
+    def resolve_command(self, ctx, args):
+        name, command, rest = super().resolve_command(ctx, args)
+        ctx.meta['cli.args'] = rest
+        return name, command, rest
+
+
+@click.group(cls=CLI)
+@click.pass_context
+def cli(ctx):
+    import query_metrics
+    query_metrics.set_caller(f'cli:{ctx.invoked_subcommand}')
+    # printing a command's help (or completing it) must not open the database
+    wants_help = ctx.resilient_parsing or any(arg in ctx.help_option_names for arg in ctx.meta.get('cli.args', ()))
+    if ctx.invoked_subcommand not in NO_SCHEMA_CHECK and not wants_help:
+        import schema_version
+        schema_version.ensure(DB_PATH)
 
 
 @cli.command('init-db')
@@ -24,14 +48,40 @@ def init_db_cmd():
 
 
 @cli.command('list-patients')
-def list_patients():
+@click.option('--limit', type=click.IntRange(1, pagination.MAX_PAGE_SIZE), help='Page size (default: all patients)')
+@click.option('--after', help='Cursor printed at the end of the previous page')
+def list_patients(limit, after):
+    import queries
+    conn = get_conn()
+    if limit or after:
+        try:
+            page = queries.page(conn, 'patients.list', after=after, limit=limit)
+        except ValueError as e:
+            conn.close()
+            raise click.BadParameter(str(e), param_hint='--after')
+        rows, next_token = page.rows, page.next_token
+    else:
+        rows, next_token = queries.listing(conn, 'patients.list'), None
+    for r in rows:
+        click.echo(f"{r.patient_id:3d}  {r.last_name}, {r.first_name}  dob:{r.dob}  phone:{r.phone}")
+    conn.close()
+    if next_token:
+        click.echo(f"-- more: --after {next_token}")
+
+
+@cli.command('search-patients')
+@click.argument('query', nargs=-1, required=True)
+@click.option('--limit', type=click.IntRange(1, 50), default=10, show_default=True)
+def search_patients_cmd(query, limit):
+    """Find patients by the start of words in their name, phone, email or insurance"""
+    import patient_search
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('SELECT patient_id, first_name, last_name, dob, phone FROM patients ORDER BY last_name')
-    rows = cur.fetchall()
+    rows = patient_search.search(conn, ' '.join(query), limit)
     for r in rows:
-        click.echo(f"{r['patient_id']:3d}  {r['last_name']}, {r['first_name']}  dob:{r['dob']}  phone:{r['phone']}")
+        click.echo(f"{r['patient_id']:3d}  {r['last_name']}, {r['first_name']}  phone:{r['phone']}  email:{r['email']}")
     conn.close()
+    if not rows:
+        click.echo('No matching patients')
 
 
 @cli.command('add-patient')
@@ -43,10 +93,10 @@ def list_patients():
 @click.option('--address', required=False)
 @click.option('--insurance', required=False)
 def add_patient_cmd(first_name, last_name, dob, phone, email, address, insurance):
+    import queries
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('INSERT INTO patients (first_name, last_name, dob, phone, email, address, insurance) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                (first_name, last_name, dob, phone, email, address, insurance))
+    queries.execute(conn, 'patients.insert', first_name=first_name, last_name=last_name, dob=dob, phone=phone,
+                    email=email, address=address, insurance=insurance)
     conn.commit()
     conn.close()
     click.echo('Patient added')
@@ -58,114 +108,378 @@ def add_patient_cmd(first_name, last_name, dob, phone, email, address, insurance
 @click.option('--datetime', 'dt', required=True)
 @click.option('--reason', required=False, default='')
 def schedule_cmd(patient_id, doctor_id, dt, reason):
+    """Book an appointment; fails if the slot is taken, past, or outside clinic days and hours"""
+    import sqlite3
+    import scheduling
+    try:
+        from clinic_time import normalize_datetime
+        dt = normalize_datetime(dt)
+    except ValueError:
+        raise click.BadParameter('expected YYYY-MM-DD HH:MM', param_hint='--datetime')
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('INSERT INTO appointments (patient_id, doctor_id, appointment_datetime, reason) VALUES (?, ?, ?, ?)',
-                (patient_id, doctor_id, dt, reason))
-    conn.commit()
-    conn.close()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        scheduling.get_index(DB_PATH).book(conn, patient_id, doctor_id, dt, reason)
+        conn.commit()
+    except (scheduling.SlotTaken, scheduling.SlotUnavailable) as e:
+        conn.rollback()
+        raise click.ClickException(f"{e}. Next free: {', '.join(e.next_free) or 'none'}")
+    except (LookupError, sqlite3.IntegrityError):
+        conn.rollback()
+        raise click.ClickException('Unknown patient or doctor')
+    finally:
+        conn.close()
     click.echo('Appointment scheduled')
 
 
+@cli.command('free-slots')
+@click.option('--doctor-id', type=int, help='One doctor')
+@click.option('--department-id', type=int, help='Any doctor of a department')
+@click.option('--count', type=click.IntRange(1, 100), default=10, show_default=True)
+@click.option('--after', help='Search from YYYY-MM-DD HH:MM (default: now)')
+def free_slots_cmd(doctor_id, department_id, count, after):
+    """Next free appointment slots for a doctor or a department"""
+    import scheduling
+    if (doctor_id is None) == (department_id is None):
+        raise click.UsageError('give exactly one of --doctor-id and --department-id')
+    if after:
+        try:
+            from clinic_time import normalize_datetime
+            after = normalize_datetime(after)
+        except ValueError:
+            raise click.BadParameter('expected YYYY-MM-DD HH:MM', param_hint='--after')
+    conn = get_conn()
+    index = scheduling.get_index(DB_PATH)
+    if doctor_id is not None:
+        for slot in index.next_free(conn, doctor_id, count, after):
+            click.echo(slot)
+    else:
+        for slot, doctor in index.next_free_in_department(conn, department_id, count, after):
+            click.echo(f'{slot}  doctor:{doctor}')
+    conn.close()
+
+
 @cli.command('patient-history')
 @click.argument('patient_id', type=int)
 def patient_history_cmd(patient_id):
+    """Show a patient's visits with their prescriptions and bills"""
+    import patient_chart
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM patients WHERE patient_id = ?', (patient_id,))
-    p = cur.fetchone()
-    if not p:
+    chart = patient_chart.get_cache(DB_PATH).get(conn, patient_id)
+    conn.close()
+    if chart is None:
         click.echo('Patient not found')
         return
-    click.echo(f"Patient: {p['first_name']} {p['last_name']} (id {p['patient_id']})")
+    p = chart.patient
+    click.echo(f"Patient: {p.first_name} {p.last_name} (id {p.patient_id})")
     click.echo('\nVisits:')
-    cur.execute('SELECT visit_id, visit_date, diagnosis FROM visits WHERE patient_id = ? ORDER BY visit_date DESC', (patient_id,))
-    for v in cur.fetchall():
-        click.echo(f" - {v['visit_date']} id:{v['visit_id']} diag:{v['diagnosis']}")
-    click.echo('\nPrescriptions:')
-    cur.execute('''
-        SELECT pr.prescription_id, pr.medication, pr.dosage, pr.prescribed_at
-        FROM prescriptions pr
-        JOIN visits v ON pr.visit_id = v.visit_id
-        WHERE v.patient_id = ?
-    ''', (patient_id,))
-    for r in cur.fetchall():
-        click.echo(f" - {r['prescribed_at']}: {r['medication']} {r['dosage']}")
-    conn.close()
+    for v in chart.visits:
+        click.echo(f" - {v.visit_date} id:{v.visit_id} diag:{v.diagnosis} dr:{v.doctor_first} {v.doctor_last}")
+        for r in v.prescriptions:
+            click.echo(f"     rx {r.prescribed_at}: {r.medication} {r.dosage}")
+        for b in v.bills:
+            click.echo(f"     bill {b.issued_at}: {b.amount:.2f} {b.status}")
+    if chart.other_bills:
+        click.echo('\nOther bills:')
+        for b in chart.other_bills:
+            click.echo(f" - {b.issued_at}: {b.amount:.2f} {b.status}")
+
+
+format_option = click.option('--format', 'fmt', type=click.Choice(['text', 'csv', 'ndjson']), default='text',
+                             show_default=True, help='Output format')
+
+
+def get_report_conn():
+    """Connection for reports: the snapshot file if HOSPITAL_REPORT_SNAPSHOT=file, else the live pool."""
+    import snapshot
+    snap = snapshot.get_snapshot(DB_PATH)
+    if snap.mode != 'file':
+        return get_conn()
+    conn = snap.connect(background=False)
+    click.echo(f"Report snapshot taken {snap.info().age:.0f}s ago", err=True)
+    return conn
+
+
+def echo_report(name, fmt, line, args=None):
+    """Stream report ``name`` to stdout, formatting text rows with ``line``."""
+    import reports
+    conn = get_report_conn()
+    columns, rows = reports.run_report(conn, name, args=args)
+    if fmt == 'text':
+        for r in rows:
+            click.echo(line(r))
+    else:
+        for chunk in reports.export(fmt, columns, rows):
+            click.echo(chunk, nl=False)
     conn.close()
 
 
 @cli.command('report-billing')
-def cli_report_billing():
+@format_option
+def cli_report_billing(fmt):
     """Print billing summary per patient"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT p.patient_id, p.first_name || ' ' || p.last_name AS patient_name,
-               SUM(b.amount) AS total_billed,
-               SUM(CASE WHEN b.status = 'unpaid' THEN b.amount ELSE 0 END) AS total_unpaid
-        FROM bills b
-        JOIN patients p ON b.patient_id = p.patient_id
-        GROUP BY p.patient_id, patient_name
-        ORDER BY total_unpaid DESC
-    ''')
-    for r in cur.fetchall():
-        click.echo(f"{r['patient_id']:3d} {r['patient_name']:30s} billed={r['total_billed'] or 0:.2f} unpaid={r['total_unpaid'] or 0:.2f}")
-    conn.close()
+    echo_report('billing', fmt, lambda r: f"{r.patient_id:3d} {r.patient_name:30s} billed={r.total_billed or 0:.2f} unpaid={r.total_unpaid or 0:.2f} bills={r.bill_count}")
 
 
 @cli.command('report-doctor-workload')
-def cli_report_doctor_workload():
+@format_option
+def cli_report_doctor_workload(fmt):
     """Print doctor workload (appointments next 7 days)"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT d.doctor_id, d.first_name || ' ' || d.last_name AS doctor_name,
-               COUNT(a.appointment_id) AS upcoming_appointments
-        FROM doctors d
-        LEFT JOIN appointments a ON a.doctor_id = d.doctor_id
-            AND date(a.appointment_datetime) BETWEEN date('now') AND date('now', '+7 days')
-        GROUP BY d.doctor_id, doctor_name
-        ORDER BY upcoming_appointments DESC
-    ''')
-    for r in cur.fetchall():
-        click.echo(f"{r['doctor_id']:3d} {r['doctor_name']:25s} upcoming={r['upcoming_appointments']}")
-    conn.close()
+    echo_report('doctor-workload', fmt, lambda r: f"{r.doctor_id:3d} {r.doctor_name:25s} upcoming={r.upcoming_appointments}")
 
 
 @cli.command('report-daily-appointments')
-def cli_report_daily_appointments():
+@format_option
+def cli_report_daily_appointments(fmt):
     """Print today's appointments"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT a.appointment_id, a.appointment_datetime, p.first_name || ' ' || p.last_name AS patient_name,
-               d.first_name || ' ' || d.last_name AS doctor_name
-        FROM appointments a
-        JOIN patients p ON a.patient_id = p.patient_id
-        JOIN doctors d ON a.doctor_id = d.doctor_id
-        WHERE date(a.appointment_datetime) = date('now')
-        ORDER BY a.appointment_datetime
-    ''')
-    for r in cur.fetchall():
-        click.echo(f"{r['appointment_id']:3d} {r['appointment_datetime']} {r['patient_name']:25s} -> {r['doctor_name']}")
-    conn.close()
+    echo_report('daily-appointments', fmt, lambda r: f"{r.appointment_id:3d} {r.appointment_datetime} {r.patient_name:25s} -> {r.doctor_name}")
 
 
 @cli.command('report-overdue-bills')
-def cli_report_overdue_bills():
+@format_option
+def cli_report_overdue_bills(fmt):
     """Print overdue unpaid bills (issued >30 days ago)"""
+    echo_report('overdue-bills', fmt, lambda r: f"{r.bill_id:3d} {r.issued_at} {r.patient_name:25s} amount={r.amount:.2f}")
+
+
+@cli.command('report-workload')
+@click.option('--start', help='First day (YYYY-MM-DD)  [default: 11 months before this month]')
+@click.option('--end', help='Day after the last one (YYYY-MM-DD)  [default: tomorrow]')
+@click.option('--grain', type=click.Choice(['day', 'week', 'month', 'year']), default='month', show_default=True)
+@click.option('--by', type=click.Choice(['department', 'doctor']), default='department', show_default=True)
+@format_option
+def cli_report_workload(start, end, grain, by, fmt):
+    """Print appointments and visits per period and department or doctor (from the rollups)"""
+    import reports
+    args = {'start': start, 'end': end, 'grain': grain, 'by': by}
+    try:
+        reports.workload_params(args)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--start/--end')
+    echo_report('workload', fmt, lambda r: f"{r.period} {r.name:30s} appointments={r.appointments} "
+                                          f"completed={r.completed} cancelled={r.cancelled} "
+                                          f"no_show={r.no_show} visits={r.visits}", args)
+
+
+@cli.command('report-ar-aging')
+@click.option('--as-of', help='Age bills as of this date (YYYY-MM-DD)  [default: today]')
+@click.option('--months', type=click.IntRange(1, 120), default=12, show_default=True,
+              help='Months of collection trends')
+@click.option('--format', 'fmt', type=click.Choice(['text', 'json']), default='text', show_default=True,
+              help='Output format')
+def cli_report_ar_aging(as_of, months, fmt):
+    """Print accounts-receivable aging, DSO and monthly collection trends (needs NumPy)"""
+    import json
+    import ar_aging
+    try:
+        as_of = ar_aging.parse_as_of(as_of)
+    except ValueError:
+        raise click.BadParameter('expected YYYY-MM-DD', param_hint='--as-of')
+    conn = get_report_conn()
+    try:
+        aging = ar_aging.report(conn, as_of, months)
+    except ar_aging.MissingNumPy as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    if fmt == 'json':
+        out = aging._asdict()
+        out['buckets'] = [b._asdict() for b in aging.buckets]
+        out['months'] = [m._asdict() for m in aging.months]
+        click.echo(json.dumps(out, indent=2))
+        return
+    click.echo(f"AR aging as of {aging.as_of}: receivables={aging.receivables:.2f} dso={aging.dso} "
+               f"bills={aging.bills} ({aging.seconds:.3f}s)")
+    for b in aging.buckets:
+        click.echo(f"  {b.label:>6s} days  bills={b.bills:<7d} patients={b.patients:<7d} amount={b.amount:.2f}")
+    for m in aging.months:
+        rate = f"{m.collection_rate:.1%}" if m.collection_rate is not None else '-'
+        click.echo(f"  {m.month}  billed={m.billed:.2f} collected={m.collected:.2f} rate={rate} "
+                   f"days_to_pay={m.avg_days_to_pay} receivables={m.receivables:.2f} dso={m.dso}")
+
+
+@cli.command('refresh-snapshot')
+def refresh_snapshot_cmd():
+    """Rewrite the report snapshot file now (HOSPITAL_REPORT_SNAPSHOT=file)"""
+    import snapshot
+    path = snapshot.default_path(DB_PATH)
+    seconds = snapshot.write_file(DB_PATH, path)
+    click.echo(f"Snapshot written to {path} in {seconds:.2f}s")
+
+
+@cli.command('import')
+@click.argument('table', type=click.Choice(['patients', 'appointments', 'visits', 'bills']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Input format (default: from file extension)')
+@click.option('--chunk-size', type=int, default=5000, show_default=True, help='Rows validated and inserted per batch')
+@click.option('--commit-every', type=int, default=50000, show_default=True, help='Rows per transaction')
+@click.option('--defer', is_flag=True, help='Drop the table\'s indexes/triggers during the load and rebuild them at the end')
+@click.option('--rejects', 'rejects_path', type=click.Path(dir_okay=False), help='Write rejected rows to this CSV file')
+def import_cmd(table, path, fmt, chunk_size, commit_every, defer, rejects_path):
+    """Bulk-import TABLE rows from a CSV or NDJSON file"""
+    import bulk_import
+
+    def progress(read, inserted, rejected, seconds):
+        click.echo(f"  read={read} inserted={inserted} rejected={rejected} ({read / max(seconds, 1e-9):.0f} rows/s)")
+
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT b.bill_id, b.issued_at, b.amount, p.first_name || ' ' || p.last_name AS patient_name
-        FROM bills b JOIN patients p ON b.patient_id = p.patient_id
-        WHERE b.status = 'unpaid' AND date(b.issued_at) <= date('now', '-30 days')
-        ORDER BY b.issued_at
-    ''')
-    for r in cur.fetchall():
-        click.echo(f"{r['bill_id']:3d} {r['issued_at']} {r['patient_name']:25s} amount={r['amount']:.2f}")
+    result = bulk_import.import_file(conn, table, path, fmt, chunk_size=chunk_size, commit_every=commit_every,
+                                     defer=defer, progress=progress)
     conn.close()
+    click.echo(f"Imported {result.inserted} of {result.read} {table} rows in {result.seconds:.2f}s "
+               f"({result.read / max(result.seconds, 1e-9):.0f} rows/s), {result.rejected} rejected")
+    for line, reason, _ in result.rejects[:10]:
+        click.echo(f"  line {line}: {reason}")
+    if rejects_path and result.rejects:
+        with open(rejects_path, 'w', encoding='utf-8', newline='') as f:
+            bulk_import.write_rejects(result.rejects, f)
+        click.echo(f"Rejected rows written to {rejects_path}")
+
+
+@cli.command('migrate')
+@click.option('--status', 'show_status', is_flag=True, help='Show applied/pending migrations and backfill progress')
+@click.option('--target', type=int, help='Stop after this migration version')
+@click.option('--no-backfill', is_flag=True, help='Apply schema changes only; run the backfills later')
+@click.option('--batch-size', type=click.IntRange(1), default=1000, show_default=True, help='Initial key range per backfill transaction')
+@click.option('--pause', type=float, default=0.02, show_default=True, help='Seconds to sleep between backfill batches')
+def migrate_cmd(show_status, target, no_backfill, batch_size, pause):
+    """Apply pending migrations, then run their batched backfills"""
+    import schema_version
+    if show_status:
+        applied, pending, backfills, stamped = schema_version.status(DB_PATH)
+        for version, name, applied_at in applied:
+            click.echo(f"{version:04d} {name:30s} applied {applied_at}")
+        for m in pending:
+            click.echo(f"{m.version:04d} {m.name:30s} pending")
+        for name, next_key, max_key, rows, done, updated_at in backfills:
+            state = 'done' if done else f"at key {next_key} of {max_key if max_key is not None else '?'}"
+            click.echo(f"backfill {name:30s} {state}, {rows} rows changed (updated {updated_at})")
+        click.echo(f"user_version = {stamped}")
+        return
+    applied = schema_version.migrate(DB_PATH, target=target)
+    click.echo(f"{len(applied)} migrations applied")
+    if no_backfill or target is not None:
+        return
+
+    def progress(name, key, max_key, rows):
+        click.echo(f"\r{name}: key {key}/{max_key}, {rows} rows changed", nl=False)
+
+    for name, rows in schema_version.run_backfills(DB_PATH, batch_size, pause, progress).items():
+        click.echo(f"\nBackfill {name} done: {rows} rows changed")
+    if schema_version.stamp(DB_PATH):
+        click.echo(f"Database is current (user_version {schema_version.latest_version()})")
+
+
+@cli.command('rebuild-summaries')
+@click.option('--check', 'check_only', is_flag=True, help='Only report summary rows that disagree with bills')
+def rebuild_summaries_cmd(check_only):
+    """Backfill or verify the patient_billing_summary table"""
+    from migrate_billing_summary import check, rebuild
+    conn = get_conn()
+    mismatches = check(conn)
+    for pid, expected, stored in mismatches:
+        click.echo(f"patient {pid}: expected={expected} stored={stored}")
+    click.echo(f"{len(mismatches)} summary rows out of sync")
+    if not check_only:
+        click.echo(f"Rebuilt {rebuild(conn)} summary rows")
+    conn.close()
+    if check_only and mismatches:
+        raise SystemExit(1)
+
+
+@cli.command('rebuild-rollups')
+@click.option('--check', 'check_only', is_flag=True, help='Only report rollup rows that disagree with a recount')
+@click.option('--archive', 'archive_path', type=click.Path(dir_okay=False),
+              help='Archive database whose rows count too  [default: hospital_archive.db if present]')
+def rebuild_rollups_cmd(check_only, archive_path):
+    """Backfill or verify the workload rollups (appointments_daily and friends)"""
+    import archive
+    import rollups
+    if archive_path is None and archive.default_archive_path(DB_PATH).exists():
+        archive_path = archive.default_archive_path(DB_PATH)
+    conn = get_conn()
+    mismatches = rollups.check(conn, archive_path)
+    for rollup, key, expected, stored in mismatches[:20]:
+        click.echo(f"{rollup} {key}: expected={expected} stored={stored}")
+    click.echo(f"{len(mismatches)} rollup rows out of sync")
+    if not check_only:
+        counts = rollups.rebuild(conn, archive_path)
+        click.echo('Rebuilt ' + ', '.join(f"{rollup} ({rows} rows)" for rollup, rows in counts.items()))
+    conn.close()
+    if check_only and mismatches:
+        raise SystemExit(1)
+
+
+@cli.command('index-advisor')
+@click.option('--strict', is_flag=True, help='Exit non-zero if any unexpected full-table scan is found')
+def index_advisor_cmd(strict):
+    """Run EXPLAIN QUERY PLAN over the registered queries and flag full scans"""
+    from index_advisor import advise
+    conn = get_conn()
+    flagged = 0
+    for name, plan, scans in advise(conn):
+        status = 'FULL SCAN: ' + ', '.join(scans) if scans else 'ok'
+        click.echo(f"{name:32s} {status}")
+        for step in plan:
+            click.echo(f"    {step}")
+        flagged += bool(scans)
+    conn.close()
+    click.echo(f"\n{flagged} queries with unexpected full-table scans")
+    if strict and flagged:
+        raise SystemExit(1)
+
+
+@cli.command('archive-patients')
+@click.option('--inactive-days', type=click.IntRange(1), default=None, help='Archive patients with no activity for this many days (default: 3 years)')
+@click.option('--batch-size', type=click.IntRange(1), default=None, help='Patient ids per batch (default: 500)')
+@click.option('--pause', type=float, default=None, help='Seconds to sleep between batches')
+@click.option('--archive', 'archive_path', type=click.Path(dir_okay=False), help='Archive database (default: hospital_archive.db)')
+@click.option('--dry-run', is_flag=True, help='Only count the patients that would be archived')
+@click.option('--status', 'show_status', is_flag=True, help='Show archive runs and their checkpoints')
+@click.option('--restart', is_flag=True, help='Abandon an unfinished run and start a new one')
+def archive_patients_cmd(inactive_days, batch_size, pause, archive_path, dry_run, show_status, restart):
+    """Move inactive patients and their records into the archive database"""
+    import archive
+    if show_status:
+        for run_id, cutoff, path, next_key, max_key, patients, done, started_at, updated_at in archive.runs(DB_PATH):
+            state = 'done' if done else f"at patient id {next_key} of {max_key}"
+            click.echo(f"run {run_id}: cutoff {cutoff}, {patients} patients -> {path}, {state} "
+                       f"(started {started_at}, updated {updated_at})")
+        return
+    inactive_days = inactive_days or archive.INACTIVE_DAYS
+    if dry_run:
+        click.echo(f"{archive.count_inactive(DB_PATH, inactive_days)} patients inactive since "
+                   f"{archive.cutoff_for(inactive_days)}")
+        return
+
+    def progress(key, max_key, moved):
+        click.echo(f"\rpatient id {key}/{max_key}, {moved} archived", nl=False)
+
+    result = archive.run(DB_PATH, archive_path, inactive_days, batch_size or archive.BATCH_SIZE,
+                         archive.PAUSE if pause is None else pause, restart, progress)
+    click.echo(f"\nRun {result['run_id']}: {result['patients']} patients inactive since {result['cutoff']} "
+               f"moved to {result['archive']} in {result['batches']} batches, {result['seconds']}s "
+               f"(slowest batch {result['slowest_batch_ms']} ms)")
+    if result['stale_copies_removed']:
+        click.echo(f"Removed {result['stale_copies_removed']} archive copies left by an interrupted run")
+
+
+@cli.command('vacuum')
+@click.option('--full', is_flag=True, help='Run a full VACUUM (rewrites the file; switches old databases to incremental auto-vacuum)')
+@click.option('--archive', 'archive_path', type=click.Path(dir_okay=False, exists=True), help='Also vacuum this archive database')
+def vacuum_cmd(full, archive_path):
+    """Reclaim free pages incrementally, refresh planner statistics and truncate the WAL"""
+    import maintenance
+    for path in (DB_PATH, archive_path):
+        if path is None:
+            continue
+        result = maintenance.vacuum(path, full=full)
+        page_size, pages, free, mode = result['before']
+        _, pages_after, free_after, mode_after = result['after']
+        click.echo(f"{path}: {pages} pages ({free} free) -> {pages_after} pages ({free_after} free), "
+                   f"{(pages - pages_after) * page_size // 1024} KiB reclaimed, auto_vacuum={mode_after}")
+        if mode_after != 'incremental' and free_after:
+            click.echo("  free pages are only reused, not released: run once with --full to enable incremental vacuum")
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,65 @@
+"""Clinic-local dates for the time-window reports.
+
+Reports used to compare ``date(column)`` against SQLite's ``date('now')``,
+which is UTC and stops SQLite from using an index on the column. Instead the
+window bounds are computed here once per request, in the clinic's timezone,
+and compared against the raw column as half-open ranges
+(``col >= start AND col < end``). Stored timestamps are 'YYYY-MM-DD HH:MM'
+strings, so plain string comparison against 'YYYY-MM-DD' bounds is correct.
+
+That needs the stored timestamps to be clinic-local too. SQLite's
+CURRENT_TIMESTAMP is UTC, so the app never relies on the schema's defaults
+for report columns: writers pass ``clinic_timestamp()``, and a visit's bill
+is issued at the visit's time (migration 0011). The defaults remain only for
+rows written outside the app.
+"""
+import os
+from datetime import date, datetime, timedelta
+
+# IANA zone name, e.g. 'Asia/Kolkata'. Unset means the server's local time.
+CLINIC_TZ = os.environ.get('CLINIC_TZ')
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+_INPUT_FORMATS = ('%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S')
+
+
+def clinic_now():
+    if CLINIC_TZ:
+        from zoneinfo import ZoneInfo
+        return datetime.now(ZoneInfo(CLINIC_TZ)).replace(tzinfo=None)
+    return datetime.now()
+
+
+def clinic_timestamp():
+    """The clinic's current time in the stored 'YYYY-MM-DD HH:MM' form."""
+    return clinic_now().strftime(DATETIME_FORMAT)
+
+
+def clinic_today():
+    return clinic_now().date()
+
+
+def day_range(days=1, offset=0, today=None):
+    """Half-open [start, end) bounds covering ``days`` days from today + ``offset``."""
+    start = (today or clinic_today()) + timedelta(days=offset)
+    return start.isoformat(), (start + timedelta(days=days)).isoformat()
+
+
+def days_ago(days, today=None):
+    """Exclusive upper bound for 'on or before ``days`` days ago'."""
+    return ((today or clinic_today()) - timedelta(days=days - 1)).isoformat()
+
+
+def normalize_datetime(value):
+    """Parse a user-entered date/time into the stored 'YYYY-MM-DD HH:MM' form.
+
+    Raises ValueError for anything that is not a recognizable date/time, so
+    malformed values never reach the range-compared columns.
+    """
+    value = (value or '').strip()
+    for fmt in _INPUT_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime(DATETIME_FORMAT)
+        except ValueError:
+            pass
+    return datetime.combine(date.fromisoformat(value), datetime.min.time()).strftime(DATETIME_FORMAT)
@@ -0,0 +1,271 @@
+"""Shared SQLite connection pool used by the web app, the CLI and the seeder.
+
+Connections are created once with the connection pragmas already applied and
+then handed out again and again instead of being reopened for every request.
+Calling ``close()`` on a pooled connection returns it to its pool; the real
+SQLite handle is only closed by ``ConnectionPool.close_all()``.
+
+Reads go through the pool and run in parallel (the database is in WAL mode);
+writes from the web app are funneled through a single ``WriteQueue`` thread so
+concurrent requests never race each other for the write lock. Statements on
+both are timed by query_metrics.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+
+import query_metrics
+
+HERE = Path(__file__).parent
+DB_PATH = HERE / 'hospital.db'
+
+POOL_SIZE = 8
+POOL_TIMEOUT = 10.0
+# compiled statements kept per connection (the sqlite3 default is 128)
+STATEMENT_CACHE = 256
+
+# Storage profiles: pragmas applied by init_db() and by every connection.
+# Pick one with the HOSPITAL_DB_PROFILE environment variable.
+STORAGE_PROFILES = {
+    'tuned': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,          # ms to wait for a lock before "database is locked"
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,      # negative = KiB, i.e. 64 MiB page cache
+        'temp_store': 'MEMORY',
+    },
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,          # what sqlite3.connect()'s default timeout gives
+        'mmap_size': 0,
+        'cache_size': -2000,
+        'temp_store': 'DEFAULT',
+    },
+}
+DEFAULT_PROFILE = os.environ.get('HOSPITAL_DB_PROFILE', 'tuned')
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to the owning pool."""
+
+    pool = None
+    checked_out = False
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or query_metrics.cursor_factory())
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        elif self.checked_out:
+            self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+
+def apply_pragmas(conn, profile=None):
+    """Apply foreign keys plus the pragmas of a storage profile to ``conn``."""
+    conn.execute('PRAGMA foreign_keys = ON;')
+    settings = STORAGE_PROFILES[profile or DEFAULT_PROFILE]
+    for name, value in settings.items():
+        conn.execute(f'PRAGMA {name} = {value};')
+
+
+class ConnectionPool:
+    """Thread-safe pool of warmed SQLite connections for one database file."""
+
+    def __init__(self, db_path=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT, warm=1, profile=None):
+        self.db_path = Path(db_path)
+        self.size = size
+        self.timeout = timeout
+        self.profile = profile
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self._stats = {'checkouts': 0, 'hits': 0, 'misses': 0, 'waits': 0, 'timeouts': 0}
+        for _ in range(min(warm, size)):
+            self._idle.put(self._new_connection())
+
+    def _new_connection(self):
+        conn = sqlite3.connect(self.db_path, factory=PooledConnection, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE)
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn, self.profile)
+        for hook in _connect_hooks:
+            hook(conn)
+        conn.pool = self
+        self._created += 1
+        return conn
+
+    def acquire(self):
+        """Check out a connection, opening a new one only if the pool has room."""
+        with self._lock:
+            self._stats['checkouts'] += 1
+            try:
+                conn = self._idle.get_nowait()
+                self._stats['hits'] += 1
+            except queue.Empty:
+                conn = None
+                if self._created < self.size:
+                    conn = self._new_connection()
+                    self._stats['misses'] += 1
+        if conn is None:
+            with self._lock:
+                self._stats['waits'] += 1
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise TimeoutError(f'No database connection available after {self.timeout}s')
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Return a connection, rolling back anything the caller left open."""
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+        if self._closed:
+            conn.pool = None
+            conn.really_close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(size=self.size, open=self._created, idle=self._idle.qsize())
+        return stats
+
+    def close_all(self, final=False):
+        """Close every idle connection; with ``final`` also those still checked out, on release."""
+        self._closed = self._closed or final
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.pool = None
+            conn.really_close()
+            with self._lock:
+                self._created -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_connect_hooks = []
+
+
+def on_connect(hook):
+    """Call ``hook(conn)`` on every pooled connection opened from now on (e.g. to prepare statements)."""
+    if hook not in _connect_hooks:
+        _connect_hooks.append(hook)
+
+
+def get_pool(db_path=DB_PATH):
+    """Return the process-wide pool for ``db_path``, creating it on first use."""
+    key = str(Path(db_path).resolve())
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path)
+        return pool
+
+
+def connect(db_path=DB_PATH):
+    """Check out a pooled connection; ``conn.close()`` gives it back."""
+    return get_pool(db_path).acquire()
+
+
+class WriteQueue:
+    """Single writer thread that runs write jobs one at a time.
+
+    ``submit(fn, *args)`` queues ``fn(conn, *args)`` and returns a Future;
+    ``run()`` waits for the result. Each job runs in its own IMMEDIATE
+    transaction which is committed on success and rolled back on error.
+    """
+
+    def __init__(self, db_path=DB_PATH, profile=None):
+        self.db_path = Path(db_path)
+        self.profile = profile
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, factory=PooledConnection,
+                               cached_statements=STATEMENT_CACHE)
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn, self.profile)
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, fn, args, caller = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            query_metrics.set_caller(caller)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                result = fn(conn, *args)
+                conn.execute('COMMIT')
+            except BaseException as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        conn.close()
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future  # only the web app writes through the queue
+        future = Future()
+        self._jobs.put((future, fn, args, query_metrics.current_caller()))
+        return future
+
+    def run(self, fn, *args, timeout=None):
+        return self.submit(fn, *args).result(timeout)
+
+    def stop(self):
+        self._jobs.put(None)
+        self._thread.join()
+
+
+_writers = {}
+
+
+def get_writer(db_path=DB_PATH):
+    """Return the process-wide write queue for ``db_path``."""
+    key = str(Path(db_path).resolve())
+    with _pools_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = WriteQueue(db_path)
+        return writer
+
+
+def discard(db_path=DB_PATH):
+    """Close and forget the pool and writer for ``db_path``, e.g. before the file is replaced."""
+    key = str(Path(db_path).resolve())
+    with _pools_lock:
+        pool = _pools.pop(key, None)
+        writer = _writers.pop(key, None)
+    if writer is not None:
+        writer.stop()
+    if pool is not None:
+        pool.close_all(final=True)
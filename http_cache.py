@@ -0,0 +1,211 @@
+"""HTTP caching for the pages staff leave on auto-refresh: validators, 304s and compression.
+
+Pages wrapped with ``conditional()`` get a weak ETag built from the change
+counters their data depends on (table_versions, patient_versions for a
+chart, or the report snapshot), the clinic date (report windows move at
+midnight), the URL and the deployed templates. A GET whose If-None-Match
+(or, without one, If-Modified-Since) matches is answered 304 after that one
+small read, before the view queries or renders anything. The counters are
+used rather than ``PRAGMA data_version``, which only tells one connection
+that another has committed and means nothing across workers or restarts.
+
+Last-Modified is when this process first served the current ETag. That is
+never earlier than the change it reflects, so a client's date from any
+worker only matches while the data is unchanged.
+
+Cache-Control is set per route: the ``conditional()`` default, overridden
+by endpoint with ``HOSPITAL_CACHE_CONTROL`` ('endpoint=policy;...', e.g.
+'report_billing=private, max-age=60;patients=no-store').
+
+``compress()`` gzips text responses (brotli when the optional ``brotli``
+package is installed and the client prefers it). Streamed reports are
+compressed chunk by chunk, so they keep streaming. Set
+``HOSPITAL_COMPRESSION=off`` when a proxy in front compresses instead.
+"""
+import functools
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from flask import Response, make_response, request, session
+
+import clinic_time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# browsers keep the page but revalidate it on every load: a 304 when unchanged
+REVALIDATE = 'private, no-cache'
+COMPRESSION = os.environ.get('HOSPITAL_COMPRESSION', 'on').lower() != 'off'
+MIN_COMPRESS_SIZE = 512
+FLUSH_SIZE = 32 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5   # fast enough to compress streamed reports on the fly
+COMPRESSIBLE = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml')
+MAX_LAST_MODIFIED = 4096
+
+
+def _policies(value):
+    policies = {}
+    for item in filter(None, (part.strip() for part in value.split(';'))):
+        endpoint, _, policy = item.partition('=')
+        policies[endpoint.strip()] = policy.strip()
+    return policies
+
+
+POLICIES = _policies(os.environ.get('HOSPITAL_CACHE_CONTROL', ''))
+
+_TEMPLATES = Path(__file__).parent / 'templates'
+# a new deployment (template or app change) gets new ETags; the same in every worker
+BUILD = str(max((p.stat().st_mtime_ns for p in [Path(__file__).with_name('app.py'), *_TEMPLATES.rglob('*.html')]),
+                default=0))
+
+_lock = threading.Lock()
+_first_served = OrderedDict()   # etag -> Last-Modified
+_stats = {'not_modified': 0, 'validated': 0, 'uncached': 0, 'compressed': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+
+def _count(**counts):
+    with _lock:
+        for name, n in counts.items():
+            _stats[name] += n
+
+
+def stats():
+    with _lock:
+        return dict(_stats, brotli=brotli is not None, compression=COMPRESSION)
+
+
+def policy_for(endpoint, default):
+    return POLICIES.get(endpoint, default)
+
+
+def _last_modified(etag):
+    with _lock:
+        when = _first_served.get(etag)
+        if when is None:
+            when = _first_served[etag] = datetime.now(timezone.utc).replace(microsecond=0)
+            while len(_first_served) > MAX_LAST_MODIFIED:
+                _first_served.popitem(last=False)
+        return when
+
+
+def etag_for(parts):
+    digest = hashlib.sha1(repr((request.full_path, BUILD, clinic_time.clinic_today(), parts)).encode()).hexdigest()
+    return digest[:20]
+
+
+def _not_modified(etag, last_modified):
+    # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return since is not None and since >= last_modified
+
+
+def conditional(validator, cache_control=REVALIDATE):
+    """Decorate a GET view to answer 304 while ``validator(**view_args)`` is unchanged.
+
+    ``validator`` returns the change counters the page depends on, or None
+    to serve it uncached (not migrated yet, snapshot due for a refresh...).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            # a pending flash message must be rendered, not answered with a 304
+            parts = None
+            if request.method in ('GET', 'HEAD') and not session.get('_flashes'):
+                parts = validator(**kwargs)
+            if parts is None:
+                _count(uncached=1)
+                return view(**kwargs)
+            etag = etag_for(parts)
+            last_modified = _last_modified(etag)
+            if _not_modified(etag, last_modified):
+                _count(not_modified=1)
+                response = Response(status=304)
+            else:
+                _count(validated=1)
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = policy_for(request.endpoint, cache_control)
+            return response
+        return wrapper
+    return decorator
+
+
+def _encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+def _compressor(encoding):
+    """(compress, finish, sync flush) functions of one gzip or brotli stream."""
+    if encoding == 'br':
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process, c.finish, lambda: c.flush()
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    return c.compress, c.flush, lambda: c.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _compressed_stream(chunks, encoding):
+    compress, finish, sync = _compressor(encoding)
+    raw = out = pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            raw += len(chunk)
+            pending += len(chunk)
+            data = compress(chunk)
+            # flush the page head at once, then every FLUSH_SIZE: the rows keep
+            # arriving as they are fetched without a flush per template fragment
+            if pending >= FLUSH_SIZE or raw == pending:
+                data += sync()
+                pending = 0
+            out += len(data)
+            if data:
+                yield data
+        data = finish()
+        out += len(data)
+        yield data
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        _count(bytes_in=raw, bytes_out=out)
+
+
+def compress(response):
+    """after_request hook: gzip/brotli-encode compressible 200 responses the client accepts."""
+    if not COMPRESSION or response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    if not (response.mimetype or '').startswith(COMPRESSIBLE):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.direct_passthrough = False
+        response.response = _compressed_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        compress_chunk, finish, _ = _compressor(encoding)
+        body = compress_chunk(data) + finish()
+        response.set_data(body)
+        _count(bytes_in=len(data), bytes_out=len(body))
+    response.headers['Content-Encoding'] = encoding
+    _count(compressed=1)
+    return response
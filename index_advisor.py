@@ -0,0 +1,53 @@
+"""Index advisor: run EXPLAIN QUERY PLAN over the app/CLI queries and flag full scans."""
+import patient_chart
+import patient_search
+import queries
+import reports
+
+# name -> (sql, sample params, tables that are expected to be scanned in full)
+QUERIES = {}
+for _name, _query in queries.CATALOG.items():
+    if not queries.is_read(_query.sql):
+        continue
+    # listings are advised in their "next page" form, the one that must seek
+    _sql = queries.keyset_sql(_name, after=True) if _query.key else _query.sql
+    _params = dict.fromkeys(queries.param_names(_sql))
+    if 'limit' in _params:
+        _params['limit'] = 51
+    QUERIES[_name] = (_sql, _params, _query.scans)
+# full listing (cli.py list-patients without --limit) reads every patient in index order
+QUERIES['patients.list/all'] = (queries.keyset_sql('patients.list'), {'limit': -1}, ('patients',))
+# report parameters are computed when advising
+for _name in reports.REPORTS:
+    _query_name = reports.resolve(_name)[0]
+    QUERIES[_query_name] = (queries.get(_query_name).sql, lambda _name=_name: reports.resolve(_name)[1],
+                            queries.get(_query_name).scans)
+QUERIES['patient-chart'] = (patient_chart.SQL_CHART, {'patient_id': 1}, ())
+QUERIES['patient-search'] = (patient_search.SQL_SEARCH, ('"a"*', 10), ('patients_fts',))  # the FTS5 index itself
+
+
+def is_full_scan(detail):
+    """True for plan steps like 'SCAN a' or 'SCAN a USING INDEX ...' (a walk of every row)."""
+    return detail.startswith('SCAN ')
+
+
+def scanned_table(detail, sql):
+    """Resolve the alias in a 'SCAN <alias>' step back to its table name."""
+    alias = detail.replace('SCAN TABLE ', 'SCAN ').split()[1]
+    words = sql.replace('\n', ' ').split()
+    for i, word in enumerate(words[:-1]):
+        if word.upper() in ('FROM', 'JOIN') and (words[i + 1] == alias or (i + 2 < len(words) and words[i + 2] == alias)):
+            return words[i + 1]
+    return alias
+
+
+def advise(conn, queries=None):
+    """Yield (name, plan details, unexpected full-scan tables) for each query."""
+    for name, (sql, params, allowed) in (queries or QUERIES).items():
+        if callable(params):
+            params = params()
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        # reading a subquery's rows (co-routine or materialized) is not a table scan
+        derived = {d.split(' ', 1)[1] for d in plan if d.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+        scans = [scanned_table(d, sql) for d in plan if is_full_scan(d) and d.split()[1] not in derived]
+        yield name, plan, [t for t in scans if t not in allowed]
@@ -1,19 +1,37 @@
 import sqlite3
 from pathlib import Path
 
+import db
+import query_cache
+from db import apply_pragmas
+
 HERE = Path(__file__).parent
 DB_PATH = HERE / 'hospital.db'
 
-def init_db(db_path=DB_PATH):
+def init_db(db_path=DB_PATH, profile=None):
+    # pooled connections in this process would keep using the deleted file, and
+    # the new file's version counters restart, so results cached for this path
+    # could look current
+    db.discard(db_path)
+    query_cache.get_cache().clear()
     if db_path.exists():
         print(f"Database already exists at {db_path}. Overwriting.")
         db_path.unlink()
+    # stale WAL/shared-memory files would otherwise be replayed into the new DB
+    for suffix in ('-wal', '-shm'):
+        side = db_path.with_name(db_path.name + suffix)
+        if side.exists():
+            side.unlink()
 
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
 
-    # enable foreign keys
-    cur.execute('PRAGMA foreign_keys = ON;')
+    # must precede the first write (WAL mode included); lets `cli.py vacuum`
+    # release free pages in small steps
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+    # enable foreign keys and the storage profile (WAL, cache, mmap, busy timeout)
+    apply_pragmas(conn, profile)
 
     schema_file = HERE / 'schema.sql'
 
@@ -2,29 +2,81 @@
 """Interactive menu-driven CLI for the Healthcare Mini DBMS.
 
 This script wraps the existing `cli.py` commands and exposes them as a
-friendly, game-like menu. It calls the current Python interpreter to run
-`cli.py` so it works when you run `py -3 interactive_cli.py` on Windows or
-`python interactive_cli.py` on other systems.
+friendly, game-like menu. It works the same when you run
+`py -3 interactive_cli.py` on Windows or `python interactive_cli.py` on
+other systems.
 
-It intentionally avoids re-implementing database logic: it shells out to
-the existing CLI implementation so behavior stays consistent.
+It intentionally avoids re-implementing database logic: every action calls
+the Click group in `cli.py` in-process, so behavior stays consistent without
+paying interpreter startup, imports and a new SQLite connection per action.
+The pooled connection (see db.py) stays open for the whole session.
+
+Batch mode runs one cli.py command per line of a file (`-` for stdin) in a
+single session; blank lines and `#` comments are skipped:
+
+    python interactive_cli.py --script nightly.txt
 """
-import subprocess
+import argparse
+import contextlib
+import io
+import shlex
 import sys
-from pathlib import Path
+import traceback
 
-ROOT = Path(__file__).parent
-CLI_SCRIPT = ROOT / 'cli.py'
+import click
 
+from cli import cli
+
+PROG_NAME = 'cli.py'
 
-def run_cli(args):
-    """Run the cli.py command with given args and return (returncode, stdout, stderr)."""
-    cmd = [sys.executable, str(CLI_SCRIPT)] + args
-    try:
-        res = subprocess.run(cmd, text=True, capture_output=True)
-        return res.returncode, res.stdout, res.stderr
-    except FileNotFoundError as e:
-        return 1, '', f'Failed to run {cmd}: {e}'
+
+def run_cli(args, capture=True):
+    """Run one cli.py command in-process; return (returncode, stdout, stderr).
+
+    Exit codes and error output match running ``python cli.py ARGS``. With
+    ``capture=False`` output goes straight to the terminal and '' is returned.
+    """
+    out, err = io.StringIO(), io.StringIO()
+    code = 0
+    with contextlib.ExitStack() as stack:
+        if capture:
+            stack.enter_context(contextlib.redirect_stdout(out))
+            stack.enter_context(contextlib.redirect_stderr(err))
+        try:
+            cli.main(args=list(args), prog_name=PROG_NAME, standalone_mode=True)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code or 0
+            else:
+                click.echo(e.code, err=True)
+                code = 1
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            code = 1
+    return code, out.getvalue(), err.getvalue()
+
+
+def run_script(lines, stop_on_error=False):
+    """Dispatch one command per line; return the number of failed commands."""
+    failed = 0
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        print(f'$ cli.py {line}', flush=True)
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            code = 1
+            print(f'ERROR: line {n}: {e}', file=sys.stderr)
+        else:
+            code, _, _ = run_cli(args, capture=False)
+        if code:
+            failed += 1
+            print(f'(exit status {code})', file=sys.stderr)
+            if stop_on_error:
+                break
+    return failed
 
 
 def pause():
@@ -77,6 +129,10 @@ def schedule_appointment():
     try:
         pid = input('Patient ID: ').strip()
         did = input('Doctor ID: ').strip()
+        if did.isdigit():
+            code, out, err = run_cli(['free-slots', '--doctor-id', did, '--count', '5'])
+            if code == 0 and out:
+                print('Next free slots:\n' + out)
         dt = input('Datetime (YYYY-MM-DD HH:MM): ').strip()
         reason = input('Reason (optional): ').strip()
         if not pid or not did or not dt:
@@ -180,8 +236,23 @@ def main_menu():
             print('Invalid selection. Try again.')
 
 
+def main():
+    parser = argparse.ArgumentParser(description='Interactive menu for the Healthcare Mini DBMS')
+    parser.add_argument('--script', metavar='FILE', help='Run cli.py commands from FILE (one per line, - for stdin)')
+    parser.add_argument('--stop-on-error', action='store_true', help='In script mode, stop at the first failing command')
+    args = parser.parse_args()
+    if args.script:
+        if args.script == '-':
+            failed = run_script(sys.stdin, args.stop_on_error)
+        else:
+            with open(args.script, encoding='utf-8') as f:
+                failed = run_script(f, args.stop_on_error)
+        sys.exit(1 if failed else 0)
+    main_menu()
+
+
 if __name__ == '__main__':
     try:
-        main_menu()
+        main()
     except KeyboardInterrupt:
         print('\nInterrupted — exiting')
@@ -0,0 +1,52 @@
+"""Space reclamation and planner upkeep: ``python cli.py vacuum``.
+
+Deletes (patient deletes, archive runs) leave pages on the freelist; the
+file only shrinks when they are vacuumed. Databases created by init_db.py
+use ``auto_vacuum = INCREMENTAL``, so free pages are released a few hundred
+at a time with ``PRAGMA incremental_vacuum(N)``, each step a short write
+transaction, instead of a full VACUUM that rewrites the file while holding
+the write lock. Older databases need one ``--full`` VACUUM to switch modes.
+"""
+import sqlite3
+import time
+
+STEP_PAGES = 256
+PAUSE = 0.01
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def space(conn, schema='main'):
+    """(page_size, page_count, freelist_count, auto_vacuum mode) of ``schema``."""
+    page_size = conn.execute(f'PRAGMA {schema}.page_size').fetchone()[0]
+    page_count = conn.execute(f'PRAGMA {schema}.page_count').fetchone()[0]
+    free = conn.execute(f'PRAGMA {schema}.freelist_count').fetchone()[0]
+    mode = conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0]
+    return page_size, page_count, free, AUTO_VACUUM_MODES.get(mode, str(mode))
+
+
+def vacuum(db_path, full=False, step=STEP_PAGES, pause=PAUSE):
+    """Reclaim free pages of ``db_path``, refresh planner statistics and truncate the WAL.
+
+    Returns {'before': space(), 'after': space(), 'mode': ...}.
+    """
+    from db import apply_pragmas
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        apply_pragmas(conn)
+        before = space(conn)
+        if full:
+            # VACUUM also applies a changed auto_vacuum mode
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        elif before[3] == 'incremental':
+            while conn.execute('PRAGMA freelist_count').fetchone()[0]:
+                # the pragma frees pages as its rows are stepped
+                conn.execute(f'PRAGMA incremental_vacuum({int(step)})').fetchall()
+                if pause:
+                    time.sleep(pause)
+        conn.execute('PRAGMA optimize')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return {'before': before, 'after': space(conn)}
+    finally:
+        conn.close()
@@ -0,0 +1,123 @@
+"""Migration script: materialized per-patient billing summary kept current by triggers.
+
+patient_billing_summary holds, per patient, the total billed, total unpaid,
+number of bills and the latest issued_at. Triggers on bills apply each
+INSERT/UPDATE/DELETE as a delta, so the billing report reads one row per
+patient instead of re-aggregating the whole bills table. Bills created by
+trg_create_bill_after_visit (migrate_db.py) go through the same triggers.
+"""
+import sqlite3
+from pathlib import Path
+
+from db import apply_pragmas
+
+DB = Path(__file__).parent / 'hospital.db'
+
+SQL_SUMMARY = '''
+CREATE TABLE IF NOT EXISTS patient_billing_summary (
+    patient_id INTEGER PRIMARY KEY,
+    total_billed REAL NOT NULL DEFAULT 0.0,
+    total_unpaid REAL NOT NULL DEFAULT 0.0,
+    bill_count INTEGER NOT NULL DEFAULT 0,
+    last_bill_at DATETIME,
+    FOREIGN KEY (patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_billing_summary_unpaid ON patient_billing_summary(total_unpaid);
+
+CREATE TRIGGER IF NOT EXISTS trg_billing_summary_insert
+AFTER INSERT ON bills
+BEGIN
+    INSERT INTO patient_billing_summary (patient_id, total_billed, total_unpaid, bill_count, last_bill_at)
+    VALUES (NEW.patient_id, NEW.amount, CASE WHEN NEW.status = 'unpaid' THEN NEW.amount ELSE 0 END, 1, NEW.issued_at)
+    ON CONFLICT(patient_id) DO UPDATE SET
+        total_billed = total_billed + excluded.total_billed,
+        total_unpaid = total_unpaid + excluded.total_unpaid,
+        bill_count = bill_count + 1,
+        last_bill_at = CASE WHEN excluded.last_bill_at > coalesce(last_bill_at, '') THEN excluded.last_bill_at ELSE last_bill_at END;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_billing_summary_delete
+AFTER DELETE ON bills
+BEGIN
+    UPDATE patient_billing_summary SET
+        total_billed = total_billed - OLD.amount,
+        total_unpaid = total_unpaid - CASE WHEN OLD.status = 'unpaid' THEN OLD.amount ELSE 0 END,
+        bill_count = bill_count - 1,
+        last_bill_at = (SELECT MAX(issued_at) FROM bills WHERE patient_id = OLD.patient_id)
+    WHERE patient_id = OLD.patient_id;
+    DELETE FROM patient_billing_summary WHERE patient_id = OLD.patient_id AND bill_count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_billing_summary_update
+AFTER UPDATE OF patient_id, amount, status, issued_at ON bills
+BEGIN
+    UPDATE patient_billing_summary SET
+        total_billed = total_billed - OLD.amount,
+        total_unpaid = total_unpaid - CASE WHEN OLD.status = 'unpaid' THEN OLD.amount ELSE 0 END,
+        bill_count = bill_count - 1
+    WHERE patient_id = OLD.patient_id;
+    INSERT INTO patient_billing_summary (patient_id, total_billed, total_unpaid, bill_count)
+    VALUES (NEW.patient_id, NEW.amount, CASE WHEN NEW.status = 'unpaid' THEN NEW.amount ELSE 0 END, 1)
+    ON CONFLICT(patient_id) DO UPDATE SET
+        total_billed = total_billed + excluded.total_billed,
+        total_unpaid = total_unpaid + excluded.total_unpaid,
+        bill_count = bill_count + 1;
+    UPDATE patient_billing_summary
+    SET last_bill_at = (SELECT MAX(issued_at) FROM bills WHERE bills.patient_id = patient_billing_summary.patient_id)
+    WHERE patient_id IN (OLD.patient_id, NEW.patient_id);
+    DELETE FROM patient_billing_summary WHERE patient_id = OLD.patient_id AND bill_count <= 0;
+END;
+'''
+
+SQL_AGGREGATE = '''
+    SELECT patient_id,
+           SUM(amount) AS total_billed,
+           SUM(CASE WHEN status = 'unpaid' THEN amount ELSE 0 END) AS total_unpaid,
+           COUNT(*) AS bill_count,
+           MAX(issued_at) AS last_bill_at
+    FROM bills
+    GROUP BY patient_id
+'''
+
+# amounts are REAL and maintained as running deltas; allow for float drift
+TOLERANCE = 0.005
+
+
+def rebuild(conn):
+    """Recompute every summary row from bills in one transaction; returns row count."""
+    with conn:
+        conn.execute('DELETE FROM patient_billing_summary')
+        conn.execute('INSERT INTO patient_billing_summary (patient_id, total_billed, total_unpaid, bill_count, last_bill_at) '
+                     + SQL_AGGREGATE)
+    return conn.execute('SELECT COUNT(*) FROM patient_billing_summary').fetchone()[0]
+
+
+def check(conn):
+    """Return (patient_id, expected, stored) for every summary row that drifted from bills."""
+    expected = {r[0]: tuple(r[1:]) for r in conn.execute(SQL_AGGREGATE)}
+    stored = {r[0]: tuple(r[1:]) for r in conn.execute(
+        'SELECT patient_id, total_billed, total_unpaid, bill_count, last_bill_at FROM patient_billing_summary')}
+    mismatches = []
+    for pid in sorted(expected.keys() | stored.keys()):
+        e, s = expected.get(pid), stored.get(pid)
+        if e is None or s is None or e[2:] != s[2:] or abs(e[0] - s[0]) > TOLERANCE or abs(e[1] - s[1]) > TOLERANCE:
+            mismatches.append((pid, e, s))
+    return mismatches
+
+
+def apply_migration(db_path=DB):
+    if not db_path.exists():
+        print(f"Database not found at {db_path}")
+        return
+    conn = sqlite3.connect(db_path)
+    apply_pragmas(conn)
+    cur = conn.cursor()
+    cur.executescript(SQL_SUMMARY)
+    conn.commit()
+    rows = rebuild(conn)
+    conn.close()
+    print(f"Migration applied: patient_billing_summary and triggers created (if not existed), {rows} rows backfilled")
+
+if __name__ == '__main__':
+    apply_migration()
@@ -2,14 +2,17 @@
 import sqlite3
 from pathlib import Path
 
+from db import apply_pragmas
+
 DB = Path(__file__).parent / 'hospital.db'
 
 SQL_TRIGGER = '''
 CREATE TRIGGER IF NOT EXISTS trg_create_bill_after_visit
 AFTER INSERT ON visits
 BEGIN
-    INSERT INTO bills (visit_id, patient_id, amount, status)
-    VALUES (NEW.visit_id, NEW.patient_id, 50.0, 'unpaid');
+    -- issued at the visit's clinic-local time; CURRENT_TIMESTAMP would be UTC
+    INSERT INTO bills (visit_id, patient_id, amount, status, issued_at)
+    VALUES (NEW.visit_id, NEW.patient_id, 50.0, 'unpaid', COALESCE(NEW.visit_date, CURRENT_TIMESTAMP));
 END;
 '''
 
@@ -18,6 +21,7 @@ def apply_migration(db_path=DB):
         print(f"Database not found at {db_path}")
         return
     conn = sqlite3.connect(db_path)
+    apply_pragmas(conn)
     cur = conn.cursor()
     cur.executescript(SQL_TRIGGER)
     conn.commit()
@@ -0,0 +1,60 @@
+"""Migration script: add secondary indexes used by the app and CLI queries
+and normalize appointment timestamps for the range-based reports."""
+import sqlite3
+from pathlib import Path
+
+from db import apply_pragmas
+
+DB = Path(__file__).parent / 'hospital.db'
+
+SQL_INDEXES = '''
+-- /patients and list-patients: ORDER BY last_name, first_name
+CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(last_name, first_name);
+
+-- /appointments and the daily report: ORDER BY / range on appointment_datetime
+CREATE INDEX IF NOT EXISTS idx_appointments_datetime ON appointments(appointment_datetime);
+
+-- doctor workload: per-doctor appointments inside a date window
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_datetime ON appointments(doctor_id, appointment_datetime);
+
+-- patient history: visits of one patient, newest first
+CREATE INDEX IF NOT EXISTS idx_visits_patient_date ON visits(patient_id, visit_date);
+
+-- patient history: prescriptions joined back to visits
+CREATE INDEX IF NOT EXISTS idx_prescriptions_visit ON prescriptions(visit_id);
+
+-- overdue bills: status = 'unpaid' AND issued_at <= cutoff
+CREATE INDEX IF NOT EXISTS idx_bills_status_issued ON bills(status, issued_at);
+
+-- billing summary: covering index for per-patient SUM(amount) by status
+CREATE INDEX IF NOT EXISTS idx_bills_patient_status_amount ON bills(patient_id, status, amount);
+
+-- bill lookup by visit (seeding, visit -> bill)
+CREATE INDEX IF NOT EXISTS idx_bills_visit ON bills(visit_id);
+'''
+
+# Reports compare appointment_datetime against 'YYYY-MM-DD' bounds as strings,
+# so rewrite any parseable legacy values (seconds, 'T' separator) to the
+# canonical 'YYYY-MM-DD HH:MM' form that new writes are normalized to.
+SQL_NORMALIZE = '''
+UPDATE appointments
+SET appointment_datetime = strftime('%Y-%m-%d %H:%M', appointment_datetime)
+WHERE strftime('%Y-%m-%d %H:%M', appointment_datetime) IS NOT NULL
+  AND appointment_datetime <> strftime('%Y-%m-%d %H:%M', appointment_datetime);
+'''
+
+def apply_migration(db_path=DB):
+    if not db_path.exists():
+        print(f"Database not found at {db_path}")
+        return
+    conn = sqlite3.connect(db_path)
+    apply_pragmas(conn)
+    cur = conn.cursor()
+    cur.executescript(SQL_INDEXES)
+    cur.executescript(SQL_NORMALIZE)
+    conn.commit()
+    conn.close()
+    print("Migration applied: secondary indexes created (if not existed)")
+
+if __name__ == '__main__':
+    apply_migration()
@@ -0,0 +1,57 @@
+"""Migration script: per-table version counters for cache invalidation.
+
+table_versions has one row per table; triggers bump it on every INSERT,
+UPDATE and DELETE. Writes made by other triggers (the visit -> bill trigger,
+the billing summary triggers, FK cascades) and by other processes bump it
+too, so query_cache can tell exactly when a cached result went stale.
+"""
+import sqlite3
+from pathlib import Path
+
+from db import apply_pragmas
+
+DB = Path(__file__).parent / 'hospital.db'
+
+VERSIONED_TABLES = ('departments', 'doctors', 'patients', 'appointments', 'visits',
+                    'medications', 'prescriptions', 'bills', 'patient_billing_summary')
+
+SQL_TABLE = '''
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+'''
+
+SQL_ROW = '''
+INSERT OR IGNORE INTO table_versions (table_name, version) VALUES ('{table}', 0);
+'''
+
+SQL_TRIGGER = '''
+CREATE TRIGGER IF NOT EXISTS trg_version_{table}_{event}
+AFTER {event} ON {table}
+BEGIN
+    UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+END;
+'''
+
+def apply_migration(db_path=DB):
+    if not db_path.exists():
+        print(f"Database not found at {db_path}")
+        return
+    conn = sqlite3.connect(db_path)
+    apply_pragmas(conn)
+    cur = conn.cursor()
+    existing = {r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    script = SQL_TABLE
+    for table in VERSIONED_TABLES:
+        if table in existing:
+            script += SQL_ROW.format(table=table)
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                script += SQL_TRIGGER.format(table=table, event=event)
+    cur.executescript(script)
+    conn.commit()
+    conn.close()
+    print("Migration applied: table_versions and version triggers created (if not existed)")
+
+if __name__ == '__main__':
+    apply_migration()
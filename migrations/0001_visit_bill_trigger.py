@@ -0,0 +1,2 @@
+"""Auto-create an unpaid bill for every new visit (see migrate_db.py)."""
+from migrate_db import SQL_TRIGGER as SQL
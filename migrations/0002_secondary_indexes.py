@@ -0,0 +1,11 @@
+"""Secondary indexes for the app/CLI queries; normalize appointment datetimes in batches."""
+from migrate_indexes import SQL_INDEXES as SQL
+from schema_version import Backfill
+
+BACKFILL = Backfill('appointments', 'appointment_id', ('''
+    UPDATE appointments
+    SET appointment_datetime = strftime('%Y-%m-%d %H:%M', appointment_datetime)
+    WHERE appointment_id >= :lo AND appointment_id < :hi
+      AND strftime('%Y-%m-%d %H:%M', appointment_datetime) IS NOT NULL
+      AND appointment_datetime <> strftime('%Y-%m-%d %H:%M', appointment_datetime)
+''',))
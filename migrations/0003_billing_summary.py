@@ -0,0 +1,14 @@
+"""Trigger-maintained patient_billing_summary; existing bills are summarized per patient range."""
+from migrate_billing_summary import SQL_SUMMARY as SQL
+from schema_version import Backfill
+
+# each range is recomputed from bills in one transaction, overwriting any
+# partial rows the triggers created for those patients in the meantime
+BACKFILL = Backfill('patients', 'patient_id', (
+    'DELETE FROM patient_billing_summary WHERE patient_id >= :lo AND patient_id < :hi',
+    '''INSERT INTO patient_billing_summary (patient_id, total_billed, total_unpaid, bill_count, last_bill_at)
+       SELECT patient_id, SUM(amount), SUM(CASE WHEN status = 'unpaid' THEN amount ELSE 0 END), COUNT(*), MAX(issued_at)
+       FROM bills
+       WHERE patient_id >= :lo AND patient_id < :hi
+       GROUP BY patient_id''',
+))
@@ -0,0 +1,14 @@
+"""Per-table version counters for query_cache invalidation (see migrate_table_versions.py)."""
+from migrate_table_versions import SQL_ROW, SQL_TABLE, SQL_TRIGGER, VERSIONED_TABLES
+from schema_version import execute_script
+
+SQL = SQL_TABLE
+
+
+def upgrade(conn):
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table in VERSIONED_TABLES:
+        if table in existing:
+            execute_script(conn, SQL_ROW.format(table=table))
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                execute_script(conn, SQL_TRIGGER.format(table=table, event=event))
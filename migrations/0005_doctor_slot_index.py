@@ -0,0 +1,10 @@
+"""Covering index for the per-doctor slot lookups in scheduling.py.
+
+Replaces idx_appointments_doctor_datetime: the (doctor_id,
+appointment_datetime) prefix still serves the doctor workload report, and
+with status in the index the conflict check never touches the table.
+"""
+SQL = '''
+DROP INDEX IF EXISTS idx_appointments_doctor_datetime;
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_slot ON appointments(doctor_id, appointment_datetime, status);
+'''
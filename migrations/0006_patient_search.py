@@ -0,0 +1,45 @@
+"""Full-text patient search (patient_search.py): FTS5 index kept in sync by triggers.
+
+The index stores its own copy of the searched columns, so the update and
+delete triggers can drop a row by rowid whether or not the backfill has
+reached it yet; each backfill batch re-indexes its id range from patients.
+"""
+from schema_version import Backfill
+
+SQL = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+    first_name, last_name, phone, email, insurance,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_patients_fts_insert
+AFTER INSERT ON patients
+BEGIN
+    INSERT INTO patients_fts (rowid, first_name, last_name, phone, email, insurance)
+    VALUES (new.patient_id, new.first_name, new.last_name, new.phone, new.email, new.insurance);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_patients_fts_update
+AFTER UPDATE OF patient_id, first_name, last_name, phone, email, insurance ON patients
+BEGIN
+    DELETE FROM patients_fts WHERE rowid = old.patient_id;
+    INSERT INTO patients_fts (rowid, first_name, last_name, phone, email, insurance)
+    VALUES (new.patient_id, new.first_name, new.last_name, new.phone, new.email, new.insurance);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_patients_fts_delete
+AFTER DELETE ON patients
+BEGIN
+    DELETE FROM patients_fts WHERE rowid = old.patient_id;
+END;
+'''
+
+BACKFILL = Backfill('patients', 'patient_id', (
+    'DELETE FROM patients_fts WHERE rowid >= :lo AND rowid < :hi',
+    '''
+    INSERT INTO patients_fts (rowid, first_name, last_name, phone, email, insurance)
+    SELECT patient_id, first_name, last_name, phone, email, insurance FROM patients
+    WHERE patient_id >= :lo AND patient_id < :hi
+    ''',
+))
@@ -0,0 +1,45 @@
+"""Per-patient change counters for the patient chart cache (patient_chart.py).
+
+Triggers bump patient_versions for the patient whose row, visits,
+prescriptions or bills changed. Row 0 is a global epoch, bumped after loads
+that ran with the triggers dropped (see bulk_import.py).
+"""
+from schema_version import execute_script
+
+SQL = '''
+CREATE TABLE IF NOT EXISTS patient_versions (
+    patient_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+SQL_TRIGGER = '''
+CREATE TRIGGER IF NOT EXISTS trg_patient_version_{table}_{event}
+AFTER {event} ON {table}
+BEGIN
+    INSERT INTO patient_versions (patient_id, version)
+    SELECT patient_id, 1 FROM ({source}) WHERE patient_id IS NOT NULL
+    ON CONFLICT (patient_id) DO UPDATE SET version = version + 1;
+END;
+'''
+
+# (table, event) -> the patient ids a change touches
+SOURCES = {
+    ('patients', 'UPDATE'): 'SELECT old.patient_id AS patient_id',
+    ('patients', 'DELETE'): 'SELECT old.patient_id AS patient_id',
+    ('visits', 'INSERT'): 'SELECT new.patient_id AS patient_id',
+    ('visits', 'UPDATE'): 'SELECT old.patient_id AS patient_id UNION SELECT new.patient_id',
+    ('visits', 'DELETE'): 'SELECT old.patient_id AS patient_id',
+    ('bills', 'INSERT'): 'SELECT new.patient_id AS patient_id',
+    ('bills', 'UPDATE'): 'SELECT old.patient_id AS patient_id UNION SELECT new.patient_id',
+    ('bills', 'DELETE'): 'SELECT old.patient_id AS patient_id',
+    # on a cascade from visits the visit is already gone; its own trigger covered it
+    ('prescriptions', 'INSERT'): 'SELECT patient_id FROM visits WHERE visit_id = new.visit_id',
+    ('prescriptions', 'UPDATE'): 'SELECT patient_id FROM visits WHERE visit_id IN (old.visit_id, new.visit_id)',
+    ('prescriptions', 'DELETE'): 'SELECT patient_id FROM visits WHERE visit_id = old.visit_id',
+}
+
+
+def upgrade(conn):
+    for (table, event), source in SOURCES.items():
+        execute_script(conn, SQL_TRIGGER.format(table=table, event=event, source=source))
@@ -0,0 +1,37 @@
+"""Indexes on the child foreign keys that had none, and the archive checkpoint table.
+
+Deleting a patient cascades to appointments, and deleting appointments,
+doctors, medications or departments sets the referencing columns to NULL.
+Without an index SQLite scans the child table for every parent row, which
+is what made bulk deletes hold the write lock for minutes.
+"""
+SQL = '''
+-- patients -> appointments (cascade); also "last activity" per patient for archive.py
+CREATE INDEX IF NOT EXISTS idx_appointments_patient ON appointments(patient_id, appointment_datetime);
+
+-- appointments -> visits (SET NULL)
+CREATE INDEX IF NOT EXISTS idx_visits_appointment ON visits(appointment_id);
+
+-- doctors -> visits (cascade)
+CREATE INDEX IF NOT EXISTS idx_visits_doctor ON visits(doctor_id);
+
+-- medications -> prescriptions (SET NULL)
+CREATE INDEX IF NOT EXISTS idx_prescriptions_med ON prescriptions(med_id);
+
+-- departments -> doctors / appointments (SET NULL); doctors per department for scheduling
+CREATE INDEX IF NOT EXISTS idx_doctors_department ON doctors(department_id);
+CREATE INDEX IF NOT EXISTS idx_appointments_department ON appointments(department_id);
+
+-- resumable archive runs (archive.py)
+CREATE TABLE IF NOT EXISTS archive_runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cutoff TEXT NOT NULL,
+    archive_path TEXT NOT NULL,
+    next_key INTEGER NOT NULL DEFAULT 0,
+    max_key INTEGER NOT NULL,
+    patients INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+'''
@@ -0,0 +1,5 @@
+"""Trigger-maintained daily workload rollups; existing history is counted per doctor range."""
+from rollups import BACKFILL_STATEMENTS, SQL_ROLLUPS as SQL
+from schema_version import Backfill
+
+BACKFILL = Backfill('doctors', 'doctor_id', BACKFILL_STATEMENTS)
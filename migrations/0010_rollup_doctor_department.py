@@ -0,0 +1,7 @@
+"""Appointments without a department_id count toward their doctor's department in the rollups."""
+from rollups import backfill_statements, drop_triggers_sql, triggers_sql
+from schema_version import Backfill
+
+SQL = drop_triggers_sql('appointments') + triggers_sql('appointments')
+
+BACKFILL = Backfill('doctors', 'doctor_id', backfill_statements(('appointments_daily', 'appointments_monthly')))
@@ -0,0 +1,8 @@
+"""Bills are issued at their visit's clinic-local time, not at UTC CURRENT_TIMESTAMP.
+
+The reports bound issued_at by clinic-local days (clinic_time.day_range), so
+a bill stamped in UTC landed on the wrong day near midnight.
+"""
+from migrate_db import SQL_TRIGGER
+
+SQL = 'DROP TRIGGER IF EXISTS trg_create_bill_after_visit;\n' + SQL_TRIGGER
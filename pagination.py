@@ -0,0 +1,81 @@
+"""Keyset (cursor) pagination for the patient and appointment listings.
+
+Pages are addressed by the sort key of the row at their edge instead of an
+OFFSET, so fetching page 1000 costs the same as page 1: SQLite seeks straight
+into the index with a row-value comparison such as
+``(last_name, first_name, patient_id) > (?, ?, ?)``.
+Cursor tokens are the url-safe base64 of the JSON-encoded key.
+"""
+import base64
+import json
+from collections import namedtuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+PAGE_SIZES = (25, 50, 100, 250)
+
+Page = namedtuple('Page', 'rows limit next_token prev_token')
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Decode a cursor token into a key tuple; ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'invalid page cursor: {token!r}') from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f'invalid page cursor: {token!r}')
+    return tuple(values)
+
+
+def clamp_limit(limit, default=DEFAULT_PAGE_SIZE):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def keyset_sql(select_sql, key_columns, after=False, before=False):
+    """``select_sql`` limited to one page after/before a key (named parameters :k0.. and :limit)."""
+    cols = ', '.join(key_columns)
+    marks = ', '.join(f':k{i}' for i in range(len(key_columns)))
+    if before:
+        return f'{select_sql} WHERE ({cols}) < ({marks}) ORDER BY {", ".join(c + " DESC" for c in key_columns)} LIMIT :limit'
+    if after:
+        return f'{select_sql} WHERE ({cols}) > ({marks}) ORDER BY {cols} LIMIT :limit'
+    return f'{select_sql} ORDER BY {cols} LIMIT :limit'
+
+
+def keyset_page(conn, select_sql, key_columns, key_names, after=None, before=None, limit=DEFAULT_PAGE_SIZE,
+                fetch=None):
+    """Fetch one page of ``select_sql`` ordered by ``key_columns``.
+
+    ``key_columns`` are the SQL expressions of the (unique) sort key and
+    ``key_names`` the matching column names in the result rows. ``after`` /
+    ``before`` are cursor tokens from a previous page. ``fetch(conn, sql,
+    params)`` returns the rows; by default ``conn.execute(...).fetchall()``.
+    """
+    token = before or after
+    key = decode_cursor(token, len(key_columns)) if token else ()
+    params = {f'k{i}': value for i, value in enumerate(key)}
+    params['limit'] = limit + 1
+    sql = keyset_sql(select_sql, key_columns, after=bool(after), before=bool(before))
+    rows = fetch(conn, sql, params) if fetch else conn.execute(sql, params).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = bool(after), more
+    key = lambda row: encode_cursor(row[name] for name in key_names)
+    next_token = key(rows[-1]) if rows and has_next else None
+    prev_token = key(rows[0]) if rows and has_prev else None
+    return Page(rows, limit, next_token, prev_token)
@@ -0,0 +1,164 @@
+"""Patient chart: the full history of one patient, fetched in one query.
+
+``load()`` reads the patient, their visits (with the doctor), prescriptions
+and bills with a single UNION ALL statement and nests prescriptions and
+bills under their visit. Rows become namedtuples, which are small and
+read-only, so one chart can be shared by every request that shows it.
+
+``ChartCache`` keeps recent charts per patient_id. An entry is valid while
+the patient's counter in patient_versions (bumped by triggers on the
+patient's row, visits, prescriptions and bills; migration 0007), the global
+epoch in row 0 and the doctors table version are unchanged. Checking that
+is one small query, and a write to one patient leaves every other cached
+chart valid.
+"""
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+MAX_CHARTS = 1024
+
+Patient = namedtuple('Patient', 'patient_id first_name last_name dob gender phone email address insurance')
+Visit = namedtuple('Visit', 'visit_id visit_date diagnosis notes doctor_first doctor_last appointment_id prescriptions bills')
+Prescription = namedtuple('Prescription', 'prescription_id prescribed_at visit_id medication dosage frequency duration')
+Bill = namedtuple('Bill', 'bill_id issued_at visit_id amount status paid_at')
+# other_bills: bills not linked to a visit
+Chart = namedtuple('Chart', 'patient visits other_bills')
+
+# the first column tags the row kind; each part is read through an index on
+# patient_id, and the few rows are put in date order in Python (an ORDER BY
+# over the UNION would cost a temp b-tree sort)
+SQL_CHART = '''
+SELECT 0, patient_id, first_name, last_name, dob, gender, phone, email, address, insurance
+FROM patients WHERE patient_id = :patient_id
+UNION ALL
+SELECT 1, v.visit_id, v.visit_date, v.diagnosis, v.notes, d.first_name, d.last_name, v.appointment_id, NULL, NULL
+FROM visits v LEFT JOIN doctors d ON d.doctor_id = v.doctor_id
+WHERE v.patient_id = :patient_id
+UNION ALL
+SELECT 2, pr.prescription_id, pr.prescribed_at, pr.visit_id, pr.medication, pr.dosage, pr.frequency, pr.duration, NULL, NULL
+FROM visits v JOIN prescriptions pr ON pr.visit_id = v.visit_id
+WHERE v.patient_id = :patient_id
+UNION ALL
+SELECT 3, b.bill_id, b.issued_at, b.visit_id, b.amount, b.status, b.paid_at, NULL, NULL, NULL
+FROM bills b
+WHERE b.patient_id = :patient_id
+'''
+
+SQL_VERSIONS = '''
+SELECT (SELECT version FROM patient_versions WHERE patient_id = ?),
+       (SELECT version FROM patient_versions WHERE patient_id = 0),
+       (SELECT version FROM table_versions WHERE table_name = 'doctors')
+'''
+
+
+def _newest_first(rows):
+    # (date, id) descending; a NULL date sorts last
+    rows.sort(key=lambda r: (r[1] or '', r[0]), reverse=True)
+    return rows
+
+
+def load(conn, patient_id):
+    """The patient's Chart (visits, prescriptions and bills newest first), or None."""
+    patient, visits, prescriptions, bills = None, {}, [], []
+    for row in conn.execute(SQL_CHART, {'patient_id': patient_id}).fetchall():
+        kind = row[0]
+        if kind == 1:
+            visits[row[1]] = Visit(*row[1:8], [], [])
+        elif kind == 2:
+            prescriptions.append(Prescription(*row[1:8]))
+        elif kind == 3:
+            bills.append(Bill(*row[1:7]))
+        else:
+            patient = Patient(*row[1:10])
+    if patient is None:
+        return None
+    for p in _newest_first(prescriptions):
+        visits[p.visit_id].prescriptions.append(p)
+    other_bills = []
+    for b in _newest_first(bills):
+        visit = visits.get(b.visit_id)
+        (visit.bills if visit is not None else other_bills).append(b)
+    return Chart(patient, _newest_first(list(visits.values())), other_bills)
+
+
+def to_dict(chart):
+    """JSON-ready nested dicts for a Chart."""
+    return {
+        'patient': chart.patient._asdict(),
+        'visits': [dict(v._asdict(), prescriptions=[p._asdict() for p in v.prescriptions],
+                        bills=[b._asdict() for b in v.bills]) for v in chart.visits],
+        'other_bills': [b._asdict() for b in chart.other_bills],
+    }
+
+
+def invalidate_all(conn):
+    """Bump the global epoch: every cached chart reloads (after trigger-less loads)."""
+    try:
+        conn.execute('INSERT INTO patient_versions (patient_id, version) VALUES (0, 1) '
+                     'ON CONFLICT (patient_id) DO UPDATE SET version = version + 1')
+    except sqlite3.OperationalError:
+        pass  # not migrated yet: nothing is cached
+
+
+class ChartCache:
+    """Bounded LRU of charts, each checked against the patient's version counters."""
+
+    def __init__(self, max_entries=MAX_CHARTS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidated': 0, 'evictions': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, conn, patient_id):
+        """The patient's Chart (None if not found), from the cache while still current."""
+        try:
+            versions = tuple(conn.execute(SQL_VERSIONS, (patient_id,)).fetchone())
+        except sqlite3.OperationalError:
+            versions = None  # not migrated yet: never cache
+        with self._lock:
+            entry = self._entries.get(patient_id)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(patient_id)
+                self._stats['hits'] += 1
+                return entry[1]
+        self._count('invalidated' if entry is not None else 'misses')
+        # versions are read first, so the chart is at least as new as them
+        chart = load(conn, patient_id)
+        with self._lock:
+            if chart is None or versions is None:
+                self._entries.pop(patient_id, None)
+            else:
+                self._entries[patient_id] = (versions, chart)
+                self._entries.move_to_end(patient_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        return chart
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_path):
+    """Return the process-wide chart cache for ``db_path``."""
+    key = str(Path(db_path).resolve())
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ChartCache()
+        return cache
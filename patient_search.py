@@ -0,0 +1,50 @@
+"""Typeahead patient search over the patients_fts index (migration 0006).
+
+Every word typed is matched as a prefix of a word in the patient's first or
+last name, phone, email or insurance, and all words must match: "sha 98"
+finds Shah with a phone number starting 98. Punctuation only separates
+words, so user input can never form FTS5 query syntax.
+
+Results come newest patient first rather than by bm25 rank: FTS5 then
+walks the matches in rowid order and stops at the limit, so even a one
+letter prefix over 200k patients answers in a few ms, where ranking has to
+score every match (~100 ms).
+"""
+import re
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_WORD = re.compile(r'\w+')
+
+SQL_SEARCH = '''
+SELECT p.patient_id, p.first_name, p.last_name, p.dob, p.phone, p.email, p.insurance
+FROM patients_fts
+JOIN patients p ON p.patient_id = patients_fts.rowid
+WHERE patients_fts MATCH ?
+ORDER BY patients_fts.rowid DESC
+LIMIT ?
+'''
+
+
+def match_expression(text):
+    """FTS5 MATCH expression for ``text``, or None if it has no words."""
+    words = _WORD.findall(text or '')
+    return ' '.join(f'"{w}"*' for w in words) or None
+
+
+def search(conn, text, limit=DEFAULT_LIMIT):
+    """Patients matching every word of ``text`` as a prefix, newest first."""
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    return conn.execute(SQL_SEARCH, (expression, max(1, min(limit, MAX_LIMIT)))).fetchall()
+
+
+def index_new_patients(conn, after_id):
+    """Index patients above ``after_id``, for loads that ran with the triggers dropped."""
+    conn.execute('DELETE FROM patients_fts WHERE rowid > ?', (after_id,))
+    conn.execute('''
+        INSERT INTO patients_fts (rowid, first_name, last_name, phone, email, insurance)
+        SELECT patient_id, first_name, last_name, phone, email, insurance FROM patients WHERE patient_id > ?
+    ''', (after_id,))
@@ -0,0 +1,301 @@
+"""The app's and CLI's SQL, each statement once, with named parameters.
+
+Routes and commands run catalog entries by name::
+
+    queries.fetch_all(conn, 'doctors.choices')
+    queries.execute(conn, 'patients.delete', patient_id=7)
+
+Because every caller sends byte-identical SQL text, the per-connection
+statement cache (sized by ``db.STATEMENT_CACHE``) reuses the compiled
+statement on the long-lived pooled connections; ``prepare()`` compiles the
+read statements when the web app opens a connection.
+
+Rows come back as records: tuples, one small class per column list, with
+the columns as attributes (``row.last_name``) and, for code written against
+``sqlite3.Row``, by name (``row['last_name']``, slower) and ``dict(row)``.
+A record is a single tuple, where an ``sqlite3.Row`` wraps one.
+
+Domain modules (scheduling, patient_chart, patient_search, archive) keep
+their own SQL next to the code that depends on its exact shape.
+"""
+import re
+import sqlite3
+from collections import namedtuple
+from functools import partial
+
+BATCH_SIZE = 500
+
+# tables: everything a read touches, for query_cache invalidation; scans:
+# tables the index advisor accepts a full scan of; key: (sort key columns,
+# their names in the rows) for keyset-paginated listings
+Query = namedtuple('Query', 'sql tables scans key', defaults=((), (), None))
+
+
+def _workload_sql(level, period):
+    """Workload per period and doctor or department (:by) from the ``level`` rollups (rollups.py)."""
+    column = 'day' if level == 'daily' else 'month'
+    return f'''
+        SELECT t.period, t.key_id,
+               CASE :by WHEN 'department' THEN COALESCE(dep.name, '(no department)')
+                        ELSE d.first_name || ' ' || d.last_name END AS name,
+               t.appointments, t.completed, t.cancelled, t.no_show, t.visits
+        FROM (
+            SELECT {period} AS period, key_id, SUM(appointments) AS appointments, SUM(completed) AS completed,
+                   SUM(cancelled) AS cancelled, SUM(no_show) AS no_show, SUM(visits) AS visits
+            FROM (
+                SELECT {column}, CASE :by WHEN 'department' THEN department_id ELSE doctor_id END AS key_id,
+                       appointments,
+                       CASE status WHEN 'completed' THEN appointments ELSE 0 END AS completed,
+                       CASE status WHEN 'cancelled' THEN appointments ELSE 0 END AS cancelled,
+                       CASE status WHEN 'no-show' THEN appointments ELSE 0 END AS no_show,
+                       0 AS visits
+                FROM appointments_{level} WHERE {column} >= :start AND {column} < :end
+                UNION ALL
+                SELECT {column}, CASE :by WHEN 'department'
+                                THEN COALESCE((SELECT department_id FROM doctors WHERE doctor_id = v.doctor_id), 0)
+                                ELSE doctor_id END,
+                       0, 0, 0, 0, visits
+                FROM visits_{level} v WHERE {column} >= :start AND {column} < :end
+            )
+            GROUP BY period, key_id
+        ) t
+        LEFT JOIN doctors d ON :by <> 'department' AND d.doctor_id = t.key_id
+        LEFT JOIN departments dep ON :by = 'department' AND dep.department_id = t.key_id
+        ORDER BY t.period, name
+    '''
+
+
+CATALOG = {
+    # --- patients ---
+    'patients.list': Query(
+        'SELECT patient_id, first_name, last_name, dob, phone FROM patients', ('patients',), ('patients',),
+        (('last_name', 'first_name', 'patient_id'), ('last_name', 'first_name', 'patient_id'))),
+    'patients.insert': Query('''
+        INSERT INTO patients (first_name, last_name, dob, phone, email, address, insurance)
+        VALUES (:first_name, :last_name, :dob, :phone, :email, :address, :insurance)
+    '''),
+    'patients.delete': Query('DELETE FROM patients WHERE patient_id = :patient_id'),
+
+    # --- appointments and doctors ---
+    'appointments.list': Query('''
+        SELECT a.appointment_id, a.appointment_datetime, a.status, a.reason,
+               p.patient_id, p.first_name AS patient_first, p.last_name AS patient_last,
+               d.doctor_id, d.first_name AS doctor_first, d.last_name AS doctor_last
+        FROM appointments a
+        JOIN patients p ON a.patient_id = p.patient_id
+        JOIN doctors d ON a.doctor_id = d.doctor_id
+    ''', ('appointments', 'patients', 'doctors'), (),
+        (('a.appointment_datetime', 'a.appointment_id'), ('appointment_datetime', 'appointment_id'))),
+    'doctors.choices': Query(
+        'SELECT doctor_id, first_name, last_name FROM doctors ORDER BY last_name, first_name',
+        ('doctors',), ('doctors',)),
+    'doctors.exists': Query('SELECT 1 FROM doctors WHERE doctor_id = :doctor_id', ('doctors',)),
+
+    # --- reports (titles and parameters in reports.py) ---
+    'report.billing': Query('''
+        SELECT s.patient_id, p.first_name || ' ' || p.last_name AS patient_name,
+               s.total_billed, s.total_unpaid, s.bill_count, s.last_bill_at
+        FROM patient_billing_summary s
+        JOIN patients p ON s.patient_id = p.patient_id
+        ORDER BY s.total_unpaid DESC
+    ''', ('patient_billing_summary', 'patients'), ('patient_billing_summary',)),
+    # the workload reports read the trigger-maintained rollups (rollups.py), which
+    # change exactly when the source tables do: those are listed for invalidation
+    'report.doctor-workload': Query('''
+        SELECT d.doctor_id, d.first_name || ' ' || d.last_name AS doctor_name,
+               COALESCE(SUM(r.appointments), 0) AS upcoming_appointments
+        FROM doctors d
+        LEFT JOIN appointments_daily r ON r.doctor_id = d.doctor_id AND r.day >= :start AND r.day < :end
+        GROUP BY d.doctor_id, doctor_name
+        ORDER BY upcoming_appointments DESC
+    ''', ('doctors', 'appointments'), ('doctors',)),
+    'report.workload': Query(_workload_sql(
+        'daily', "CASE :grain WHEN 'week' THEN date(day, '-6 days', 'weekday 1') ELSE day END"),
+        ('appointments', 'visits', 'doctors', 'departments')),
+    'report.workload-monthly': Query(_workload_sql(
+        'monthly', "CASE :grain WHEN 'year' THEN substr(month, 1, 4) || '-01-01' ELSE month END"),
+        ('appointments', 'visits', 'doctors', 'departments')),
+    'report.daily-appointments': Query('''
+        SELECT a.appointment_id, a.appointment_datetime, a.status, p.first_name || ' ' || p.last_name AS patient_name,
+               d.first_name || ' ' || d.last_name AS doctor_name
+        FROM appointments a
+        JOIN patients p ON a.patient_id = p.patient_id
+        JOIN doctors d ON a.doctor_id = d.doctor_id
+        WHERE a.appointment_datetime >= :start AND a.appointment_datetime < :end
+        ORDER BY a.appointment_datetime
+    ''', ('appointments', 'patients', 'doctors')),
+    'report.overdue-bills': Query('''
+        SELECT b.bill_id, b.issued_at, b.amount, b.status, p.first_name || ' ' || p.last_name AS patient_name
+        FROM bills b
+        JOIN patients p ON b.patient_id = p.patient_id
+        WHERE b.status = 'unpaid' AND b.issued_at < :before
+        ORDER BY b.issued_at
+    ''', ('bills', 'patients')),
+
+    # AR aging (ar_aging.py): bills as numbers, dates as day ordinals (date.toordinal())
+    'bills.aging-chunk': Query('''
+        SELECT bill_id, patient_id, amount, COALESCE(status = 'paid', 0),
+               COALESCE(julianday(substr(issued_at, 1, 10)) - 1721424.5, 0),
+               COALESCE(julianday(substr(paid_at, 1, 10)) - 1721424.5, 0)
+        FROM bills WHERE bill_id > :after ORDER BY bill_id LIMIT :limit
+    ''', ('bills',)),
+
+    # --- verify.py ---
+    'verify.test-visit': Query('''
+        INSERT INTO visits (appointment_id, patient_id, doctor_id, visit_date, diagnosis, notes)
+        VALUES (NULL, :patient_id, :doctor_id, :visit_date, 'Check', 'Auto-test')
+    '''),
+    'verify.last-bill': Query(
+        'SELECT bill_id, visit_id, patient_id, amount, status FROM bills ORDER BY bill_id DESC LIMIT 1', ('bills',),
+        ('bills',)),  # reads one row from the end of the table
+    'verify.billing-summary': Query(
+        'SELECT bill_count, total_unpaid FROM patient_billing_summary WHERE patient_id = :patient_id',
+        ('patient_billing_summary',)),
+}
+
+_PARAM = re.compile(r':(\w+)')
+
+
+def get(name):
+    return CATALOG[name]
+
+
+def param_names(sql):
+    return tuple(dict.fromkeys(_PARAM.findall(sql)))
+
+
+def is_read(sql):
+    return sql.lstrip().upper().startswith(('SELECT', 'WITH'))
+
+
+# --- records ---
+
+def _getitem(self, key, _get=tuple.__getitem__):
+    if key.__class__ is str:
+        return _get(self, self._index[key])
+    return _get(self, key)
+
+
+def _keys(self):
+    return self._columns
+
+
+def _reduce(self):
+    return _rebuild, (self._columns, tuple(self))
+
+
+def _rebuild(columns, values):
+    return tuple.__new__(record_type(columns), values)
+
+
+_record_types = {}
+
+
+def record_type(columns):
+    """The record class for a column list, created once per distinct list."""
+    columns = tuple(columns)
+    rtype = _record_types.get(columns)
+    if rtype is None:
+        base = namedtuple('Record', columns, rename=True)
+        rtype = type('Record', (base,), {
+            '__slots__': (), '__getitem__': _getitem, 'keys': _keys, '__reduce__': _reduce,
+            '_columns': columns, '_index': {c: i for i, c in enumerate(columns)}})
+        rtype = _record_types.setdefault(columns, rtype)
+    return rtype
+
+
+def maker(description):
+    """Turn a plain row tuple into a record for a cursor with this ``description``."""
+    # tuple.__new__ via partial keeps record creation in C: no Python frame per row
+    return partial(tuple.__new__, record_type(d[0] for d in description))
+
+
+# --- running statements ---
+
+def _cursor(conn, sql, params):
+    cur = conn.cursor()
+    cur.row_factory = None  # plain tuples, turned into records in bulk
+    cur.execute(sql, params)
+    return cur
+
+
+def execute(conn, name, **params):
+    """Run catalog statement ``name``; returns the cursor (rowcount, lastrowid)."""
+    return _cursor(conn, CATALOG[name].sql, params)
+
+
+def fetch_all(conn, name, **params):
+    cur = execute(conn, name, **params)
+    return list(map(maker(cur.description), cur.fetchall()))
+
+
+def fetch_one(conn, name, **params):
+    cur = execute(conn, name, **params)
+    row = cur.fetchone()
+    make = maker(cur.description)
+    cur.close()
+    return None if row is None else make(row)
+
+
+def records(cur, batch_size=BATCH_SIZE):
+    """Yield an executed cursor's rows as records, fetching ``batch_size`` at a time."""
+    make = maker(cur.description)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from map(make, rows)
+
+
+def iterate(conn, name, batch_size=BATCH_SIZE, **params):
+    """Run ``name``; return (column names, record iterator) for streaming."""
+    cur = execute(conn, name, **params)
+    return [d[0] for d in cur.description], records(cur, batch_size)
+
+
+def keyset_sql(name, after=False, before=False):
+    """SQL of one page of the keyset-paginated listing ``name`` (see pagination.py)."""
+    import pagination
+    return pagination.keyset_sql(CATALOG[name].sql, CATALOG[name].key[0], after, before)
+
+
+def page(conn, name, after=None, before=None, limit=None):
+    """One keyset page of listing ``name``; ValueError for a malformed cursor token."""
+    import pagination
+    query = CATALOG[name]
+    return pagination.keyset_page(conn, query.sql, query.key[0], query.key[1], after=after, before=before,
+                                  limit=limit or pagination.DEFAULT_PAGE_SIZE, fetch=_fetch_records)
+
+
+def listing(conn, name, batch_size=BATCH_SIZE):
+    """Every row of listing ``name`` in key order, streamed (the first-page statement with LIMIT -1)."""
+    return records(_cursor(conn, keyset_sql(name), {'limit': -1}), batch_size)
+
+
+def _fetch_records(conn, sql, params):
+    cur = _cursor(conn, sql, params)
+    return list(map(maker(cur.description), cur.fetchall()))
+
+
+def prepare(conn):
+    """Compile every catalog read into ``conn``'s statement cache.
+
+    Each statement runs with NULL parameters (LIMIT 0), which select nothing
+    or, for parameterless queries, stop after their first row: the cursor is
+    closed at once, so this costs about one compile per statement.
+    """
+    for name, query in CATALOG.items():
+        if not is_read(query.sql):
+            continue
+        if query.key is None:
+            variants = [query.sql]
+        else:
+            variants = [keyset_sql(name, *flags) for flags in ((False, False), (True, False), (False, True))]
+        for sql in variants:
+            params = dict.fromkeys(param_names(sql))
+            if 'limit' in params:
+                params['limit'] = 0  # LIMIT NULL is an error
+            try:
+                conn.execute(sql, params).close()
+            except sqlite3.OperationalError:
+                pass  # schema not migrated yet; compiled on first use instead
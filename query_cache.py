@@ -0,0 +1,229 @@
+"""Process-wide query result cache invalidated by table version counters.
+
+Entries are keyed by database file, SQL text and parameters and remember the versions (from
+the table_versions table, see migrate_table_versions.py) of the tables the
+query reads. A lookup re-reads those counters with one tiny query; if any
+table changed since the entry was stored, the entry is dropped and the query
+runs again. On top of that entries expire after a TTL and the cache is a
+bounded LRU.
+
+By default entries live in this process's memory. Set
+``HOSPITAL_QUERY_CACHE`` to a file path to share one on-disk cache (a small
+SQLite database) between several app worker processes.
+"""
+import itertools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import queries
+
+MAX_ENTRIES = 256
+TTL = 300.0
+# results longer than this are streamed straight through instead of cached
+MAX_ROWS = 5000
+
+
+@lru_cache(maxsize=64)
+def _resolved(path):
+    return str(Path(path).resolve())
+
+
+def database_key(conn):
+    """The resolved path of the database ``conn`` reads, or None for an unnamed in-memory one.
+
+    Pooled connections (db.py, snapshot.py) take it from their pool, so this
+    costs no query.
+    """
+    pool = getattr(conn, 'pool', None)
+    if pool is not None:
+        return _resolved(str(pool.db_path))
+    path = next((row[2] for row in conn.execute('PRAGMA database_list') if row[1] == 'main'), '')
+    return _resolved(path) if path else None
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        """Store ``entry``; returns how many entries were evicted to make room."""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskBackend:
+    """LRU cache stored in a shared SQLite file so several workers see one warm cache."""
+
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS cache (
+                key BLOB PRIMARY KEY, entry BLOB NOT NULL, used_at REAL NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_used ON cache(used_at)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA journal_mode = WAL;')
+            conn.execute('PRAGMA synchronous = OFF;')
+        return conn
+
+    def get(self, key):
+        k = pickle.dumps(key)
+        with self._conn() as conn:
+            row = conn.execute('SELECT entry FROM cache WHERE key = ?', (k,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE cache SET used_at = ? WHERE key = ?', (time.time(), k))
+        return pickle.loads(row[0])
+
+    def set(self, key, entry):
+        with self._conn() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache (key, entry, used_at) VALUES (?, ?, ?)',
+                         (pickle.dumps(key), pickle.dumps(entry), time.time()))
+            over = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_entries
+            if over > 0:
+                conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used_at LIMIT ?)', (over,))
+        return max(over, 0)
+
+    def delete(self, key):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (pickle.dumps(key),))
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class QueryCache:
+    def __init__(self, backend=None, ttl=TTL, max_rows=MAX_ROWS):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidated': 0, 'uncacheable': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    @staticmethod
+    def table_versions(conn, tables):
+        """Current version of each table, or None if any of them is not versioned."""
+        try:
+            rows = conn.execute('SELECT table_name, version FROM table_versions').fetchall()
+        except sqlite3.OperationalError:
+            return None
+        versions = dict((r[0], r[1]) for r in rows)
+        if not tables or any(t not in versions for t in tables):
+            return None
+        return tuple(versions[t] for t in tables)
+
+    def query(self, conn, sql, params=(), tables=(), batch_size=500):
+        """Return the rows of ``sql`` as records (queries.py), from cache when still valid.
+
+        ``params`` is a sequence or a dict of named parameters; ``tables``
+        lists every table the query reads. Short results come back as a
+        list; results over ``max_rows`` are streamed from the cursor.
+        """
+        versions = self.table_versions(conn, tables)
+        database = database_key(conn) if versions is not None else None
+        if database is None:
+            versions = None
+        key = (database, sql, tuple(sorted(params.items())) if isinstance(params, dict) else tuple(params))
+        if versions is not None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                stored_at, stored_versions, rows = entry
+                if stored_versions != versions:
+                    self._count('invalidated')
+                    self.backend.delete(key)
+                elif time.time() - stored_at > self.ttl:
+                    self._count('expired')
+                    self.backend.delete(key)
+                else:
+                    self._count('hits')
+                    return rows
+        self._count('misses')
+        cur = conn.cursor()
+        cur.row_factory = None
+        cur.execute(sql, params)
+        make = queries.maker(cur.description)
+        rows = []
+        while len(rows) <= self.max_rows:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            rows.extend(map(make, batch))
+        else:
+            self._count('uncacheable')
+            return itertools.chain(rows, queries.records(cur, batch_size))
+        if versions is not None:
+            self._count('evictions', self.backend.set(key, (time.time(), versions, rows)))
+        return rows
+
+    def fetch(self, conn, name, **params):
+        """``query()`` for catalog entry ``name`` (queries.py), which lists the tables it reads."""
+        query = queries.get(name)
+        return self.query(conn, query.sql, params, query.tables)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(entries=len(self.backend), ttl=self.ttl)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide cache, on disk if HOSPITAL_QUERY_CACHE is set."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            path = os.environ.get('HOSPITAL_QUERY_CACHE')
+            _cache = QueryCache(DiskBackend(path) if path else MemoryBackend())
+        return _cache
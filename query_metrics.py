@@ -0,0 +1,290 @@
+"""Per-statement SQL instrumentation, slow-query log and Prometheus metrics.
+
+Pooled connections (see db.py) hand out ``InstrumentedCursor`` objects. A
+statement is timed from ``execute()`` until its result set is exhausted, the
+cursor is reused or it is garbage collected. Only the time spent inside
+SQLite counts; time the caller spends rendering rows between fetches does not.
+Each statement is attributed to the current caller: the Flask endpoint or
+the Click command, set with ``set_caller()``.
+
+Statements slower than ``HOSPITAL_SLOW_QUERY_MS`` (default 100) are logged
+to the ``hospital.slow_query`` logger together with their ``EXPLAIN QUERY
+PLAN``. Set ``HOSPITAL_SLOW_QUERY_LOG`` to also append them to a file.
+Parameter values are patient data, so only their count and types are logged
+unless ``HOSPITAL_SLOW_QUERY_LOG_PARAMS=1``.
+``HOSPITAL_QUERY_METRICS=0`` turns the instrumentation off.
+"""
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get('HOSPITAL_QUERY_METRICS', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('HOSPITAL_SLOW_QUERY_MS', '100'))
+SLOW_QUERY_LOG = os.environ.get('HOSPITAL_SLOW_QUERY_LOG')
+LOG_PARAM_VALUES = os.environ.get('HOSPITAL_SLOW_QUERY_LOG_PARAMS', '0') == '1'
+RECENT_SLOW = 50
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_log = None
+
+
+def slow_log():
+    """The ``hospital.slow_query`` logger, set up on the first slow statement."""
+    global _log
+    if _log is None:
+        import logging  # kept off the CLI's startup path
+        log = logging.getLogger('hospital.slow_query')
+        if SLOW_QUERY_LOG:
+            handler = logging.FileHandler(SLOW_QUERY_LOG, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            log.addHandler(handler)
+        _log = log
+    return _log
+
+
+_caller = contextvars.ContextVar('sql_caller', default='-')
+
+
+def set_caller(name):
+    """Attribute statements run from now on (in this thread/context) to ``name``."""
+    _caller.set(name or '-')
+
+
+def current_caller():
+    return _caller.get()
+
+
+def _operation(sql):
+    words = sql.lstrip().split(None, 1)
+    return words[0].lower() if words else '-'
+
+
+def explain(conn, sql, params=()):
+    """EXPLAIN QUERY PLAN details for ``sql``, or None if it cannot be explained."""
+    try:
+        # the base class execute() keeps the plan query itself out of the metrics
+        rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    except sqlite3.Error:
+        return None
+    return [r[3] for r in rows]
+
+
+def describe_params(params, values=False):
+    """How a slow statement's parameters are logged: count and types, or with ``values`` their repr."""
+    if values:
+        return repr(params)[:200]
+    if isinstance(params, dict):
+        types = ', '.join(f'{name}={type(value).__name__}' for name, value in sorted(params.items()))
+    else:
+        types = ', '.join(type(value).__name__ for value in params)
+    return f'{len(params)} ({types})'
+
+
+class StatementStats:
+    """Counters and latency histograms per (caller, SQL operation)."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, log_params=LOG_PARAM_VALUES):
+        self.slow_ms = slow_ms
+        self.log_params = log_params
+        self._lock = threading.Lock()
+        self._series = {}
+        self._slow = deque(maxlen=RECENT_SLOW)
+
+    def record(self, caller, sql, seconds, rows, conn=None, params=(), error=False):
+        op = _operation(sql)
+        slow = seconds * 1000 >= self.slow_ms
+        with self._lock:
+            s = self._series.get((caller, op))
+            if s is None:
+                s = self._series[(caller, op)] = {'count': 0, 'seconds': 0.0, 'rows': 0, 'slow': 0, 'errors': 0,
+                                                  'buckets': [0] * len(BUCKETS)}
+            s['count'] += 1
+            s['seconds'] += seconds
+            s['rows'] += max(rows, 0)
+            s['slow'] += slow
+            s['errors'] += error
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    s['buckets'][i] += 1
+                    break
+        if slow:
+            plan = explain(conn, sql, params) if conn is not None and op in ('select', 'with') else None
+            entry = {'caller': caller, 'ms': round(seconds * 1000, 3), 'rows': rows, 'sql': ' '.join(sql.split()),
+                     'params': describe_params(params, self.log_params), 'plan': plan}
+            with self._lock:
+                self._slow.append(entry)
+            slow_log().warning('slow query %.1f ms caller=%s rows=%d sql=%s params=%s plan=%s',
+                               entry['ms'], caller, rows, entry['sql'], entry['params'], plan)
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(s, buckets=list(s['buckets'])) for key, s in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._slow.clear()
+
+
+_stats = StatementStats()
+
+
+def get_stats():
+    return _stats
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """sqlite3 cursor that reports latency and row counts to ``get_stats()``."""
+
+    _sql = None
+
+    def _start(self, sql, params, elapsed):
+        self._sql, self._params, self._elapsed, self._rows = sql, params, elapsed, 0
+        self._who = _caller.get()
+
+    def _finish(self, error=False, collected=False):
+        sql = self._sql
+        if sql is None:
+            return
+        self._sql = None
+        rows = self._rows if self.description is not None else self.rowcount
+        # from __del__ the pooled connection may be checked out by another
+        # thread by now: record the timing only, no EXPLAIN on it
+        conn = None if collected else self.connection
+        _stats.record(self._who, sql, self._elapsed, rows, conn, self._params, error)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except sqlite3.Error:
+            self._start(sql, parameters, time.perf_counter() - start)
+            self._finish(error=True)
+            raise
+        self._start(sql, parameters, time.perf_counter() - start)
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error:
+            self._start(sql, (), time.perf_counter() - start)
+            self._finish(error=True)
+            raise
+        self._start(sql, (), time.perf_counter() - start)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+            if row is None:
+                self._finish()
+            else:
+                self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+            self._rows += len(rows)
+            if len(rows) < size:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            if self._sql is not None:
+                self._elapsed += time.perf_counter() - start
+                self._finish()
+            raise
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+            self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # e.g. conn.execute(...).fetchone(): the cursor is dropped before exhaustion
+        try:
+            self._finish(collected=True)
+        except Exception:
+            pass
+
+
+def cursor_factory():
+    return InstrumentedCursor if ENABLED else sqlite3.Cursor
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def render_prometheus(stats=None):
+    """Statement counters and latency histograms in Prometheus text format."""
+    series = sorted((stats or _stats).snapshot().items())
+    lines = []
+    for name, field, kind, help_text in (
+            ('hospital_sql_statements_total', 'count', 'counter', 'SQL statements executed.'),
+            ('hospital_sql_rows_total', 'rows', 'counter', 'Rows returned (SELECT) or changed (DML).'),
+            ('hospital_sql_slow_statements_total', 'slow', 'counter', f'Statements slower than {SLOW_QUERY_MS:g} ms.'),
+            ('hospital_sql_errors_total', 'errors', 'counter', 'Statements that raised an error.')):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{_labels(caller=caller, op=op)} {s[field]}' for (caller, op), s in series]
+    name = 'hospital_sql_statement_duration_seconds'
+    lines += [f'# HELP {name} Time spent in SQLite per statement.', f'# TYPE {name} histogram']
+    for (caller, op), s in series:
+        cumulative = 0
+        for bound, n in zip(BUCKETS, s['buckets']):
+            cumulative += n
+            lines.append(f'{name}_bucket{_labels(caller=caller, op=op, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(caller=caller, op=op, le="+Inf")} {s["count"]}')
+        lines.append(f'{name}_sum{_labels(caller=caller, op=op)} {s["seconds"]:.6f}')
+        lines.append(f'{name}_count{_labels(caller=caller, op=op)} {s["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def render_gauges(prefix, values, help_text):
+    """Render a flat dict of numbers (e.g. pool or cache stats) as gauges."""
+    lines = []
+    for key, value in sorted(values.items()):
+        if isinstance(value, (int, float)):
+            lines += [f'# HELP {prefix}_{key} {help_text} ({key})', f'# TYPE {prefix}_{key} gauge', f'{prefix}_{key} {value}']
+    return '\n'.join(lines) + '\n'
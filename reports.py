@@ -0,0 +1,115 @@
+"""Report queries shared by the web routes and the CLI, plus streaming exporters.
+
+The SQL lives in the query catalog (queries.py). Rows are pulled from the
+cursor in ``fetchmany`` batches and handed on one at a time, so the HTML
+pages, CSV/NDJSON downloads and CLI output keep memory flat however many
+rows a report returns.
+"""
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import date, timedelta
+
+import clinic_time
+import queries
+
+BATCH_SIZE = 500
+
+# query: the catalog entry (queries.py), or a function of the params that picks
+# one; params: computed per request from its arguments (query string or
+# command options, a mapping), raising ValueError for malformed ones
+Report = namedtuple('Report', 'title query params')
+
+WORKLOAD_GRAINS = ('day', 'week', 'month', 'year')
+WORKLOAD_BY = ('department', 'doctor')
+WORKLOAD_MONTHS = 12
+
+
+def _month_start(day, months_back=0):
+    months = day.year * 12 + day.month - 1 - months_back
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def workload_params(args):
+    """start/end (half-open, 'YYYY-MM-DD'), grain and by of the workload report.
+
+    Defaults to the last ``WORKLOAD_MONTHS`` months by month and department.
+    Month and year grains cover whole months: the range is widened to them.
+    """
+    grain, by = args.get('grain') or 'month', args.get('by') or 'department'
+    if grain not in WORKLOAD_GRAINS or by not in WORKLOAD_BY:
+        raise ValueError(f'grain must be one of {WORKLOAD_GRAINS} and by one of {WORKLOAD_BY}')
+    today = clinic_time.clinic_today()
+    end = date.fromisoformat(args['end']) if args.get('end') else today + timedelta(days=1)
+    start = date.fromisoformat(args['start']) if args.get('start') else _month_start(today, WORKLOAD_MONTHS - 1)
+    if grain in ('month', 'year'):
+        start = _month_start(start)
+        end = end if end.day == 1 else _month_start(end, -1)
+    if start >= end:
+        raise ValueError('start must be before end')
+    return {'start': start.isoformat(), 'end': end.isoformat(), 'grain': grain, 'by': by}
+
+
+REPORTS = {
+    'billing': Report('Billing summary per patient', 'report.billing', lambda args: {}),
+    'doctor-workload': Report(
+        'Doctor workload (appointments next 7 days)', 'report.doctor-workload',
+        lambda args: dict(zip(('start', 'end'), clinic_time.day_range(days=8)))),
+    'daily-appointments': Report(
+        "Today's appointments", 'report.daily-appointments',
+        lambda args: dict(zip(('start', 'end'), clinic_time.day_range()))),
+    'overdue-bills': Report(
+        'Overdue unpaid bills (issued >30 days ago)', 'report.overdue-bills',
+        lambda args: {'before': clinic_time.days_ago(30)}),
+    # month and year grains read the monthly rollups (rollups.py)
+    'workload': Report(
+        'Workload by period and department or doctor',
+        lambda params: 'report.workload-monthly' if params['grain'] in ('month', 'year') else 'report.workload',
+        workload_params),
+}
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def resolve(name, args=None):
+    """(catalog entry, params) of report ``name`` for ``args``; ValueError for malformed args."""
+    report = REPORTS[name]
+    params = report.params(args or {})
+    return (report.query(params) if callable(report.query) else report.query), params
+
+
+def run_report(conn, name, batch_size=BATCH_SIZE, args=None):
+    """Execute report ``name``; return (column names, record iterator)."""
+    query, params = resolve(name, args)
+    return queries.iterate(conn, query, batch_size, **params)
+
+
+def iter_csv(columns, rows, batch_size=BATCH_SIZE):
+    """Yield CSV text (header first) in chunks of about ``batch_size`` rows."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(tuple(row))
+        if i % batch_size == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def iter_ndjson(columns, rows, batch_size=BATCH_SIZE):
+    """Yield one JSON object per line, grouped into chunks of ``batch_size`` rows."""
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(columns, tuple(row)))))
+        if len(chunk) == batch_size:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def export(fmt, columns, rows):
+    return (iter_csv if fmt == 'csv' else iter_ndjson)(columns, rows)
@@ -0,0 +1,242 @@
+"""Workload rollups: appointments and visits counted per day and per month, kept current by triggers.
+
+appointments_daily / appointments_monthly count appointments per (period,
+doctor, department, status); visits_daily / visits_monthly count visits
+per (period, doctor). Triggers on appointments and visits apply each
+INSERT/UPDATE/DELETE as a +1/-1 delta, so the workload reports read a
+rollup instead of counting appointments: the daily tables for day and week
+grains and 7-day windows, the monthly ones for month and year grains.
+Appointments count toward their own department_id or, when that is unset
+(demo seed, bulk import, legacy rows), their doctor's, the department visits
+are reported under too, so a doctor's work is never split off into "no
+department"; 0 when neither is known. Visits are counted per doctor and
+placed in the doctor's department when a report runs. Nothing changes a
+doctor's department; if that is done by hand, ``rebuild()`` recounts.
+
+archive.py adds back the counts of the rows it moves before deleting them,
+so archiving keeps the history. ``rebuild()`` recounts from the live
+tables, plus an archive file when given (``python cli.py rebuild-rollups``).
+"""
+# source table -> (primary key, columns the rollup dimensions read)
+SOURCES = {
+    'appointments': ('appointment_id', ('appointment_datetime', 'doctor_id', 'department_id', 'status')),
+    'visits': ('visit_id', ('visit_date', 'doctor_id')),
+}
+
+
+def _dims(period, extra):
+    return dict(period, doctor_id='{r}.doctor_id', **extra)
+
+
+_APPOINTMENT = {
+    'department_id': 'COALESCE({r}.department_id, (SELECT department_id FROM doctors WHERE doctor_id = {r}.doctor_id), 0)',
+    'status': "COALESCE({r}.status, '')",
+}
+
+# rollup table -> (source table, count column, rollup column -> its value for a
+# source row {r}); the first column is the period, NULL rows are not counted
+ROLLUPS = {
+    'appointments_daily': ('appointments', 'appointments', _dims(
+        {'day': 'substr({r}.appointment_datetime, 1, 10)'}, _APPOINTMENT)),
+    'appointments_monthly': ('appointments', 'appointments', _dims(
+        {'month': "substr({r}.appointment_datetime, 1, 7) || '-01'"}, _APPOINTMENT)),
+    'visits_daily': ('visits', 'visits', _dims({'day': 'substr({r}.visit_date, 1, 10)'}, {})),
+    'visits_monthly': ('visits', 'visits', _dims({'month': "substr({r}.visit_date, 1, 7) || '-01'"}, {})),
+}
+
+SQL_TABLES = '''
+CREATE TABLE IF NOT EXISTS appointments_daily (
+    day TEXT NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    department_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    appointments INTEGER NOT NULL,
+    PRIMARY KEY (day, doctor_id, department_id, status)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_appointments_daily_doctor ON appointments_daily(doctor_id, day);
+
+CREATE TABLE IF NOT EXISTS appointments_monthly (
+    month TEXT NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    department_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    appointments INTEGER NOT NULL,
+    PRIMARY KEY (month, doctor_id, department_id, status)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS visits_daily (
+    day TEXT NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    visits INTEGER NOT NULL,
+    PRIMARY KEY (day, doctor_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS visits_monthly (
+    month TEXT NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    visits INTEGER NOT NULL,
+    PRIMARY KEY (month, doctor_id)
+) WITHOUT ROWID;
+'''
+
+
+def _rollups_of(source):
+    return [(rollup, count, dims) for rollup, (src, count, dims) in ROLLUPS.items() if src == source]
+
+
+def _values(dims, row):
+    return ', '.join(expr.format(r=row) for expr in dims.values())
+
+
+def _match(dims, row):
+    return ' AND '.join(f'{col} = {expr.format(r=row)}' for col, expr in dims.items())
+
+
+def _period(dims, row):
+    return next(iter(dims.values())).format(r=row)
+
+
+def _increment(rollup, count, dims, row):
+    return (f'INSERT INTO {rollup} ({", ".join(dims)}, {count}) SELECT {_values(dims, row)}, 1 '
+            f'WHERE {_period(dims, row)} IS NOT NULL '
+            f'ON CONFLICT ({", ".join(dims)}) DO UPDATE SET {count} = {count} + 1;')
+
+
+def _decrement(rollup, count, dims, row):
+    return (f'UPDATE {rollup} SET {count} = {count} - 1 WHERE {_match(dims, row)};\n'
+            f'    DELETE FROM {rollup} WHERE {_match(dims, row)} AND {count} <= 0;')
+
+
+def triggers_sql(source):
+    columns = SOURCES[source][1]
+    rollups = _rollups_of(source)
+    increment = '\n    '.join(_increment(*r, 'NEW') for r in rollups)
+    decrement = '\n    '.join(_decrement(*r, 'OLD') for r in rollups)
+    changed = ' OR '.join(dict.fromkeys(f'{expr.format(r="OLD")} IS NOT {expr.format(r="NEW")}'
+                                        for _, _, dims in rollups for expr in dims.values()))
+    return f'''
+CREATE TRIGGER IF NOT EXISTS trg_rollup_{source}_insert
+AFTER INSERT ON {source}
+BEGIN
+    {increment}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_{source}_delete
+AFTER DELETE ON {source}
+BEGIN
+    {decrement}
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_{source}_update
+AFTER UPDATE OF {", ".join(columns)} ON {source}
+WHEN {changed}
+BEGIN
+    {decrement}
+    {increment}
+END;
+'''
+
+
+SQL_ROLLUPS = SQL_TABLES + ''.join(triggers_sql(source) for source in SOURCES)
+
+
+def drop_triggers_sql(source):
+    return ''.join(f'DROP TRIGGER IF EXISTS trg_rollup_{source}_{event};\n' for event in ('insert', 'delete', 'update'))
+
+
+
+def add_sql(rollup, where, schema='main'):
+    """Statement adding the counts of source rows matching ``where`` (alias s) in ``schema`` to ``rollup``."""
+    source, count, dims = ROLLUPS[rollup]
+    positions = ', '.join(str(i) for i in range(1, len(dims) + 1))
+    return (f'INSERT INTO main.{rollup} ({", ".join(dims)}, {count}) '
+            f'SELECT {_values(dims, "s")}, COUNT(*) FROM {schema}.{source} s '
+            f'WHERE ({where}) AND {_period(dims, "s")} IS NOT NULL GROUP BY {positions} '
+            f'ON CONFLICT ({", ".join(dims)}) DO UPDATE SET {count} = {count} + excluded.{count}')
+
+
+def backfill_statements(rollups=tuple(ROLLUPS)):
+    """Recount ``rollups`` per doctor range (:lo, :hi), one transaction per range,
+    overwriting the partial rows the triggers wrote for it in the meantime."""
+    return tuple(
+        statement
+        for rollup in rollups
+        for statement in (f'DELETE FROM {rollup} WHERE doctor_id >= :lo AND doctor_id < :hi',
+                          add_sql(rollup, 's.doctor_id >= :lo AND s.doctor_id < :hi'))
+    )
+
+
+BACKFILL_STATEMENTS = backfill_statements()
+
+# rows of archive.py's current batch (temp.archive_batch), counted back in
+# before they are deleted so the rollups keep archived history
+SQL_KEEP_ARCHIVED = tuple(add_sql(rollup, 's.patient_id IN temp.archive_batch') for rollup in ROLLUPS)
+
+# archived rows of patients no longer in the main database (not partial copies)
+_ARCHIVED = 's.patient_id NOT IN (SELECT patient_id FROM main.patients)'
+
+
+def add_new(conn, source, watermark):
+    """Count ``source`` rows with keys above ``watermark`` (loaded with the triggers dropped)."""
+    key = SOURCES[source][0]
+    for rollup, _, _ in _rollups_of(source):
+        conn.execute(add_sql(rollup, f's.{key} > ?'), (watermark,))
+
+
+def _attach_archive(conn, archive_path):
+    """Attach ``archive_path`` as ``archive`` unless it already is; True if this call attached it."""
+    if archive_path is None or any(r[1] == 'archive' for r in conn.execute('PRAGMA database_list')):
+        return False
+    conn.execute('ATTACH DATABASE ? AS archive', (str(archive_path),))
+    return True
+
+
+def _archive_has(conn, table):
+    return conn.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,)).fetchone() is not None
+
+
+def rebuild(conn, archive_path=None):
+    """Recount every rollup from scratch in one transaction; returns {rollup: rows}.
+
+    With ``archive_path`` the archived appointments and visits are counted too.
+    """
+    attached = _attach_archive(conn, archive_path)
+    try:
+        with conn:
+            for rollup, (source, _, _) in ROLLUPS.items():
+                conn.execute(f'DELETE FROM {rollup}')
+                conn.execute(add_sql(rollup, '1'))
+                if archive_path is not None and _archive_has(conn, source):
+                    conn.execute(add_sql(rollup, _ARCHIVED, schema='archive'))
+            # cached report results were computed from the old counts
+            conn.executemany('UPDATE table_versions SET version = version + 1 WHERE table_name = ?',
+                             [(source,) for source in SOURCES])
+        return {rollup: conn.execute(f'SELECT COUNT(*) FROM {rollup}').fetchone()[0] for rollup in ROLLUPS}
+    finally:
+        if attached:
+            conn.execute('DETACH DATABASE archive')
+
+
+def check(conn, archive_path=None):
+    """Return (rollup, key, expected, stored) for every rollup row that differs from a recount."""
+    attached = _attach_archive(conn, archive_path)
+    try:
+        mismatches = []
+        for rollup, (source, count, dims) in ROLLUPS.items():
+            selects = [f'SELECT {_values(dims, "s")} FROM main.{source} s']
+            if archive_path is not None and _archive_has(conn, source):
+                selects.append(f'SELECT {_values(dims, "s")} FROM archive.{source} s WHERE {_ARCHIVED}')
+            positions = ', '.join(str(i) for i in range(1, len(dims) + 1))
+            expected = {tuple(r[:-1]): r[-1] for r in conn.execute(
+                f'SELECT *, COUNT(*) FROM ({" UNION ALL ".join(selects)}) GROUP BY {positions}')
+                if r[0] is not None}
+            stored = {tuple(r[:-1]): r[-1] for r in conn.execute(f'SELECT {", ".join(dims)}, {count} FROM {rollup}')}
+            for key in sorted(expected.keys() | stored.keys(), key=repr):
+                if expected.get(key) != stored.get(key):
+                    mismatches.append((rollup, key, expected.get(key), stored.get(key)))
+        return mismatches
+    finally:
+        if attached:
+            conn.execute('DETACH DATABASE archive')
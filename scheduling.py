@@ -0,0 +1,240 @@
+"""Doctor availability: free-slot search and conflict-checked booking.
+
+An appointment occupies one ``SLOT_MINUTES`` slot. For every doctor the
+start times of upcoming, non-cancelled appointments are kept in memory as a
+sorted list of minute numbers, so "is this slot free" is one bisect and
+"next N free slots" walks the clinic's slot grid with one bisect per
+candidate instead of a query per candidate. A doctor's list is loaded on
+first use with one range scan of ``idx_appointments_doctor_slot`` and
+reloaded when the appointments version in table_versions moves, i.e. after
+any process changed appointments.
+
+``book()`` re-checks the slot against the database inside the caller's
+IMMEDIATE transaction before inserting, so two concurrent bookings (the web
+writer thread, the CLI, another worker) can never both get the same slot;
+the loser gets ``SlotTaken``. A time the free-slot search would never
+offer (in the past, on a closed day, outside clinic hours) gets
+``SlotUnavailable``.
+
+Clinic hours default to weekdays 08:00-17:00 in 15 minute slots, like the
+seeded data. Override with HOSPITAL_SLOT_MINUTES and HOSPITAL_CLINIC_HOURS
+(e.g. ``09:00-18:00``).
+"""
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+from bisect import bisect_right
+from datetime import date
+from pathlib import Path
+
+import clinic_time
+
+SLOT_MINUTES = int(os.environ.get('HOSPITAL_SLOT_MINUTES', '15'))
+CLINIC_HOURS = os.environ.get('HOSPITAL_CLINIC_HOURS', '08:00-17:00')
+CLINIC_DAYS = (0, 1, 2, 3, 4)  # Monday..Friday
+# how far ahead next_free() looks before giving up
+SEARCH_DAYS = 90
+DEFAULT_COUNT = 10
+MAX_COUNT = 100
+
+DAY = 24 * 60
+
+
+def _hhmm(text):
+    hours, minutes = text.strip().split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+OPEN, CLOSE = (_hhmm(t) for t in CLINIC_HOURS.split('-'))
+
+
+class SlotTaken(Exception):
+    """The requested slot overlaps an existing appointment of the doctor."""
+
+    def __init__(self, doctor_id, requested, conflict, next_free=()):
+        super().__init__(f'Doctor {doctor_id} already has an appointment at {conflict}')
+        self.doctor_id = doctor_id
+        self.requested = requested
+        self.conflict = conflict
+        self.next_free = list(next_free)
+
+
+class SlotUnavailable(Exception):
+    """The requested time is in the past or outside clinic days and hours."""
+
+    def __init__(self, requested, reason, next_free=()):
+        super().__init__(f'{requested} is {reason}')
+        self.requested = requested
+        self.reason = reason
+        self.next_free = list(next_free)
+
+
+def to_minutes(value):
+    """'YYYY-MM-DD HH:MM' (the stored form) -> minutes since 0001-01-01."""
+    return (date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal() * DAY
+            + int(value[11:13]) * 60 + int(value[14:16]))
+
+
+def from_minutes(minutes):
+    day, minute = divmod(minutes, DAY)
+    return f'{date.fromordinal(day).isoformat()} {minute // 60:02d}:{minute % 60:02d}'
+
+
+def _appointments_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM table_versions WHERE table_name = 'appointments'").fetchone()
+    except sqlite3.OperationalError:  # not migrated yet: always reload
+        return None
+    return row[0] if row else None
+
+
+def unavailable_reason(minutes):
+    """Why the slot starting at ``minutes`` cannot be booked, or None if it can."""
+    day, minute = divmod(minutes, DAY)
+    if minutes < _after(None) - 1:
+        return 'in the past'
+    if date.fromordinal(day).weekday() not in CLINIC_DAYS:
+        return 'not a clinic day'
+    if minute < OPEN or minute + SLOT_MINUTES > CLOSE:
+        return f'outside clinic hours ({CLINIC_HOURS})'
+    return None
+
+
+def stored_conflict(conn, doctor_id, minutes):
+    """Start of a stored appointment overlapping ``minutes``, straight from the index."""
+    row = conn.execute('''
+        SELECT appointment_datetime FROM appointments
+        WHERE doctor_id = ? AND appointment_datetime > ? AND appointment_datetime < ? AND status <> 'cancelled'
+        ORDER BY appointment_datetime LIMIT 1
+    ''', (doctor_id, from_minutes(minutes - SLOT_MINUTES), from_minutes(minutes + SLOT_MINUTES))).fetchone()
+    return row[0] if row else None
+
+
+class SlotIndex:
+    """Sorted booked-slot lists per doctor, shared by all threads of the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # doctor_id -> (appointments version, first minute covered, sorted start minutes);
+        # lists are replaced, never mutated, so readers need no lock
+        self._doctors = {}
+
+    def clear(self):
+        with self._lock:
+            self._doctors.clear()
+
+    def _load(self, conn, doctor_id, version, floor):
+        booked = []
+        for (value,) in conn.execute('''
+                SELECT appointment_datetime FROM appointments
+                WHERE doctor_id = ? AND appointment_datetime >= ? AND status <> 'cancelled'
+                ORDER BY appointment_datetime
+        ''', (doctor_id, from_minutes(floor - SLOT_MINUTES))):
+            try:
+                booked.append(to_minutes(value))
+            except (TypeError, ValueError):
+                continue  # malformed legacy value, cannot be compared
+        entry = (version, floor, booked)
+        if version is not None:
+            with self._lock:
+                self._doctors[doctor_id] = entry
+        return entry
+
+    def booked(self, conn, doctor_id):
+        """(first minute covered, sorted start minutes) for the doctor, reloaded if stale."""
+        floor = clinic_time.clinic_today().toordinal() * DAY
+        version = _appointments_version(conn)
+        entry = self._doctors.get(doctor_id)
+        if entry is None or version is None or entry[0] != version or entry[1] != floor:
+            entry = self._load(conn, doctor_id, version, floor)
+        return entry[1], entry[2]
+
+    def conflict(self, conn, doctor_id, when):
+        """Start of the appointment that ``when`` would overlap, or None if the slot is free."""
+        minutes = to_minutes(when)
+        floor, booked = self.booked(conn, doctor_id)
+        if minutes < floor:
+            return stored_conflict(conn, doctor_id, minutes)  # past days are not kept in memory
+        i = bisect_right(booked, minutes - SLOT_MINUTES)
+        if i < len(booked) and booked[i] < minutes + SLOT_MINUTES:
+            return from_minutes(booked[i])
+        return None
+
+    def is_free(self, conn, doctor_id, when):
+        return self.conflict(conn, doctor_id, when) is None
+
+    def _free_minutes(self, conn, doctor_id, after):
+        """Free slot starts on the clinic grid from ``after`` on, in order."""
+        floor, booked = self.booked(conn, doctor_id)
+        start = max(after, floor)
+        first_day = start // DAY
+        for day in range(first_day, first_day + SEARCH_DAYS):
+            if date.fromordinal(day).weekday() not in CLINIC_DAYS:
+                continue
+            base = day * DAY
+            offset = OPEN
+            if base + offset < start:
+                offset += -(-(start - base - OPEN) // SLOT_MINUTES) * SLOT_MINUTES
+            for minutes in range(base + offset, base + CLOSE - SLOT_MINUTES + 1, SLOT_MINUTES):
+                i = bisect_right(booked, minutes - SLOT_MINUTES)
+                if i == len(booked) or booked[i] >= minutes + SLOT_MINUTES:
+                    yield minutes
+
+    def next_free(self, conn, doctor_id, count=DEFAULT_COUNT, after=None):
+        """The doctor's next ``count`` free slots (stored datetime strings) after ``after``."""
+        return [from_minutes(m) for m in itertools.islice(self._free_minutes(conn, doctor_id, _after(after)), count)]
+
+    def next_free_in_department(self, conn, department_id, count=DEFAULT_COUNT, after=None):
+        """Next ``count`` free (datetime, doctor_id) pairs across the department's doctors."""
+        doctors = [r[0] for r in conn.execute('SELECT doctor_id FROM doctors WHERE department_id = ? ORDER BY doctor_id',
+                                              (department_id,))]
+        start = _after(after)
+        streams = [zip(self._free_minutes(conn, d, start), itertools.repeat(d)) for d in doctors]
+        return [(from_minutes(m), d) for m, d in itertools.islice(heapq.merge(*streams), count)]
+
+    def book(self, conn, patient_id, doctor_id, when, reason=''):
+        """Insert an appointment unless the slot is taken; returns its id.
+
+        ``conn`` must already be inside a BEGIN IMMEDIATE transaction, which
+        the caller commits: the check and the insert are then atomic.
+        """
+        minutes = to_minutes(when)
+        problem = unavailable_reason(minutes)
+        if problem is not None:
+            raise SlotUnavailable(when, problem, self.next_free(conn, doctor_id, 5))
+        conflict = stored_conflict(conn, doctor_id, minutes)
+        if conflict is not None:
+            raise SlotTaken(doctor_id, when, conflict, self.next_free(conn, doctor_id, 5, when))
+        cur = conn.execute('''
+            INSERT INTO appointments (patient_id, doctor_id, department_id, appointment_datetime, reason)
+            SELECT ?, doctor_id, department_id, ?, ? FROM doctors WHERE doctor_id = ?
+        ''', (patient_id, when, reason, doctor_id))
+        if cur.rowcount != 1:
+            raise LookupError(f'Doctor {doctor_id} not found')
+        # the in-memory list is left alone: the insert moves the appointments
+        # version, so it is reloaded once this commits, and is still right if
+        # it rolls back
+        return cur.lastrowid
+
+
+def _after(value):
+    """Minute number to search from: ``value`` ('YYYY-MM-DD HH:MM') or now."""
+    if value is None:
+        return to_minutes(clinic_time.clinic_now().strftime(clinic_time.DATETIME_FORMAT)) + 1
+    return to_minutes(value)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(db_path):
+    """Return the process-wide slot index for ``db_path``."""
+    key = str(Path(db_path).resolve())
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = SlotIndex()
+        return index
@@ -0,0 +1,293 @@
+"""Versioned schema migrations with online, batched backfills.
+
+Migrations are the numbered files in ``migrations/`` (``0001_name.py`` or
+``0001_name.sql``), applied in order. Each one runs in its own IMMEDIATE
+transaction together with its row in ``schema_migrations``, so a failure
+leaves the database at the previous version. A ``.py`` migration may define:
+
+- ``SQL``: a script of statements to run,
+- ``upgrade(conn)``: extra Python steps in the same transaction,
+- ``BACKFILL``: a ``Backfill`` that rewrites existing rows afterwards.
+
+Backfills never run inside the schema transaction. They walk the table's
+integer key in ranges, one short transaction per range, and record a
+checkpoint in ``migration_backfills`` in that same transaction. The range
+size adapts to keep each transaction near ``TARGET_BATCH_MS``, and the
+runner pauses between batches, so the web app's writer is never stalled
+for long. An interrupted backfill resumes from its checkpoint.
+
+``PRAGMA user_version`` caches "every migration and backfill is done".
+``ensure()`` (called when the CLI and the web app start) compares it with
+``LATEST_VERSION``, so a current database costs a single header read and
+``migrations/`` is not even listed. Bump ``LATEST_VERSION`` with every new
+migration file; ``discover()`` refuses to run until it matches.
+"""
+import importlib.util
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+HERE = Path(__file__).parent
+MIGRATIONS_DIR = HERE / 'migrations'
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.(py|sql)$')
+# version of the newest file in migrations/
+LATEST_VERSION = 11
+
+BATCH_SIZE = 1000
+MIN_BATCH, MAX_BATCH = 100, 100000
+TARGET_BATCH_MS = 50.0
+PAUSE = 0.02
+
+# statements run per key range with :lo (inclusive) and :hi (exclusive) bound
+Backfill = namedtuple('Backfill', 'table key statements')
+Migration = namedtuple('Migration', 'version name path')
+
+SQL_TABLES = '''
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS migration_backfills (
+    name TEXT PRIMARY KEY,
+    next_key INTEGER NOT NULL DEFAULT 0,
+    max_key INTEGER,
+    rows INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+
+def discover(directory=MIGRATIONS_DIR):
+    """All migration files in version order."""
+    found = []
+    for path in directory.iterdir():
+        m = MIGRATION_FILE.match(path.name)
+        if m:
+            found.append(Migration(int(m.group(1)), m.group(2), path))
+    found.sort()
+    versions = [m.version for m in found]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f'Duplicate migration version in {directory}')
+    if directory == MIGRATIONS_DIR and max(versions, default=0) != LATEST_VERSION:
+        raise RuntimeError(f'schema_version.LATEST_VERSION is {LATEST_VERSION} but the newest migration '
+                           f'in {directory} is {max(versions, default=0)}: update LATEST_VERSION')
+    return found
+
+
+def latest_version():
+    return LATEST_VERSION
+
+
+def load(migration):
+    """Return (SQL script, upgrade function or None, Backfill or None) for a migration file."""
+    if migration.path.suffix == '.sql':
+        return migration.path.read_text(encoding='utf-8'), None, None
+    spec = importlib.util.spec_from_file_location(f'migration_{migration.version:04d}', migration.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, 'SQL', ''), getattr(module, 'upgrade', None), getattr(module, 'BACKFILL', None)
+
+
+def split_sql(script):
+    """Split a script into statements (trigger bodies included) for execute()."""
+    statements, buf = [], ''
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            statements.append(buf.strip())
+            buf = ''
+    if any(l.strip() and not l.strip().startswith('--') for l in buf.splitlines()):
+        statements.append(buf.strip())  # incomplete: let SQLite report the error
+    return statements
+
+
+def execute_script(conn, script):
+    """Run a multi-statement script inside the caller's transaction (unlike executescript)."""
+    for statement in split_sql(script):
+        conn.execute(statement)
+
+
+def stamped_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _connect(db_path):
+    from db import apply_pragmas
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    apply_pragmas(conn)
+    return conn
+
+
+def _ensure_tables(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    execute_script(conn, SQL_TABLES)
+    conn.execute('COMMIT')
+
+
+def applied_versions(conn):
+    return {r[0] for r in conn.execute('SELECT version FROM schema_migrations')}
+
+
+def migrate(db_path, target=None, out=None):
+    """Apply pending schema migrations up to ``target``; returns the versions applied."""
+    out = out or sys.stdout
+    conn = _connect(db_path)
+    try:
+        _ensure_tables(conn)
+        done = applied_versions(conn)
+        applied = []
+        for migration in discover():
+            if migration.version in done or (target is not None and migration.version > target):
+                continue
+            sql, upgrade, backfill = load(migration)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                execute_script(conn, sql)
+                if upgrade:
+                    upgrade(conn)
+                conn.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)',
+                             (migration.version, migration.name))
+                if backfill:
+                    conn.execute('INSERT OR IGNORE INTO migration_backfills (name) VALUES (?)', (_backfill_name(migration),))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            applied.append(migration.version)
+            print(f'Applied migration {migration.version:04d} {migration.name}', file=out)
+        return applied
+    finally:
+        conn.close()
+
+
+def _backfill_name(migration):
+    return f'{migration.version:04d}_{migration.name}'
+
+
+def pending_backfills(conn):
+    """(name, Backfill) for every recorded backfill that has not finished."""
+    names = {r[0] for r in conn.execute('SELECT name FROM migration_backfills WHERE done = 0')}
+    pending = []
+    for migration in discover():
+        if _backfill_name(migration) in names:
+            pending.append((_backfill_name(migration), load(migration)[2]))
+    return pending
+
+
+def run_backfill(conn, name, backfill, batch_size=BATCH_SIZE, pause=PAUSE, progress=None):
+    """Run one backfill from its checkpoint to the end; returns rows changed."""
+    state = conn.execute('SELECT next_key, max_key, rows FROM migration_backfills WHERE name = ?', (name,)).fetchone()
+    next_key, max_key, rows = state
+    if max_key is None:
+        # rows added after this point are written by code that already follows the new schema
+        max_key = conn.execute(f'SELECT COALESCE(MAX({backfill.key}), 0) FROM {backfill.table}').fetchone()[0]
+        conn.execute('UPDATE migration_backfills SET max_key = ? WHERE name = ?', (max_key, name))
+    while next_key <= max_key:
+        hi = next_key + batch_size
+        start = time.perf_counter()
+        before = conn.total_changes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in backfill.statements:
+                conn.execute(statement, {'lo': next_key, 'hi': hi})
+            changed = conn.total_changes - before
+            conn.execute('UPDATE migration_backfills SET next_key = ?, rows = rows + ?, updated_at = CURRENT_TIMESTAMP '
+                         'WHERE name = ?', (hi, changed, name))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        next_key, rows = hi, rows + changed
+        if progress:
+            progress(name, min(next_key, max_key + 1), max_key, rows)
+        # keep each write transaction short: shrink slow batches, grow fast ones
+        if elapsed_ms > TARGET_BATCH_MS:
+            batch_size = max(MIN_BATCH, batch_size // 2)
+        elif elapsed_ms < TARGET_BATCH_MS / 4:
+            batch_size = min(MAX_BATCH, batch_size * 2)
+        if pause:
+            time.sleep(pause)
+    conn.execute('UPDATE migration_backfills SET done = 1, updated_at = CURRENT_TIMESTAMP WHERE name = ?', (name,))
+    return rows
+
+
+def run_backfills(db_path, batch_size=BATCH_SIZE, pause=PAUSE, progress=None):
+    """Run every pending backfill; returns {name: rows changed}."""
+    conn = _connect(db_path)
+    try:
+        _ensure_tables(conn)
+        return {name: run_backfill(conn, name, backfill, batch_size, pause, progress)
+                for name, backfill in pending_backfills(conn)}
+    finally:
+        conn.close()
+
+
+def stamp(db_path):
+    """Record in user_version that all migrations and backfills are done."""
+    conn = _connect(db_path)
+    try:
+        if set(m.version for m in discover()) <= applied_versions(conn) and not pending_backfills(conn):
+            conn.execute(f'PRAGMA user_version = {latest_version()}')
+            return True
+        return False
+    finally:
+        conn.close()
+
+
+def apply(db_path, out=None, pause=0):
+    """Migrate ``db_path`` fully (schema, then backfills) and stamp it."""
+    migrate(db_path, out=out)
+    run_backfills(db_path, pause=pause)
+    stamp(db_path)
+
+
+def status(db_path):
+    """(applied migrations, pending migration files, backfill rows) for ``cli.py migrate --status``."""
+    conn = _connect(db_path)
+    try:
+        _ensure_tables(conn)
+        applied = conn.execute('SELECT version, name, applied_at FROM schema_migrations ORDER BY version').fetchall()
+        done = {r[0] for r in applied}
+        pending = [m for m in discover() if m.version not in done]
+        backfills = conn.execute('SELECT name, next_key, max_key, rows, done, updated_at FROM migration_backfills ORDER BY name').fetchall()
+        return applied, pending, backfills, stamped_version(conn)
+    finally:
+        conn.close()
+
+
+def ensure(db_path, background_backfills=False):
+    """Bring an initialized database up to date; True if anything had to run.
+
+    Schema migrations run inline. Backfills run inline too, or on a daemon
+    thread with ``background_backfills`` so the web app can start serving.
+    """
+    db_path = Path(db_path)
+    if not db_path.exists():
+        return False
+    conn = sqlite3.connect(db_path)
+    try:
+        if stamped_version(conn) >= latest_version():
+            return False
+        initialized = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients'").fetchone()
+    finally:
+        conn.close()
+    if not initialized:
+        return False
+    migrate(db_path, out=sys.stderr)
+
+    def finish():
+        run_backfills(db_path)
+        stamp(db_path)
+
+    if background_backfills:
+        threading.Thread(target=finish, name='db-backfill', daemon=True).start()
+    else:
+        finish()
+    return True
@@ -1,17 +1,17 @@
-import sqlite3
 from pathlib import Path
 from datetime import datetime, timedelta
+import argparse
 import random
 
+import db
+from clinic_time import days_ago
+
 HERE = Path(__file__).parent
 DB_PATH = HERE / 'hospital.db'
 
 
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA foreign_keys = ON;')
-    return conn
+    return db.connect(DB_PATH)
 
 
 def ensure_schema():
@@ -22,9 +22,9 @@ def ensure_schema():
 
 
 def apply_migration():
-    # ensure trigger exists
-    from migrate_db import apply_migration as mapply
-    mapply()
+    # ensure trigger, secondary indexes, billing summary and table versions exist
+    import schema_version
+    schema_version.apply(DB_PATH)
 
 
 def seed_departments(conn):
@@ -148,10 +148,12 @@ def seed_appointments_and_visits(conn):
 
 def seed_prescriptions_and_adjust_bills(conn, visit_ids):
     cur = conn.cursor()
-    # get med ids
-    cur.execute('SELECT med_id FROM medications')
-    meds = [r['med_id'] for r in cur.fetchall()]
+    # lookup tables up front instead of one query per prescription / visit
+    med_names = {r['med_id']: r['name'] for r in cur.execute('SELECT med_id, name FROM medications')}
+    meds = list(med_names)
+    bill_for_visit = {r['visit_id']: r['bill_id'] for r in cur.execute('SELECT visit_id, bill_id FROM bills WHERE visit_id IS NOT NULL')}
 
+    prescriptions, overdue_updates, paid_updates = [], [], []
     overdue_count = 0
     for vid, visit_dt in visit_ids:
         # Attach 0-2 prescriptions
@@ -159,35 +161,31 @@ def seed_prescriptions_and_adjust_bills(conn, visit_ids):
             num_rx = random.choice([1,1,2])
             for _ in range(num_rx):
                 med = random.choice(meds)
-                med_name = None
-                cur.execute('SELECT name FROM medications WHERE med_id = ?', (med,))
-                row = cur.fetchone()
-                if row:
-                    med_name = row['name']
+                med_name = med_names.get(med)
                 dosage = random.choice(['500 mg','10 mg','5 mg','1 tablet'])
                 frequency = random.choice(['once daily','twice daily','three times daily'])
                 duration = random.choice(['5 days','7 days','10 days','30 days'])
-                cur.execute('INSERT INTO prescriptions (visit_id, med_id, medication, dosage, frequency, duration) VALUES (?, ?, ?, ?, ?, ?)',
-                            (vid, med, med_name, dosage, frequency, duration))
+                prescriptions.append((vid, med, med_name, dosage, frequency, duration))
 
         # The bill for this visit was auto-created by trigger; update some bills to be old/unpaid
-        cur.execute('SELECT bill_id FROM bills WHERE visit_id = ?', (vid,))
-        b = cur.fetchone()
-        if b:
-            bill_id = b['bill_id']
+        bill_id = bill_for_visit.get(vid)
+        if bill_id:
             # If visit date more than 30 days ago, make bill overdue (issued_at = visit_dt)
             if (datetime.now() - visit_dt).days > 30:
                 issued_at = visit_dt - timedelta(days=1)
                 issued_at_str = issued_at.strftime('%Y-%m-%d %H:%M:%S')
-                cur.execute('UPDATE bills SET issued_at = ?, status = ? WHERE bill_id = ?', (issued_at_str, 'unpaid', bill_id))
+                overdue_updates.append((issued_at_str, 'unpaid', bill_id))
                 overdue_count += 1
             else:
                 # Randomly mark some as paid
                 if random.random() < 0.4:
                     paid_at = datetime.now() - timedelta(days=random.randint(0,5))
                     paid_at_str = paid_at.strftime('%Y-%m-%d %H:%M:%S')
-                    cur.execute('UPDATE bills SET status = ?, paid_at = ? WHERE bill_id = ?', ('paid', paid_at_str, bill_id))
+                    paid_updates.append(('paid', paid_at_str, bill_id))
 
+    cur.executemany('INSERT INTO prescriptions (visit_id, med_id, medication, dosage, frequency, duration) VALUES (?, ?, ?, ?, ?, ?)', prescriptions)
+    cur.executemany('UPDATE bills SET issued_at = ?, status = ? WHERE bill_id = ?', overdue_updates)
+    cur.executemany('UPDATE bills SET status = ?, paid_at = ? WHERE bill_id = ?', paid_updates)
     conn.commit()
     return overdue_count
 
@@ -208,7 +206,7 @@ def make_report(conn, out_path=HERE / 'seed_report.txt'):
     bres = cur.fetchone()
     bills = bres['cnt'] or 0
     total_billed = bres['total'] or 0.0
-    cur.execute("SELECT COUNT(*) as cnt, SUM(amount) as total FROM bills WHERE status='unpaid' AND date(issued_at) <= date('now','-30 days')")
+    cur.execute("SELECT COUNT(*) as cnt, SUM(amount) as total FROM bills WHERE status='unpaid' AND issued_at < ?", (days_ago(30),))
     overdue = cur.fetchone()
     overdue_count = overdue['cnt'] or 0
     overdue_amount = overdue['total'] or 0.0
@@ -229,18 +227,223 @@ def make_report(conn, out_path=HERE / 'seed_report.txt'):
 
     print(out)
 
+# ---------------------------------------------------------------------------
+# Scaled synthetic data for capacity testing: python seed_data.py --scale 100k
+# ---------------------------------------------------------------------------
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+SHARD_SIZE = 10_000          # patients generated per task (and per executemany batch)
+HISTORY_DAYS = 730           # appointments reach this far back ...
+FUTURE_DAYS = 30             # ... and this far ahead
+PATIENTS_PER_DOCTOR = 400
+
+FIRST_NAMES = ['Arjun','Karan','Sana','Manish','Lakshmi','Rakesh','Sunita','Deepak','Pooja','Ankit','Priyanka','Siddharth','Divya','Kavita','Rohit','Meera','Ananya','Vishal','Shreya','Rajesh','Madhuri','Aakash','Bhavna','Harish','Geeta','Amit','Priya','Rahul','Sneha','Vikram','Neha','Suresh','Anjali','Isha']
+LAST_NAMES = ['Shah','Patel','Gupta','Rao','Iyer','Bose','Chopra','Desai','Kapoor','Jain','Nair','Menon','Saxena','Joshi','Malhotra','Trivedi','Nath','Khan','Kohli','Singh','Verma','Bhandari','Goyal','Kumar','Das','Sharma','Reddy','Ganesan','Kaur','Mehta']
+SPECIALTIES = [('General Physician', 1), ('Pediatrician', 2), ('Cardiologist', 3), ('Orthopedic', 4), ('Gynecologist', 5)]
+REASONS = ['Routine checkup','Fever','Cough','Follow-up','Prescription refill','Pain']
+DIAGNOSES = ['Hypertension','Diabetes','Viral fever','Upper respiratory infection','Back pain','Gastritis']
+FEES = [50.0, 50.0, 75.0, 100.0, 150.0, 250.0]
+
+_shard_context = {}
+
+
+def _init_shard_worker(context):
+    _shard_context.update(context)
+
+
+def _business_slot(rng, day):
+    """Weekday 08:00-16:45 in 15 minute slots; weekends roll to Monday."""
+    if day.weekday() >= 5:
+        day += timedelta(days=7 - day.weekday())
+    return day.replace(hour=rng.randint(8, 16), minute=rng.choice((0, 15, 30, 45)))
+
+
+def generate_shard(shard):
+    """Generate one shard of patients with all their dependent rows.
+
+    Runs in worker processes, so it only uses its arguments and the context
+    set by _init_shard_worker. Patient ids are absolute; appointment/visit ids
+    are shard-local indexes that the parent renumbers on insert.
+    """
+    index, first_id, count = shard
+    ctx = _shard_context
+    rng = random.Random(ctx['seed'] * 1_000_003 + index)
+    today = ctx['today']
+    doctors, med_names = ctx['doctors'], ctx['med_names']
+    meds = sorted(med_names)
+    patients, appts, visits, rx, bills = [], [], [], [], []
+    for pid in range(first_id, first_id + count):
+        fn, ln = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        dob = today - timedelta(days=rng.randint(365, 85 * 365))
+        patients.append((pid, fn, ln, dob.date().isoformat(), rng.choice('MF'), f'9{rng.randint(100000000, 999999999)}',
+                         f'{fn.lower()}.{ln.lower()}{pid}@example.in', f'{rng.randint(1, 400)} MG Road, City',
+                         rng.choice(['Arogya Care', 'Bharat Health', 'None', 'National Insurance'])))
+        # most patients have a few appointments, some have many
+        for _ in range(rng.choices((0, 1, 2, 3, 4, 6, 10), (10, 30, 25, 15, 10, 7, 3))[0]):
+            doctor_id, dept_id = rng.choice(doctors)
+            # skewed toward recent history: more activity lately than two years ago
+            offset = int(rng.triangular(-HISTORY_DAYS, FUTURE_DAYS, 0))
+            dt = _business_slot(rng, today + timedelta(days=offset))
+            if dt >= today:
+                status = 'scheduled'
+            else:
+                status = rng.choices(('completed', 'cancelled', 'no-show'), (80, 12, 8))[0]
+            a = len(appts)
+            appts.append((a, pid, doctor_id, dept_id, dt.strftime('%Y-%m-%d %H:%M'), rng.choice(REASONS), status))
+            if status != 'completed':
+                continue
+            v = len(visits)
+            visit_dt = dt + timedelta(minutes=rng.randint(0, 45))
+            visit_str = visit_dt.strftime('%Y-%m-%d %H:%M')
+            visits.append((v, a, pid, doctor_id, visit_str, rng.choice(DIAGNOSES), 'Synthetic visit'))
+            if rng.random() < 0.8:
+                for _ in range(rng.choice((1, 1, 2))):
+                    med = rng.choice(meds)
+                    rx.append((v, med, med_names[med], rng.choice(['500 mg','10 mg','5 mg','1 tablet']),
+                               rng.choice(['once daily','twice daily','three times daily']),
+                               rng.choice(['5 days','7 days','10 days','30 days']), visit_str))
+            # older bills are more likely to have been paid; the rest age into overdue
+            age = (today - visit_dt).days
+            paid_at = None
+            if rng.random() < min(0.95, 0.3 + age / 120):
+                paid_at = min(visit_dt + timedelta(days=rng.expovariate(1 / 12)), today).strftime('%Y-%m-%d %H:%M:%S')
+            bills.append((v, pid, rng.choice(FEES), 'paid' if paid_at else 'unpaid',
+                          visit_dt.strftime('%Y-%m-%d %H:%M:%S'), paid_at))
+    return patients, appts, visits, rx, bills
+
+
+def _seed_scaled_doctors(conn, rng, count):
+    cur = conn.cursor()
+    existing = cur.execute('SELECT COUNT(*) FROM doctors').fetchone()[0]
+    rows = []
+    for i in range(existing, count):
+        fn, ln = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        specialty, dept = SPECIALTIES[i % len(SPECIALTIES)]
+        rows.append((fn, ln, specialty, f'98765{i:05d}', f'{fn.lower()}.{ln.lower()}.dr{i}@example.in', dept))
+    cur.executemany('INSERT INTO doctors (first_name, last_name, specialty, phone, email, department_id) VALUES (?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+
+
+def generate(conn, patients, seed=42, workers=1, commit_every=200_000, today=None, progress=print):
+    """Add ``patients`` synthetic patients (plus appointments, visits, prescriptions
+    and bills) to the database behind ``conn``. The same seed gives the same rows.
+
+    Shards are generated in ``workers`` processes; the parent inserts them in
+    shard order with executemany, committing every ``commit_every`` rows.
+    Triggers and secondary indexes on the bulk tables are dropped for the load
+    and recreated afterwards (bills are generated explicitly, so the
+    visit -> bill trigger must not fire); the billing summary is rebuilt and
+    the new patients are added to the search index and workload rollups once.
+    """
+    from bulk_import import drop_indexes_and_triggers, recreate
+    from migrate_billing_summary import rebuild
+
+    rng = random.Random(seed)
+    today = today or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    cur = conn.cursor()
+    if not cur.execute('SELECT COUNT(*) FROM departments').fetchone()[0]:
+        seed_departments(conn)
+    if not cur.execute('SELECT COUNT(*) FROM medications').fetchone()[0]:
+        seed_medications(conn)
+    _seed_scaled_doctors(conn, rng, max(10, patients // PATIENTS_PER_DOCTOR))
+    context = {
+        'seed': seed,
+        'today': today,
+        'doctors': [tuple(r) for r in cur.execute('SELECT doctor_id, department_id FROM doctors')],
+        'med_names': {r[0]: r[1] for r in cur.execute('SELECT med_id, name FROM medications')},
+    }
+    first_id = cur.execute('SELECT COALESCE(MAX(patient_id), 0) FROM patients').fetchone()[0] + 1
+    offsets = {t: cur.execute(f'SELECT COALESCE(MAX({k}), 0) FROM {t}').fetchone()[0]
+               for t, k in (('appointments', 'appointment_id'), ('visits', 'visit_id'))}
+    watermarks = dict(offsets)
+    shards = [(i, first_id + start, min(SHARD_SIZE, patients - start))
+              for i, start in enumerate(range(0, patients, SHARD_SIZE))]
+
+    saved = []
+    for table in ('patients', 'appointments', 'visits', 'prescriptions', 'bills'):
+        saved += drop_indexes_and_triggers(conn, table)
+    started = datetime.now()
+    totals = dict.fromkeys(('patients', 'appointments', 'visits', 'prescriptions', 'bills'), 0)
+    since_commit = 0
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers, _init_shard_worker, (context,))
+        results = pool.imap(generate_shard, shards)
+    else:
+        pool = None
+        _init_shard_worker(context)
+        results = map(generate_shard, shards)
+    try:
+        for p_rows, a_rows, v_rows, rx_rows, b_rows in results:
+            ao, vo = offsets['appointments'], offsets['visits']
+            cur.executemany('INSERT INTO patients (patient_id, first_name, last_name, dob, gender, phone, email, address, insurance) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', p_rows)
+            cur.executemany('INSERT INTO appointments (appointment_id, patient_id, doctor_id, department_id, appointment_datetime, reason, status) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)', [(r[0] + ao + 1,) + r[1:] for r in a_rows])
+            cur.executemany('INSERT INTO visits (visit_id, appointment_id, patient_id, doctor_id, visit_date, diagnosis, notes) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)', [(r[0] + vo + 1, r[1] + ao + 1) + r[2:] for r in v_rows])
+            cur.executemany('INSERT INTO prescriptions (visit_id, med_id, medication, dosage, frequency, duration, prescribed_at) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)', [(r[0] + vo + 1,) + r[1:] for r in rx_rows])
+            cur.executemany('INSERT INTO bills (visit_id, patient_id, amount, status, issued_at, paid_at) '
+                            'VALUES (?, ?, ?, ?, ?, ?)', [(r[0] + vo + 1,) + r[1:] for r in b_rows])
+            offsets['appointments'] += len(a_rows)
+            offsets['visits'] += len(v_rows)
+            for table, rows in zip(totals, (p_rows, a_rows, v_rows, rx_rows, b_rows)):
+                totals[table] += len(rows)
+            since_commit += len(p_rows) + len(a_rows) + len(v_rows) + len(rx_rows) + len(b_rows)
+            if since_commit >= commit_every:
+                conn.commit()
+                since_commit = 0
+            if progress:
+                elapsed = (datetime.now() - started).total_seconds()
+                progress(f"  {totals['patients']}/{patients} patients, {sum(totals.values())} rows "
+                         f"({sum(totals.values()) / max(elapsed, 1e-9):.0f} rows/s)")
+        conn.commit()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        recreate(conn, saved)
+        conn.commit()
+    rebuild(conn)
+    if any(name == 'trg_patients_fts_insert' for _, name, _ in saved):
+        from patient_search import index_new_patients
+        index_new_patients(conn, first_id - 1)
+        conn.commit()
+    if any(name == 'trg_rollup_appointments_insert' for _, name, _ in saved):
+        from rollups import add_new
+        for table, watermark in watermarks.items():
+            add_new(conn, table, watermark)
+        conn.commit()
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'table_versions'").fetchone():
+        cur.executemany('UPDATE table_versions SET version = version + 1 WHERE table_name = ?',
+                        [(t,) for t in totals] + [('doctors',)])
+        conn.commit()
+    return totals
+
 
 def main():
+    parser = argparse.ArgumentParser(description='Seed hospital.db with mock data')
+    parser.add_argument('--scale', choices=sorted(SCALES, key=SCALES.get), help='Synthetic data size, e.g. 100k patients')
+    parser.add_argument('--patients', type=int, help='Exact number of synthetic patients (overrides --scale)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed gives the same data')
+    parser.add_argument('--workers', type=int, default=1, help='Processes generating shards in parallel')
+    args = parser.parse_args()
+
     print('Seeding database with mock hospital data...')
     ensure_schema()
     apply_migration()
     conn = get_conn()
-    seed_departments(conn)
-    seed_medications(conn)
-    seed_doctors(conn)
-    seed_patients(conn)
-    visit_ids = seed_appointments_and_visits(conn)
-    overdue_count = seed_prescriptions_and_adjust_bills(conn, visit_ids)
+    count = args.patients or SCALES.get(args.scale)
+    if count:
+        generate(conn, count, seed=args.seed, workers=args.workers)
+    else:
+        seed_departments(conn)
+        seed_medications(conn)
+        seed_doctors(conn)
+        seed_patients(conn)
+        visit_ids = seed_appointments_and_visits(conn)
+        overdue_count = seed_prescriptions_and_adjust_bills(conn, visit_ids)
     make_report(conn)
     conn.close()
     print('Seeding complete.')
@@ -0,0 +1,240 @@
+"""Read-only snapshots of the database for the reports.
+
+With ``HOSPITAL_REPORT_SNAPSHOT`` set, the report pages, exports and
+``report-*`` commands read a copy of the database made with SQLite's online
+backup API instead of the live file:
+
+- ``file``: a copy next to the database (``hospital_snapshot.db``, or
+  ``HOSPITAL_SNAPSHOT_PATH``), written to a temporary file and renamed into
+  place, so readers never see a half-written copy and the CLI and every app
+  worker share one snapshot;
+- ``memory``: a shared in-memory copy per app process (the CLI reads the
+  live database in this mode: copying it for one report gains nothing).
+
+The copy is taken in a single backup step. In WAL mode that is an ordinary
+read transaction on the live database, so the front desk's writes are
+never blocked; the reports' long aggregations then run against the copy and
+no longer hold a read transaction open on the live file, which kept WAL
+checkpoints from completing.
+
+A snapshot older than ``HOSPITAL_SNAPSHOT_REFRESH`` seconds (default 60) is
+still served while a fresh one is taken in the background; one older than
+``HOSPITAL_SNAPSHOT_MAX_AGE`` (default 300) is refreshed before it is read.
+Unset or ``off`` keeps the reports on the live database.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import db
+
+MODE = os.environ.get('HOSPITAL_REPORT_SNAPSHOT', 'off').lower()
+REFRESH = float(os.environ.get('HOSPITAL_SNAPSHOT_REFRESH', '60'))
+MAX_AGE = float(os.environ.get('HOSPITAL_SNAPSHOT_MAX_AGE', '300'))
+MODES = ('off', 'file', 'memory')
+
+# shown on the report pages; taken_at is a Unix time
+SnapshotInfo = namedtuple('SnapshotInfo', 'mode taken_at age refresh max_age seconds')
+
+_memory_names = itertools.count(1)
+
+
+def default_path(db_path):
+    db_path = Path(db_path)
+    return Path(os.environ.get('HOSPITAL_SNAPSHOT_PATH') or
+                db_path.with_name(db_path.stem + '_snapshot' + db_path.suffix))
+
+
+class SnapshotPool(db.ConnectionPool):
+    """Pool of read-only connections to one snapshot; retired with ``close_all(final=True)``."""
+
+    def __init__(self, uri, size=db.POOL_SIZE):
+        self.uri = uri
+        super().__init__(uri, size=size)
+
+    def _new_connection(self):
+        conn = sqlite3.connect(self.uri, uri=True, factory=db.PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA query_only = ON')
+        conn.execute(f"PRAGMA cache_size = {db.STORAGE_PROFILES['tuned']['cache_size']}")
+        conn.pool = self
+        self._created += 1
+        return conn
+
+
+def _copy(source_path, target):
+    """Back ``source_path`` up into the open connection ``target`` in one step; returns seconds."""
+    started = time.perf_counter()
+    source = sqlite3.connect(source_path, timeout=db.STORAGE_PROFILES['tuned']['busy_timeout'] / 1000)
+    try:
+        # one step = one read transaction: a consistent copy that writers never wait for
+        source.backup(target)
+    finally:
+        source.close()
+    return time.perf_counter() - started
+
+
+class Snapshot:
+    """The current report snapshot of one database, refreshed as it ages."""
+
+    def __init__(self, db_path, mode=MODE, path=None, refresh=REFRESH, max_age=MAX_AGE):
+        if mode not in MODES:
+            raise ValueError(f'HOSPITAL_REPORT_SNAPSHOT must be one of {", ".join(MODES)}, not {mode!r}')
+        self.db_path = Path(db_path)
+        self.mode = mode
+        self.path = Path(path) if path else default_path(db_path)
+        self.refresh = refresh
+        self.max_age = max(max_age, refresh)
+        self._lock = threading.Lock()          # guards the fields below
+        self._refresh_lock = threading.Lock()  # one copy at a time
+        self._pool = None
+        self._taken_at = None
+        self._seconds = None
+        self._file_key = None                  # (inode, mtime) of the file the pool reads
+        self._keeper = None                    # keeps a memory snapshot alive
+        self._stats = {'refreshes': 0, 'background_refreshes': 0, 'failures': 0}
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    # --- taking snapshots ---
+
+    def take(self, if_older_than=None):
+        """Copy the live database and switch readers over to the copy.
+
+        With ``if_older_than`` (seconds) nothing happens if a snapshot taken
+        meanwhile, e.g. by a refresh this call waited for, is recent enough.
+        """
+        with self._refresh_lock:
+            age = self.age()
+            if if_older_than is not None and age is not None and age <= if_older_than:
+                return
+            taken_at = time.time()
+            if self.mode == 'memory':
+                uri = f'file:hospital_snapshot_{os.getpid()}_{next(_memory_names)}?mode=memory&cache=shared'
+                keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                seconds = _copy(self.db_path, keeper)
+                self._install(SnapshotPool(uri), taken_at, seconds, keeper=keeper)
+            else:
+                seconds = write_file(self.db_path, self.path, taken_at)
+                self._open_file()
+            with self._lock:
+                self._stats['refreshes'] += 1
+
+    def _install(self, pool, taken_at, seconds, keeper=None, file_key=None):
+        with self._lock:
+            old_pool, old_keeper = self._pool, self._keeper
+            self._pool, self._keeper, self._file_key = pool, keeper, file_key
+            self._taken_at, self._seconds = taken_at, seconds
+        if old_pool is not None:
+            old_pool.close_all(final=True)  # connections still reading finish on the old copy
+        if old_keeper is not None:
+            old_keeper.close()
+
+    def _open_file(self):
+        """Point the pool at the snapshot file if it is new (e.g. refreshed by another process)."""
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return False
+        key = (st.st_ino, st.st_mtime_ns)
+        if key == self._file_key:
+            return True
+        # the file is replaced, never modified, so readers can skip locking
+        pool = SnapshotPool(f'file:{self.path.resolve()}?mode=ro&immutable=1')
+        conn = pool.acquire()
+        try:
+            taken_at, seconds = conn.execute('SELECT taken_at, seconds FROM snapshot_info').fetchone()
+        except sqlite3.DatabaseError:
+            taken_at, seconds = st.st_mtime, None
+        finally:
+            conn.close()
+        self._install(pool, taken_at, seconds, file_key=key)
+        return True
+
+    def _refresh_in_background(self):
+        if not self._refresh_lock.locked():
+            with self._lock:
+                self._stats['background_refreshes'] += 1
+            threading.Thread(target=self._safe_take, name='snapshot-refresh', daemon=True).start()
+
+    def _safe_take(self):
+        try:
+            self.take(if_older_than=self.refresh)
+        except (sqlite3.Error, OSError):
+            with self._lock:
+                self._stats['failures'] += 1
+
+    # --- reading ---
+
+    def age(self):
+        return None if self._taken_at is None else time.time() - self._taken_at
+
+    def connect(self, background=True):
+        """Check out a connection to a snapshot no older than ``max_age``.
+
+        Past ``refresh`` the current snapshot is still returned while a new one
+        is taken in the background; with ``background=False`` (the CLI, which
+        exits before a background copy would finish) it is refreshed first.
+        """
+        if self.mode == 'file':
+            self._open_file()
+        age = self.age()
+        if age is None or age > self.max_age:
+            self.take(if_older_than=self.max_age)
+        elif age > self.refresh and not background:
+            self.take(if_older_than=self.refresh)
+        elif age > self.refresh:
+            self._refresh_in_background()
+        return self._pool.acquire()
+
+    def info(self):
+        age = self.age()
+        return SnapshotInfo(self.mode, self._taken_at, None if age is None else round(age, 1),
+                            self.refresh, self.max_age, None if self._seconds is None else round(self._seconds, 3))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(self.info()._asdict(), path=str(self.path) if self.mode == 'file' else None)
+        return stats
+
+
+def write_file(db_path, path, taken_at=None):
+    """Write a snapshot of ``db_path`` to ``path`` via a temporary file; returns seconds taken."""
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    for stale in (tmp, tmp.with_name(tmp.name + '-journal')):
+        if stale.exists():
+            stale.unlink()
+    target = sqlite3.connect(tmp)
+    try:
+        seconds = _copy(db_path, target)
+        # a rollback-journal file with no -wal/-shm companions, so it can be renamed safely
+        target.execute('PRAGMA journal_mode = DELETE')
+        target.execute('CREATE TABLE snapshot_info (taken_at REAL NOT NULL, seconds REAL NOT NULL)')
+        target.execute('INSERT INTO snapshot_info VALUES (?, ?)', (taken_at or time.time(), seconds))
+        target.commit()
+    finally:
+        target.close()
+    os.replace(tmp, path)
+    return seconds
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(db_path):
+    """Return the process-wide report snapshot for ``db_path``."""
+    key = str(Path(db_path).resolve())
+    with _snapshots_lock:
+        snap = _snapshots.get(key)
+        if snap is None:
+            snap = _snapshots[key] = Snapshot(db_path)
+        return snap